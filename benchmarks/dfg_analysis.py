@@ -0,0 +1,66 @@
+'''
+    Speed benchmark of the pre-scheduling analysis: the pure-Python topological pass
+    against the level-by-level NumPy pass of DFGAnalysis.
+
+    usage: python benchmarks/dfg_analysis.py [number of operators]
+'''
+import sys
+import time
+import random
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.dfg_creator import GraphBuilder
+from src.dfg_analysis import DFGAnalysis, np
+from src.expression_parser import parse_deep_expression
+
+
+def balanced_expression(num_inputs : int, num_names : int = 64) -> str:
+    '''
+        A wide, balanced expression tree; the number of DFG levels grows with log2(num_inputs).
+    '''
+    random.seed(0)
+    terms = [f"i{random.randrange(num_names)}" for _ in range(num_inputs)]
+    while len(terms) > 1:
+        paired = [f"({a} {random.choice(['+', '-', '*', '&'])} {b})" for a, b in zip(terms[::2], terms[1::2])]
+        terms = paired + (terms[-1:] if len(terms) % 2 else [])
+    return terms[0]
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def main():
+    if np is None:
+        print("numpy is not installed, only the pure-Python analysis is available")
+        return
+
+    num_operators = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    root = GraphBuilder().build(parse_deep_expression(balanced_expression(num_operators + 1)))
+
+    python_time = min(timed(lambda: DFGAnalysis(root, vectorized=False)) for _ in range(3))
+    numpy_time = min(timed(lambda: DFGAnalysis(root, vectorized=True)) for _ in range(3))
+
+    # the level passes alone, without the topological sort both variants share
+    analysis = DFGAnalysis(root, vectorized=False)
+
+    def python_pass():
+        analysis.asap = [0] * analysis.num_ids
+        analysis.priorities = [0] * analysis.num_ids
+        analysis._analyze()
+
+    python_pass_time = min(timed(python_pass) for _ in range(3))
+    numpy_pass_time = min(timed(analysis._analyze_vectorized) for _ in range(3))
+
+    print(f"operators:            {num_operators}")
+    print(f"                      {'python':>10} {'numpy':>10} {'speedup':>8}")
+    print(f"DFGAnalysis():        {python_time * 1000:8.1f}ms {numpy_time * 1000:8.1f}ms {python_time / numpy_time:7.1f}x")
+    print(f"level passes only:    {python_pass_time * 1000:8.1f}ms {numpy_pass_time * 1000:8.1f}ms {python_pass_time / numpy_pass_time:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
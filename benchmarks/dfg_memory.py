@@ -0,0 +1,52 @@
+'''
+    Memory benchmark of the two DFG representations: the object graph built by GraphBuilder
+    and the column-oriented DFGStore.
+
+    usage: python benchmarks/dfg_memory.py [number of operators]
+'''
+import gc
+import sys
+import random
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.dfg_creator import GraphBuilder
+from src.dfg_store import DFGStore
+from src.expression_parser import parse_deep_expression
+
+
+def random_expression(num_operators : int, num_inputs : int = 64) -> str:
+    random.seed(0)
+    terms = [f"i{random.randrange(num_inputs)}" for _ in range(num_operators + 1)]
+    ops = [random.choice(["+", "-", "*", "&", "|", "<<"]) for _ in range(num_operators)]
+    return " ".join(term + " " + op for term, op in zip(terms, ops)) + " " + terms[-1]
+
+
+def measure(build) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def main():
+    num_operators = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    tree = parse_deep_expression(random_expression(num_operators))
+
+    builder = GraphBuilder()
+    root, object_bytes = measure(lambda: builder.build(tree))
+    store, store_bytes = measure(lambda: DFGStore.from_dfg(root))
+
+    print(f"operators:     {num_operators}")
+    print(f"object graph:  {object_bytes / 2**20:8.2f} MiB  ({object_bytes / num_operators:6.1f} B/operator)")
+    print(f"DFGStore:      {store_bytes / 2**20:8.2f} MiB  ({store_bytes / num_operators:6.1f} B/operator)")
+    print(f"ratio:         {object_bytes / store_bytes:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+'''
+    Speed benchmark of the datapath simulator: random input vectors checked per second against the Expression,
+    one vector at a time on Python ints against whole batches on NumPy arrays.
+
+    usage: python benchmarks/simulator.py [number of operators] [number of vectors]
+'''
+import sys
+import random
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.dfg_creator import GraphBuilder
+from src.scheduler import MinLatencyScheduler
+from src.code_generator import VerilogGenerator
+from src.simulator import verify_design, np
+from src.expression_parser import parse_deep_expression
+
+
+def balanced_expression(num_inputs : int, num_names : int = 16) -> str:
+    '''
+        A balanced expression tree over num_names inputs.
+    '''
+    random.seed(0)
+    terms = [f"i{random.randrange(num_names)}" for _ in range(num_inputs)]
+    while len(terms) > 1:
+        paired = [f"({a} {random.choice(['+', '-', '*', '&', '^'])} {b})" for a, b in zip(terms[::2], terms[1::2])]
+        terms = paired + (terms[-1:] if len(terms) % 2 else [])
+    return terms[0]
+
+
+def main():
+    num_operators = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    num_vectors = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+
+    tree = parse_deep_expression(balanced_expression(num_operators + 1))
+    scheduler = MinLatencyScheduler(dfg_root=GraphBuilder().build(tree), numof_resources={"ALU": 4, "mult": 2, "logic": 2},
+                                    latencies={"mult": 2}, intervals={"mult": 1})
+    scheduler.schedule()
+    generator = VerilogGenerator(scheduler.get_scheduling_info(), intervals={"mult": 1})
+
+    # the Python path checks every vector on its own, a sample is enough for its speed
+    python = verify_design(generator, tree, count=max(1, num_vectors // 100), vectorized=False)
+    print(f"operators:            {num_operators}")
+    print(f"cycles:               {generator.index.max_time}")
+    print(f"python:               {python['vectors_per_second']:12.0f} vectors/s ({python['failures']} failing)")
+
+    if np is None:
+        print("numpy is not installed, only the pure-Python simulator is available")
+        return
+
+    vectorized = verify_design(generator, tree, count=num_vectors, vectorized=True)
+    print(f"numpy:                {vectorized['vectors_per_second']:12.0f} vectors/s ({vectorized['failures']} failing)")
+    print(f"speedup:              {vectorized['vectors_per_second'] / python['vectors_per_second']:11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
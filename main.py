@@ -1,14 +1,44 @@
+import os
 import ast
 import sys
+import glob
 import json
+import time
+import argparse
+import traceback
 from pathlib import Path
-from src.dfg_creator import GraphBuilder
-from src.graph_visualizer import expression_to_graph, visualize_graph, visualize_scheduled_graph,visualize_scheduled_graph_ranked 
-from src.scheduler import MinLatencyScheduler, MinResourceScheduler, ScheduledNodeInfo
-from src.code_generator import generate_verilog
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from src.dfg_creator import GraphBuilder, OutputNode, outputs_of
+from src.graph_visualizer import expression_to_graph, visualize_graph, visualize_scheduled_graph,visualize_scheduled_graph_ranked, GraphRenderer, RENDER_MODES
+from src.scheduler import ForceDirectedScheduler, MinLatencyScheduler, MinResourceScheduler, ModuloScheduler, ScheduledNodeInfo, chained_latencies
+from src.schedule_index import ScheduleIndex
+from src.exact_scheduler import BranchAndBoundScheduler
+from src.dfg_analysis import DFGAnalysis
+from src.dfg_optimizer import DFGOptimizer
+from src.dfg_store import DFGStore
+from src.design_space import DesignSpaceExplorer
+from src.dot_writer import write_scheduled_graph
+from src.code_generator import generate_verilog, VerilogGenerator
+from src.simulator import verify_design
+from src.testbench import write_testbench
+from src.verilog_runner import run_testbenches, simulator_version, require_tools
+from src.binding import FUBinder
+from src.register_allocation import register_chains
+from src.result_cache import ResultCache, tool_version, written_files, DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
 
 MinResourceAlgorithm = "MinResourceLatencyConstrained"
 MinlatencyAlgorithm = "MinLatencyResourceContrained"
+ForceDirectedAlgorithm = "ForceDirectedLatencyConstrained"
+OptimalLatencyAlgorithm = "OptimalLatencyResourceConstrained"
+OptimalResourceAlgorithm = "OptimalResourceLatencyConstrained"
+DesignSpaceAlgorithm = "DesignSpaceExploration"
+ModuloAlgorithm = "ModuloScheduleResourceConstrained"
+
+# from this many scheduled nodes on, the scheduled graphs are streamed to disk instead of built with graphviz.Digraph
+STREAMING_DOT_THRESHOLD = 5000
+
+# files written while parsing, the rest of the folder depends on the whole config
+DFG_ARTIFACTS = ("ast_output.", "pics/DFG-")
 
 def load_input(filename: str) -> dict:
     with open(filename, "r") as file:
@@ -25,8 +55,9 @@ def ast_to_dict(node):
     else:
         return node
 
-def build_dfg(expression: str, folder_path : str):
+def build_dfg(expression, folder_path : str, renderer : GraphRenderer = None, outputs : list[str] = None):
     
+    # a list of (name, AST) for a block of assignments, see expression_to_graph
     ast_root = expression_to_graph(expression)
     # root
     # print(ast_root)          # BinOp
@@ -41,37 +72,99 @@ def build_dfg(expression: str, folder_path : str):
     # and recursively...
     # ast_root.right.left  , ast_root.right.right , ast_root.right.op , etc.
     
-    with open(folder_path + "/ast_output.log", "w") as f:
-        f.write(ast.dump(ast_root, indent=4))
-    
-    ast_dict = ast_to_dict(ast_root)
-    with open(folder_path + "/ast_output.json", "w") as f:
-        json.dump(ast_dict, f, indent=4)
+    try:
+        if isinstance(ast_root, list):
+            ast_log = "\n".join(f"{name} =\n{ast.dump(tree, indent=4)}" for name, tree in ast_root)
+            ast_json = json.dumps({name: ast_to_dict(tree) for name, tree in ast_root}, indent=4)
+        else:
+            ast_log = ast.dump(ast_root, indent=4)
+            ast_json = json.dumps(ast_to_dict(ast_root), indent=4)
+    except RecursionError:
+        # the DFG is built iteratively, only these debug dumps are limited by the AST depth
+        print("AST too deep to dump, skipping ast_output.log and ast_output.json")
+    else:
+        with open(folder_path + "/ast_output.log", "w") as f:
+            f.write(ast_log)
+        
+        with open(folder_path + "/ast_output.json", "w") as f:
+            f.write(ast_json)
     
+    if renderer is None:
+        renderer = GraphRenderer()
         
-    dotv1 = visualize_graph(ast_root,version = 1)
-    dotv1.attr(label="", labelloc='t', fontsize='17')  
-    dotv1.render(folder_path + "/pics/DFG-V1", format='png', view=False, cleanup=True)
+    if renderer.enabled:
+        dotv1 = visualize_graph(ast_root,version = 1)
+        dotv1.attr(label="", labelloc='t', fontsize='17')  
+        renderer.render(dotv1, folder_path + "/pics/DFG-V1")
 
-    dotv2 = visualize_graph(ast_root,version = 2)
-    dotv2.attr(label="", labelloc='t', fontsize='17')  
-    dotv2.render(folder_path + "/pics/DFG-V2", format='png', view=False, cleanup=True)
+        dotv2 = visualize_graph(ast_root,version = 2)
+        dotv2.attr(label="", labelloc='t', fontsize='17')  
+        renderer.render(dotv2, folder_path + "/pics/DFG-V2")
 
-    print("Visulization Done")
+        print("Visulization Done")
     
     builder = GraphBuilder()
     
     print("Build Done")
+    if isinstance(ast_root, list):
+        return builder.build_outputs(ast_root, outputs=outputs)
     return builder.build(ast_root)
 
 
-def schedule_dfg(dfg_root, algorithm : str, config : dict, folder_path : str) -> list:
+def optimize_dfg(dfg_root):
+    
+    optimizer = DFGOptimizer()
+    dfg_root = optimizer.optimize(dfg_root)
+    
+    print(f"Optimization Done ({optimizer.merged} common subexpressions merged, {optimizer.folded} operators folded)")
+    return dfg_root
+
+
+def bind_resources(schedule_info : list[ScheduledNodeInfo], config : dict) -> list[ScheduledNodeInfo]:
+    
+    binder = FUBinder(intervals=config.get("II", {}))
+    schedule_info = binder.bind(schedule_info)
+    
+    print(f"Binding Done (mux inputs {binder.mux_inputs_before} -> {binder.mux_inputs_after}, {binder.swapped} operands swapped)")
+    return schedule_info
+
+
+def schedule_dfg(dfg_root, algorithm : str, config : dict):
+    
+    # cycles per operation and initiation interval of every resource type, single-cycle units by default
+    latencies = config.get("Latency", {})
+    intervals = config.get("II", {})
+    # chaining: clock period and combinational delay of every resource type in ns
+    clock_period = config.get("ClockPeriod")
+    delays = config.get("Delay", {})
+    # a type slower than the clock period takes several cycles, the schedulers derive the same latencies
+    analysis = DFGAnalysis(dfg_root, latencies=chained_latencies(latencies, clock_period, delays))
+    
+    if (algorithm not in (MinResourceAlgorithm, MinlatencyAlgorithm, ModuloAlgorithm)) and any(latency != 1 for latency in latencies.values()):
+        raise ValueError(f"{algorithm} only supports single-cycle units, remove the Latency config")
+    if (algorithm not in (MinResourceAlgorithm, MinlatencyAlgorithm)) and clock_period is not None:
+        raise ValueError(f"{algorithm} does not chain operations, remove the ClockPeriod config")
     
     if (algorithm == MinResourceAlgorithm):
-        scheduler = MinResourceScheduler(dfg_root=dfg_root, max_time=config["MaxTime"], numof_resources=None)
+        scheduler = MinResourceScheduler(dfg_root=dfg_root, max_time=config["MaxTime"], numof_resources=None, analysis=analysis,
+                                         latencies=latencies, intervals=intervals, clock_period=clock_period, delays=delays)
     
     elif (algorithm == MinlatencyAlgorithm):
-        scheduler = MinLatencyScheduler(dfg_root=dfg_root, numof_resources=config["Resources"])    
+        scheduler = MinLatencyScheduler(dfg_root=dfg_root, numof_resources=config["Resources"], analysis=analysis,
+                                        latencies=latencies, intervals=intervals, clock_period=clock_period, delays=delays)
+
+    elif (algorithm == ModuloAlgorithm):
+        scheduler = ModuloScheduler(dfg_root=dfg_root, numof_resources=config["Resources"], initiation_interval=config.get("InitiationInterval"),
+                                    analysis=analysis, latencies=latencies, intervals=intervals)
+
+    elif (algorithm == ForceDirectedAlgorithm):
+        scheduler = ForceDirectedScheduler(dfg_root=dfg_root, max_time=config["MaxTime"], analysis=analysis)
+
+    elif (algorithm == OptimalLatencyAlgorithm):
+        scheduler = BranchAndBoundScheduler(dfg_root=dfg_root, numof_resources=config["Resources"], time_budget=config.get("TimeBudget", 10), analysis=analysis)
+
+    elif (algorithm == OptimalResourceAlgorithm):
+        scheduler = BranchAndBoundScheduler(dfg_root=dfg_root, max_time=config["MaxTime"], time_budget=config.get("TimeBudget", 10), analysis=analysis)
             
     else:
         raise ValueError(f"Unknown scheduling algorithm: {algorithm}")
@@ -79,31 +172,86 @@ def schedule_dfg(dfg_root, algorithm : str, config : dict, folder_path : str) ->
     scheduler.schedule()
     schedule_info = scheduler.get_scheduling_info()
 
+    if isinstance(scheduler, BranchAndBoundScheduler):
+        print(f"{scheduler.objective}: {scheduler.best_cost} (lower bound {scheduler.lower_bound}, gap {scheduler.optimality_gap:.1%})")
+
+    if isinstance(scheduler, ModuloScheduler):
+        chains = register_chains(schedule_info, scheduler.initiation_interval, intervals, outputs=outputs_of(dfg_root))
+        print(f"initiation interval: {scheduler.initiation_interval} (target {scheduler.target_interval}, resource bound {scheduler.resource_bound}), "
+              f"{sum(chains.values())} pipeline registers, {sum(chains.values()) - len(schedule_info)} more than one per operator")
+
     print("schedule Done")
-    dotv1 = visualize_scheduled_graph(root_id=dfg_root.id, schedule_info=schedule_info, version = 1)
+    return scheduler
+
+def visualize_schedule(dfg_root, index : ScheduleIndex, folder_path : str, renderer : GraphRenderer = None):
+    
+    if renderer is None:
+        renderer = GraphRenderer()
+        
+    if not renderer.enabled:
+        return
+        
+    # the outputs of a multi-output DFG are drawn as separate roots
+    root_ids = [node.id for node in outputs_of(dfg_root)]
+    schedule_info = index.schedule_info
+    
+    if len(schedule_info) >= STREAMING_DOT_THRESHOLD:
+        stream_scheduled_graphs(index, folder_path, renderer)
+        return
+    
+    dotv1 = visualize_scheduled_graph(root_id=root_ids, schedule_info=schedule_info, version = 1, view=index)
     dotv1.attr(label="", labelloc='t', fontsize='17')  
-    dotv1.render(folder_path + "/pics/ScheduledDFG-V1", format='png', view=False, cleanup=True)
+    renderer.render(dotv1, folder_path + "/pics/ScheduledDFG-V1")
     
-    dotv2 = visualize_scheduled_graph(root_id=dfg_root.id, schedule_info=schedule_info, version = 2)
+    dotv2 = visualize_scheduled_graph(root_id=root_ids, schedule_info=schedule_info, version = 2, view=index)
     dotv2.attr(label="", labelloc='t', fontsize='17')  
-    dotv2.render(folder_path + "/pics/ScheduledDFG-V2", format='png', view=False, cleanup=True)
+    renderer.render(dotv2, folder_path + "/pics/ScheduledDFG-V2")
 
     print("Visualize schedule Done")
-    dotv1 = visualize_scheduled_graph_ranked(root_id=dfg_root.id, schedule_info=schedule_info, version = 1)
+    dotv1 = visualize_scheduled_graph_ranked(root_id=root_ids, schedule_info=schedule_info, version = 1, view=index)
     dotv1.attr(label="", labelloc='t', fontsize='17')  
-    dotv1.render(folder_path + "/pics/RankedScheduledDFG-V1", format='png', view=False, cleanup=True)
+    renderer.render(dotv1, folder_path + "/pics/RankedScheduledDFG-V1")
     
-    dotv2 = visualize_scheduled_graph_ranked(root_id=dfg_root.id, schedule_info=schedule_info, version = 2)
+    dotv2 = visualize_scheduled_graph_ranked(root_id=root_ids, schedule_info=schedule_info, version = 2, view=index)
     dotv2.attr(label="", labelloc='t', fontsize='17')  
-    dotv2.render(folder_path + "/pics/RankedScheduledDFG-V2", format='png', view=False, cleanup=True)
+    renderer.render(dotv2, folder_path + "/pics/RankedScheduledDFG-V2")
     print("Visualize Rank schedule done")
 
-    return schedule_info
+def stream_scheduled_graphs(view : ScheduleIndex, folder_path : str, renderer : GraphRenderer):
+    
+    os.makedirs(folder_path + "/pics", exist_ok=True)
+    
+    for name, ranked in (("ScheduledDFG", False), ("RankedScheduledDFG", True)):
+        for version in (1, 2):
+            path = folder_path + f"/pics/{name}-V{version}"
+            source_path = renderer.source_path(path)
+            with open(source_path, "w") as file:
+                write_scheduled_graph(view, file, version=version, ranked=ranked)
+            renderer.render_file(source_path, path)
+            
+    print("Visualize schedule Done (streamed)")
+
+def explore_design_space(dfg_root, config : dict, folder_path : str) -> list:
+    '''
+        Sweeps MaxTime and Resources instead of a single run. The Sweep config key may limit the sweep, e.g.
+        {"MaxTime": [4, 8], "Resources": {"ALU": [1, 3], "mult": [1, 2], "logic": [1, 2]}}; missing parts use the defaults.
+    '''
+    sweep = config.get("Sweep", {})
+    explorer = DesignSpaceExplorer(dfg_root, workers=config.get("Jobs"), latencies=config.get("Latency"), intervals=config.get("II"),
+                                   clock_period=config.get("ClockPeriod"), delays=config.get("Delay"))
+
+    latency_bounds = list(range(sweep["MaxTime"][0], sweep["MaxTime"][1] + 1)) if "MaxTime" in sweep else None
+    resource_vectors = explorer.resource_vectors(sweep["Resources"]) if "Resources" in sweep else None
+    front = explorer.explore(latency_bounds=latency_bounds, resource_vectors=resource_vectors, prune=config.get("Prune", True))
+    explorer.save(folder_path)
 
-def save_result(folder_path : str, schedule_info : list[ScheduledNodeInfo]):
+    print(f"Design space exploration Done ({len(explorer.points)} runs, {explorer.pruned} pruned, {len(front)} Pareto points)")
+    return front
+
+def save_result(folder_path : str, index : ScheduleIndex):
     json_output = {}
     with open(folder_path + "/output.json", "w") as file:
-        for node_info in schedule_info:
+        for node_info in index:
             json_output[node_info.node.id] = {
                 "clk_cycle": node_info.scheduled_time,
                 "resource_type": node_info.node.op_type,
@@ -112,23 +260,205 @@ def save_result(folder_path : str, schedule_info : list[ScheduledNodeInfo]):
         json.dump(json_output, file, indent=4)
 
 
-def run_test(folder_path : str):
+def simulate_design(generator : VerilogGenerator, expression, folder_path : str, count : int):
+    
+    report = verify_design(generator, expression_to_graph(expression), count=count)
+    with open(folder_path + "/simulation.json", "w") as file:
+        json.dump(report, file, indent=4)
+
+    print(f"Simulation Done ({report['vectors']} vectors, {report['failures']} failing, {report['vectors_per_second']:.0f} vectors/s)")
+    if report["failures"]:
+        raise RuntimeError(f"{report['failures']} of {report['vectors']} simulated vectors differ from the Expression, see simulation.json")
+
+
+def synthesize(dfg_root, data : dict, folder_path : str, renderer : GraphRenderer):
+    
+    if data["Algorithm"] == DesignSpaceAlgorithm:
+        explore_design_space(dfg_root, config=data["Config"], folder_path=folder_path)
+        return
+
+    scheduler = schedule_dfg(dfg_root, algorithm=data["Algorithm"], config=data["Config"])
+    schedule_info = scheduler.get_scheduling_info()
+    # overlapping evaluations share the units through the modulo reservation table, which binding does not know
+    initiation_interval = scheduler.initiation_interval if isinstance(scheduler, ModuloScheduler) else None
+
+    if initiation_interval is not None:
+        for key, default in (("Binding", False), ("FSMEncoding", "binary"), ("MergeRuns", False), ("Verify", 0)):
+            if data["Config"].get(key, default) != default:
+                raise ValueError(f"{ModuloAlgorithm} does not support {key}, remove it from the config")
+
+    if data["Config"].get("Binding", False):
+        schedule_info = bind_resources(schedule_info, config=data["Config"])
+
+    # built once the units are final, the pictures, output.json and the Verilog all read it
+    index = ScheduleIndex(schedule_info, intervals=data["Config"].get("II"), root_id=dfg_root.id)
+    visualize_schedule(dfg_root, index, folder_path=folder_path, renderer=renderer)
+
+    save_result(folder_path=folder_path, index=index)
+
+    generator = generate_verilog(folder_path=folder_path, schedule_info=schedule_info, intervals=data["Config"].get("II"),
+                                 share_registers=data["Config"].get("ShareRegisters", True),
+                                 outputs=list(zip(dfg_root.names, dfg_root.operands)) if isinstance(dfg_root, OutputNode) else None,
+                                 initiation_interval=initiation_interval, index=index,
+                                 fsm_encoding=data["Config"].get("FSMEncoding", "binary"),
+                                 merge_runs=data["Config"].get("MergeRuns", False))
+
+    if data["Config"].get("Verify", 0):
+        simulate_design(generator, data["Expression"], folder_path=folder_path, count=data["Config"]["Verify"])
+
+    if data["Config"].get("Testbench", 0):
+        write_testbench(folder_path, generator, count=data["Config"]["Testbench"])
+
+
+def run_test(folder_path : str, render_mode : str = None, cache : ResultCache = None):
+    '''
+        Runs one folder. With a cache, an unchanged design only copies its artifacts back, and a design whose
+        expression is unchanged reuses its parsed and optimized DFG.
+    '''
     input_file_path = folder_path + "/input.json"
     data = load_input(input_file_path)
 
-    dfg_root = build_dfg(expression=data["Expression"], folder_path=folder_path)
+    # the command line flag wins over the Render key of the config
+    renderer = GraphRenderer(mode=render_mode or data["Config"].get("Render", "sync"))
+
+    if cache is not None:
+        run_key = cache.key("run", data["Expression"], data["Algorithm"], data["Config"], renderer.mode)
+        dfg_key = cache.key("dfg", data["Expression"], data["Config"].get("Outputs"), data["Config"].get("Optimize", True), renderer.mode)
+        if cache.restore(run_key, folder_path) is not None:
+            print("Restored from cache")
+            return
 
-    schedule_info = schedule_dfg(dfg_root, algorithm=data["Algorithm"], config=data["Config"], folder_path=folder_path)
+    # every file modified from then on is an artifact of this run, whole seconds for coarse file system timestamps
+    started = int(time.time())
+    restored = cache.restore(dfg_key, folder_path) if cache is not None else None
+    try:
+        if restored is not None:
+            dfg_root = restored[1].root()
+            print("DFG restored from cache")
+        else:
+            dfg_root = build_dfg(expression=data["Expression"], folder_path=folder_path, renderer=renderer, outputs=data["Config"].get("Outputs"))
 
-    save_result(folder_path=folder_path, schedule_info=schedule_info)
+            if data["Config"].get("Optimize", True):
+                dfg_root = optimize_dfg(dfg_root)
+
+        # copied before scheduling, binding may swap operands
+        dfg_store = DFGStore.from_dfg(dfg_root) if cache is not None and restored is None else None
+
+        synthesize(dfg_root, data, folder_path=folder_path, renderer=renderer)
+    finally:
+        renderer.wait()
+
+    if cache is not None:
+        files = written_files(folder_path, since=started)
+        if dfg_store is not None:
+            cache.store(dfg_key, folder_path, [path for path in files if path.startswith(DFG_ARTIFACTS)], value=dfg_store)
+        cache.store(run_key, folder_path, files)
+
+def timed_run_test(folder_path : str, render_mode : str = None, cache : ResultCache = None) -> dict:
+    '''
+        Runs one folder and reports its status instead of raising, so a failing design does not abort a batch.
+    '''
+    start = time.perf_counter()
+    try:
+        run_test(folder_path=folder_path, render_mode=render_mode, cache=cache)
+        status = {"folder": folder_path, "status": "ok"}
+    except Exception as e:
+        status = {"folder": folder_path, "status": "failed", "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+    status["wall_time"] = round(time.perf_counter() - start, 3)
+    return status
+
+
+def expand_folders(patterns : list[str]) -> list[str]:
+    '''
+        Expands glob patterns into folder paths, keeping the given order and dropping duplicates.
+    '''
+    folders = []
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            matches = sorted(path for path in glob.glob(pattern) if Path(path).is_dir())
+        else:
+            matches = [pattern]
+        for folder in matches:
+            folder = folder.rstrip("/")
+            if folder not in folders:
+                folders.append(folder)
+    return folders
+
+
+def run_batch(folder_paths : list[str], workers : int = None, summary_path : str = "batch_summary.json", render_mode : str = None,
+              cache : ResultCache = None) -> dict:
+    '''
+        Runs many folders across a process pool, so interpreter startup and imports are paid once per worker.
+        Writes a summary with the status and wall time of every folder to summary_path.
+    '''
+    start = time.perf_counter()
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(timed_run_test, folder, render_mode, cache): folder for folder in folder_paths}
+        for future in as_completed(futures):
+            folder = futures[future]
+            try:
+                results[folder] = future.result()
+            except Exception as e:
+                # the worker process itself died
+                results[folder] = {"folder": folder, "status": "failed", "error": f"{type(e).__name__}: {e}", "wall_time": None}
+            print(f"[{results[folder]['status']}] {folder}")
+
+    folders = [results[folder] for folder in folder_paths]
+    failed = sum(1 for result in folders if result["status"] != "ok")
+    summary = {
+        "total": len(folders),
+        "passed": len(folders) - failed,
+        "failed": failed,
+        "wall_time": round(time.perf_counter() - start, 3),
+        "folders": folders,
+    }
+
+    with open(summary_path, "w") as file:
+        json.dump(summary, file, indent=4)
+
+    print(f"Batch done: {summary['passed']}/{summary['total']} passed, summary written to {summary_path}")
+    return summary
 
-    generate_verilog(folder_path=folder_path, schedule_info=schedule_info)
 
 def main():
-    if len(sys.argv) == 2:
-        run_test(folder_path=sys.argv[1])
-    else:
+    parser = argparse.ArgumentParser(description="Schedules expressions and generates their Verilog.")
+    parser.add_argument("folders", nargs="*", help="input folder(s) or glob patterns such as 'samples/*'")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="number of worker processes in batch mode (default: number of cores)")
+    parser.add_argument("--summary", default="batch_summary.json", help="path of the batch summary JSON")
+    parser.add_argument("--render", choices=RENDER_MODES, default=None, help="how to write the DFG pictures (default: the Render config key, or sync)")
+    parser.add_argument("--no-cache", action="store_true", help="neither read nor write the result cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help=f"directory of the result cache (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024), help="size limit of the result cache in MB")
+    parser.add_argument("--iverilog", action="store_true", help="afterwards compile and run the testbenches (Testbench config key) with iverilog and vvp")
+    parser.add_argument("--testbench-summary", default="testbench_summary.json", help="path of the testbench summary JSON")
+    args = parser.parse_args()
+
+    # keyed by the sources of main and src as well, so a changed tool never reuses old results
+    cache = None if args.no_cache else ResultCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024, version=tool_version(__file__))
+
+    folders = expand_folders(args.folders)
+    failed = False
+    if not folders:
         print("Please provide the input folder path.")
+    elif len(folders) == 1 and args.jobs is None:
+        run_test(folder_path=folders[0], render_mode=args.render, cache=cache)
+    else:
+        summary = run_batch(folders, workers=args.jobs, summary_path=args.summary, render_mode=args.render, cache=cache)
+        failed = summary["failed"] > 0
+
+    if folders and args.iverilog:
+        # checked before the cache, which asks iverilog for its version
+        require_tools("iverilog", "vvp")
+        # compiled testbenches only depend on the Verilog and the simulator, not on the version of this tool
+        testbench_cache = None if args.no_cache else ResultCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024,
+                                                                  version=simulator_version())
+        summary = run_testbenches(folders, workers=args.jobs, cache=testbench_cache, summary_path=args.testbench_summary)
+        failed = failed or summary["failed"] > 0
+
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
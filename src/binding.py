@@ -0,0 +1,159 @@
+from collections import defaultdict
+from .dfg_creator import IdentifierNode
+from .dfg_optimizer import COMMUTATIVE_OPS
+from .code_generator import VerilogGenerator
+from .scheduler import ScheduledNodeInfo
+from typing import List
+
+
+def count_mux_inputs(schedule_info : List[ScheduledNodeInfo], intervals : dict = None) -> int:
+    '''
+        Total number of mux inputs in front of the functional units of the generated datapath.
+    '''
+    generator = VerilogGenerator(schedule_info, intervals=intervals)
+    return sum(len(sources) for ports in generator.mux_tables.values() for sources in ports.values())
+
+
+def _min_cost_assignment(cost : List[List[int]]) -> List[int]:
+    '''
+        Hungarian algorithm for a rows x columns cost matrix with rows <= columns.
+        Returns the column assigned to every row, so that the total cost is minimal.
+    '''
+    rows, columns = len(cost), len(cost[0]) if cost else 0
+    infinity = float("inf")
+    u = [0] * (rows + 1)
+    v = [0] * (columns + 1)
+    # match[column] = row assigned to it, 1-based, 0 if free
+    match = [0] * (columns + 1)
+    way = [0] * (columns + 1)
+
+    for row in range(1, rows + 1):
+        match[0] = row
+        column = 0
+        min_slack = [infinity] * (columns + 1)
+        used = [False] * (columns + 1)
+        while True:
+            used[column] = True
+            current_row, delta, next_column = match[column], infinity, 0
+            for j in range(1, columns + 1):
+                if used[j]:
+                    continue
+                slack = cost[current_row - 1][j - 1] - u[current_row] - v[j]
+                if slack < min_slack[j]:
+                    min_slack[j], way[j] = slack, column
+                if min_slack[j] < delta:
+                    delta, next_column = min_slack[j], j
+            for j in range(columns + 1):
+                if used[j]:
+                    u[match[j]] += delta
+                    v[j] -= delta
+                else:
+                    min_slack[j] -= delta
+            column = next_column
+            if match[column] == 0:
+                break
+        while column:
+            previous = way[column]
+            match[column] = match[previous]
+            column = previous
+
+    assignment = [0] * rows
+    for j in range(1, columns + 1):
+        if match[j]:
+            assignment[match[j] - 1] = j - 1
+    return assignment
+
+
+class FUBinder:
+    '''
+        Rebinds scheduled operations to functional-unit instances so the datapath needs fewer mux inputs.
+        Clock cycles are visited in order and, per resource type, the operations of a cycle are matched to the free
+        units with a min-cost bipartite matching. The cost of an operation on a unit is the number of sources it adds
+        to the two input ports of that unit; operands of commutative operations may be swapped to fit the ports.
+        Cycles, unit counts and the initiation intervals of multi-cycle units are kept, only resource_num changes.
+        If the result needs more mux inputs than the original binding, the original binding is kept.
+    '''
+
+    def __init__(self, intervals : dict = None, swap_commutative : bool = True):
+        self.intervals = intervals or {}
+        self.swap_commutative = swap_commutative
+        self.mux_inputs_before = 0
+        self.mux_inputs_after = 0
+        self.swapped = 0
+
+    def _source(self, operand, consumer : ScheduledNodeInfo, node_map : dict):
+        '''
+            Key of the value an operand port reads; equal keys share one mux input.
+        '''
+        if operand is None:
+            return None
+        if isinstance(operand, IdentifierNode):
+            return ("value", operand.name)
+        producer = node_map.get(operand.id)
+        if producer is not None and producer.scheduled_time == consumer.scheduled_time:
+            return ("chained", operand.id)
+        return ("register", operand.id)
+
+    def bind(self, schedule_info : List[ScheduledNodeInfo]) -> List[ScheduledNodeInfo]:
+        '''
+            Rebinds schedule_info in place and returns it.
+        '''
+        self.mux_inputs_before = count_mux_inputs(schedule_info, self.intervals)
+        original = [(info.resource_num, info.node.operands) for info in schedule_info]
+        node_map = {info.node.id: info for info in schedule_info}
+
+        by_type = defaultdict(list)
+        for info in schedule_info:
+            by_type[info.node.op_type].append(info)
+
+        for resource_type, infos in by_type.items():
+            units = sorted({info.resource_num for info in infos})
+            interval = self.intervals.get(resource_type, max(info.duration_cycles for info in infos))
+            # sources already wired to the two ports of every unit, and the first cycle it can start an operation again
+            ports = {unit: (set(), set()) for unit in units}
+            free_from = {unit: 0 for unit in units}
+
+            by_cycle = defaultdict(list)
+            for info in infos:
+                by_cycle[info.scheduled_time].append(info)
+
+            for cycle in sorted(by_cycle):
+                operations = sorted(by_cycle[cycle], key=lambda info: info.node.id)
+                free_units = [unit for unit in units if free_from[unit] <= cycle]
+
+                options = []
+                cost = []
+                for info in operations:
+                    left, right = (self._source(operand, info, node_map) for operand in info.node.operands)
+                    row_options = []
+                    for unit in free_units:
+                        ports_left, ports_right = ports[unit]
+                        straight = (left is not None and left not in ports_left) + (right is not None and right not in ports_right)
+                        swapped = (left is not None and left not in ports_right) + (right is not None and right not in ports_left)
+                        if self.swap_commutative and isinstance(info.node.op, COMMUTATIVE_OPS) and right is not None and swapped < straight:
+                            row_options.append((swapped, True))
+                        else:
+                            row_options.append((straight, False))
+                    options.append(row_options)
+                    cost.append([option[0] for option in row_options])
+
+                for row, column in enumerate(_min_cost_assignment(cost)):
+                    info, unit = operations[row], free_units[column]
+                    if options[row][column][1]:
+                        info.node.operands = info.node.operands[::-1]
+                        self.swapped += 1
+                    left, right = (self._source(operand, info, node_map) for operand in info.node.operands)
+                    if left is not None:
+                        ports[unit][0].add(left)
+                    if right is not None:
+                        ports[unit][1].add(right)
+                    info.resource_num = unit
+                    free_from[unit] = cycle + interval
+
+        self.mux_inputs_after = count_mux_inputs(schedule_info, self.intervals)
+        if self.mux_inputs_after > self.mux_inputs_before:
+            # the matching is greedy over the cycles, never hand back a datapath wider than the scheduler's
+            for info, (resource_num, operands) in zip(schedule_info, original):
+                info.resource_num, info.node.operands = resource_num, operands
+            self.mux_inputs_after, self.swapped = self.mux_inputs_before, 0
+        return schedule_info
@@ -1,316 +1,828 @@
 import os
 import ast
 from collections import defaultdict
-from src.scheduler import ScheduledNodeInfo
-from dfg_creator import BaseNode , OperatorNode, IdentifierNode
+from .scheduler import ScheduledNodeInfo
+from .dfg_creator import BaseNode , OperatorNode, IdentifierNode
+from .register_allocation import read_cycles, chain_index, register_chains
+from .schedule_index import ScheduleIndex
+
+# width of the op select of every resource type
+OP_WIDTHS = {"ALU": 3, "mult": 2, "logic": 3, "shift": 1, "pow": 1}
+
+# ports of the datapath and controller that output names must not take
+RESERVED_PORTS = {"clk", "rst", "start", "done", "done_next", "result_en", "op_ready", "state", "next_state"}
+
+# state encodings of the controller FSM
+FSM_ENCODINGS = ["binary", "onehot", "rom"]
+
+def write_lines(file, lines) -> None:
+    '''
+        Writes lines separated by newlines as they are produced, so the text of a module is never held in memory.
+    '''
+    separator = ""
+    for line in lines:
+        file.write(separator)
+        file.write(line)
+        separator = "\n"
+
 class VerilogGenerator:
-    
+    '''
+        Generates a datapath and a controller FSM from a schedule.
+        Every resource unit gets a mux per operand. Operator results share registers when their lifetimes do not
+        overlap (left-edge allocation); share_registers=False gives every result its own register. A register written
+        by several units selects the unit with its _wsel input.
+
+        outputs is a list of (port name, node) of a multi-output design; by default the operator no other operator
+        reads drives a single result port. All output ports are written in S_DONE.
+
+        The controller is an FSM with one state per clock cycle, binary or one-hot encoded (fsm_encoding), or a
+        microcode ROM of control words stepped through by a program counter ("rom"). With merge_runs, consecutive
+        cycles with the same control word are one state (or ROM word) held for the length of the run by a counter,
+        which is what long multi-cycle operations produce; "rom" always merges.
+
+        Operations chained into one cycle read the output of the unit that computes their operand instead of its register.
+        Operations may take several cycles (ScheduledNodeInfo.duration_cycles). A unit that is not pipelined keeps its
+        inputs selected for all of those cycles; a pipelined unit (intervals[type] < latency) gets pipeline registers
+        after its logic, so its inputs are only selected in the issue cycle. Either way the result register is
+        enabled in the last cycle of the operation.
+
+        The per-cycle, per-unit and lifetime tables come from a ScheduleIndex, which may be shared with the
+        visualizers (it has to be built with the same intervals); the rest of what the emitters need per state is
+        tabulated once in the constructor, and write_datapath and write_controller stream the modules into a file
+        line by line.
+    '''
+
     def _get_reg_name(self, node_id):
-        if node_id not in self.node_map:
-            return "unknown"
-        info = self.node_map[node_id]
-        return f"reg_{info.node.op_type}{info.node.id}"
+        return self.reg_names.get(node_id, "unknown")
+
+    def _allocate_registers(self, share_registers : bool):
+        output_ids = [node.id for _, node in self.outputs if node.id in self.node_map]
+        if share_registers:
+            self.reg_names = {node_id: f"reg{register}" for node_id, register in self.index.registers(output_ids).items()}
+        else:
+            self.reg_names = {info.node.id: f"reg_{info.node.op_type}{info.node.id}" for info in self.schedule_info}
+
+        # {register name: units writing it, in write order}, the index of a unit is its _wsel value
+        self.register_writers : dict[str, list[str]] = {}
+        # {node id: _wsel value of the unit that writes its register}
+        self.write_selects : dict[int, int] = {}
+        for info in sorted(self.schedule_info, key=lambda x: (self._get_finish_time(x), x.node.id)):
+            if info.node.id not in self.reg_names:
+                continue
+            writers = self.register_writers.setdefault(self.reg_names[info.node.id], [])
+            res = self._get_resource_name(info)
+            if res not in writers:
+                writers.append(res)
+            self.write_selects[info.node.id] = writers.index(res)
+
+    @property
+    def register_count(self):
+        return len(self.register_writers)
+
+    def _get_wsel_width(self, reg_name):
+        return max(1, (len(self.register_writers[reg_name]) - 1).bit_length())
+
+    def _get_resource_name(self, info : ScheduledNodeInfo) -> str:
+        return f"{info.node.op_type}{info.resource_num}"
 
     def _collect_inputs(self):
         for info in self.schedule_info:
             for operand in info.node.operands:
-                if type(operand).__name__ == "IdentifierNode":
+                if isinstance(operand, IdentifierNode):
                     if operand.value is None:
                         self.inputs.add(operand.name)
 
-    def _get_operand_source(self, operand):
-        if type(operand).__name__ == "IdentifierNode":
+    def _get_operand_source(self, operand, consumer : ScheduledNodeInfo = None, cycle : int = None):
+        if isinstance(operand, IdentifierNode):
             if operand.value is not None:
-                return f"32'd{operand.value}"
+                return f"32'd{operand.value}" if operand.value >= 0 else f"-32'd{-operand.value}"
             return operand.name
-            
-        elif type(operand).__name__ == "OperatorNode":
+
+        elif isinstance(operand, OperatorNode):
+            producer = self.node_map.get(operand.id)
+            if consumer is not None and producer is not None and producer.scheduled_time == consumer.scheduled_time:
+                # chained in the same cycle, read the unit output before it reaches the register
+                return f"{self._get_resource_name(producer)}_out"
             return self._get_reg_name(operand.id)
         return "32'd0"
 
     def _build_mux_tables(self):
-        
+
         for resource_name, nodes in self.resources.items():
-                
-            for op_idx in [0, 1]: 
-                sources = set()
-                
+
+            for op_idx in [0, 1]:
+                # sources get select values in the order they are first read
+                table = self.mux_tables[resource_name][op_idx]
+
                 for info in nodes:
                     if info.node.operands[op_idx]:
-                        src = self._get_operand_source(info.node.operands[op_idx])
-                        sources.add(src)
-                
-                for idx, src in enumerate(sources):
-                    self.mux_tables[resource_name][op_idx][src] = idx
-
-
-    def __init__(self, schedule_info: list[ScheduledNodeInfo]):
-        
-        self.schedule_info = sorted(schedule_info, key=lambda x: x.node.id)
-        self.node_map = {info.node.id: info for info in self.schedule_info}
-        
+                        table.setdefault(self._get_operand_source(info.node.operands[op_idx], info), len(table))
+
+    def _build_state_tables(self):
+        '''
+            {state: (info, cycle) of the operations whose unit inputs are driven in it} and
+            {state: infos whose result is written at its end}. A state is a clock cycle of the schedule.
+        '''
+        # a pipelined unit only reads its operands in the issue cycle, see read_cycles
+        self.driven_at = self.index.reads_at
+        self.finished_at = self.index.finished_at
+
+
+    def __init__(self, schedule_info: list[ScheduledNodeInfo], intervals : dict = None, share_registers : bool = True,
+                 outputs : list[tuple] = None, index : ScheduleIndex = None, fsm_encoding : str = "binary", merge_runs : bool = False):
+
+        if fsm_encoding not in FSM_ENCODINGS:
+            raise ValueError(f"fsm_encoding must be one of {FSM_ENCODINGS}")
+        self.fsm_encoding = fsm_encoding
+        self.merge_runs = merge_runs or fsm_encoding == "rom"
+
+        self.intervals = intervals or {}
+        self.index = index if index is not None else ScheduleIndex(schedule_info, intervals=self.intervals)
+        self.schedule_info = sorted(self.index.schedule_info, key=lambda x: x.node.id)
+        self.node_map = self.index.by_id
+
+        # the result is the operator no other operator reads
+        self.root_id = max(self.index.roots) if self.index.roots else None
+        if outputs is None:
+            outputs = [("result", self.node_map[self.root_id].node)] if self.root_id is not None else []
+        self.outputs = list(outputs)
+
         self.inputs = set()
         self._collect_inputs()
-        
-        self.resources : dict[str:list[ScheduledNodeInfo]] = {}
-        for info in self.schedule_info:
-            resource_name = f"{info.node.op_type}{info.resource_num}"
-            self.resources[resource_name].append(info)
-            
+        for name, node in self.outputs:
+            if isinstance(node, IdentifierNode) and node.value is None:
+                self.inputs.add(node.name)
+        clashes = sorted({name for name, _ in self.outputs} & (self.inputs | RESERVED_PORTS))
+        if clashes:
+            raise ValueError(f"output names {clashes} are already used by input or control ports")
+
+        self.resources : dict[str, list[ScheduledNodeInfo]] = self.index.by_unit
+        self.unit_latencies = self.index.unit_latencies
+
+        self._allocate_registers(share_registers)
+
         self.op_codes = {
             ast.Add: 0,
-            ast.Sub: 1, 
-            ast.Lt: 1, ast.LtE: 1, ast.Gt: 1, ast.GtE: 1,
+            ast.Sub: 1,
             ast.USub: 2,
-            
+            ast.Lt: 3, ast.LtE: 4, ast.Gt: 5, ast.GtE: 6,
+
             ast.Mult: 0,
             ast.Div: 1,
             ast.FloorDiv: 1,
-            ast.Mod: 1,
-            
-            ast.Eq: 0,
-            ast.NotEq: 0,
+            ast.Mod: 2,
+
             ast.BitAnd: 0,
             ast.BitOr: 1,
             ast.BitXor: 2,
             ast.Invert: 3,
-            
+            ast.Eq: 4,
+            ast.NotEq: 5,
+
             ast.LShift: 0, ast.RShift: 1,
-            
+
             ast.Pow: 0
         }
 
         # {resource_name: {operand_index (0/1): {source_name: select_value}}}
-        self.mux_tables: dict[str:dict[dict[int:str]]] = {}
+        self.mux_tables: dict[str, dict[int, dict[str, int]]] = defaultdict(lambda: {0: {}, 1: {}})
         self._build_mux_tables()
-     
+        self._build_state_tables()
+
     def _get_op_width(self, res_type):
-        res_type = res_type.lower()
-        
-        if "alu" in res_type or "logic" in res_type: 
-            return 2
-        else:
-            return 1   
+        return OP_WIDTHS.get(res_type, 1)
+
+    def _get_sel_width(self, res, op_idx):
+        return max(1, (len(self.mux_tables[res][op_idx]) - 1).bit_length())
+
+    def _get_latency(self, res):
+        return self.unit_latencies[res]
+
+    def _is_pipelined(self, res):
+        res_type = self.resources[res][0].node.op_type
+        latency = self._get_latency(res)
+        return latency > 1 and self.intervals.get(res_type, latency) < latency
+
+    def _get_finish_time(self, info : ScheduledNodeInfo) -> int:
+        return info.scheduled_time + info.duration_cycles - 1
+
+    def _functional_unit(self, res):
+        '''
+            Combinational logic of a unit, computing {res}_result from its operands and op select.
+        '''
+        res_type = self.resources[res][0].node.op_type
+        width = self._get_op_width(res_type)
+        a, b = f"{res}_op1", f"{res}_op2"
+        cases = {
+            "ALU": [f"{a} + {b}", f"{a} - {b}", f"-{a}",
+                    f"{{31'b0, $signed({a}) < $signed({b})}}", f"{{31'b0, $signed({a}) <= $signed({b})}}",
+                    f"{{31'b0, $signed({a}) > $signed({b})}}", f"{{31'b0, $signed({a}) >= $signed({b})}}"],
+            # x / 0 and x % 0 are all x in Verilog, the unit defines them as 0 like the simulator
+            "mult": [f"{a} * {b}", f"({b} == 0) ? 32'd0 : {a} / {b}", f"({b} == 0) ? 32'd0 : {a} % {b}"],
+            "logic": [f"{a} & {b}", f"{a} | {b}", f"{a} ^ {b}", f"~{a}",
+                      f"{{31'b0, {a} == {b}}}", f"{{31'b0, {a} != {b}}}"],
+            "shift": [f"{a} << {b}", f"{a} >> {b}"],
+            "pow": [f"{a} ** {b}"],
+        }.get(res_type, [f"{a}"])
+
+        lines = [f"// {res} Functional Unit", f"reg [31:0] {res}_result;", "always @(*) begin", f"  case ({res}_op)"]
+        for code, expression in enumerate(cases):
+            lines.append(f"    {width}'d{code}: {res}_result = {expression};")
+        lines += [f"    default: {res}_result = 0;", "  endcase", "end"]
+
+        latency = self._get_latency(res)
+        if not self._is_pipelined(res):
+            # a multi-cycle unit that is not pipelined is a multicycle path, its inputs are held by the controller
+            lines.append(f"assign {res}_out = {res}_result;")
+            return lines
+
+        stages = [f"{res}_stage{stage}" for stage in range(1, latency)]
+        lines.append(f"reg [31:0] {', '.join(stages)};")
+        lines.append("always @(posedge clk) begin")
+        lines.append(f"  {stages[0]} <= {res}_result;")
+        for previous, stage in zip(stages, stages[1:]):
+            lines.append(f"  {stage} <= {previous};")
+        lines.append("end")
+        lines.append(f"assign {res}_out = {stages[-1]};")
+        return lines
+
+    def _unit_control_ports(self, direction):
+        '''
+            Mux select and op select ports of every unit, declared as direction ("input" or "output reg").
+        '''
+        for res in sorted(self.resources.keys()):
+            for op_idx in [0, 1]:
+                yield f"  {direction} [{self._get_sel_width(res, op_idx) - 1}:0] {res}_sel{op_idx + 1},"
+        for res in sorted(self.resources.keys()):
+            op_width = self._get_op_width(self.resources[res][0].node.op_type)
+            yield f"  {direction} [{op_width - 1}:0] {res}_op,"
+
+    def _unit_lines(self):
+        '''
+            Input muxes and logic of every functional unit.
+        '''
+        yield "\n// Muxing logic for FU inputs"
+        for res in sorted(self.resources.keys()):
+            for op_idx in [0, 1]:
+                suffix = "1" if op_idx == 0 else "2"
+                sel_width = self._get_sel_width(res, op_idx)
+                yield f"reg [31:0] {res}_op{suffix}_reg;"
+                yield "always @(*) begin"
+                yield f"  case ({res}_sel{suffix})"
+                for src, sel_val in self.mux_tables[res][op_idx].items():
+                    yield f"    {sel_width}'d{sel_val}: {res}_op{suffix}_reg = {src};"
+                yield f"    default: {res}_op{suffix}_reg = 0;"
+                yield "  endcase"
+                yield "end"
+                yield f"assign {res}_op{suffix} = {res}_op{suffix}_reg;\n"
+
+        yield "// Functional Units"
+        for res in sorted(self.resources.keys()):
+            yield from self._functional_unit(res)
+            yield ""
 
     def generate_datapath(self):
-        lines = []
-        
-        lines.append("module datapath(")
-        lines.append("  input clk, rst,")
-        
-        inputs_list = sorted(list(self.inputs))
-        inputs_str = ",\n // Data Inputs\n  ".join([f"input [31:0] {i}" for i in inputs_list])
-        if inputs_list: inputs_str = f"  {inputs_str},"
-        else: inputs_str = "  // No data inputs detected"
-        lines.append(inputs_str)
-
-        lines.append(" // Control Signals from Controller")
+        return "\n".join(self._datapath_lines())
+
+    def write_datapath(self, file):
+        write_lines(file, self._datapath_lines())
+
+    def generate_controller(self):
+        return "\n".join(self._controller_lines())
+
+    def write_controller(self, file):
+        write_lines(file, self._controller_lines())
+
+    def _control_assignments(self, state):
+        '''
+            (signal, value, Verilog literal) of the unit selects and register enables of the operations driven or
+            finished in state. This is the control word of the state, every other control output is 0.
+        '''
+        for info, cycle in self.driven_at.get(state, ()):
+            res = self._get_resource_name(info)
+            op_val = self.op_codes.get(type(info.node.op), 0)
+            yield f"{res}_op", op_val, f"{self._get_op_width(info.node.op_type)}'d{op_val}"
+            for op_idx in [0, 1]:
+                if info.node.operands[op_idx]:
+                    src = self._get_operand_source(info.node.operands[op_idx], info, cycle)
+                    sel = self.mux_tables[res][op_idx].get(src, 0)
+                    yield f"{res}_sel{op_idx + 1}", sel, f"{sel}"
+
+        for info in self.finished_at.get(state, ()):
+            yield from self._enable_assignments(info)
+
+    def control_word(self, state) -> dict:
+        '''
+            {signal: value} of the control outputs set in state, see _control_assignments.
+        '''
+        return {signal: value for signal, value, _ in self._control_assignments(state)}
+
+    def _enable_assignments(self, info : ScheduledNodeInfo):
+        if info.node.id not in self.reg_names:
+            # only read chained, the value never reaches a register
+            return
+        reg_name = self._get_reg_name(info.node.id)
+        yield f"{reg_name}_en", 1, "1'b1"
+        if len(self.register_writers[reg_name]) > 1:
+            yield f"{reg_name}_wsel", self.write_selects[info.node.id], f"{self.write_selects[info.node.id]}"
+
+    def _state_lines(self, state):
+        for signal, _, literal in self._control_assignments(state):
+            yield f"      {signal} = {literal};"
+
+    def _state_runs(self) -> list[tuple]:
+        '''
+            (first cycle, length) of the states of the controller. Without merge_runs every cycle is a state.
+        '''
+        runs = []
+        previous = None
+        for t in range(1, self.index.max_time + 1):
+            # only the previous word is kept, so this is one pass in bounded memory
+            word = tuple(self._control_assignments(t))
+            if self.merge_runs and runs and word == previous:
+                runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+            else:
+                runs.append((t, 1))
+            previous = word
+        return runs
+
+    def _control_fields(self) -> list[tuple]:
+        '''
+            (signal, width) of every control output set by the states, in the order of the ROM control word.
+        '''
+        fields = []
+        for res in sorted(self.resources.keys()):
+            fields.append((f"{res}_sel1", self._get_sel_width(res, 0)))
+            fields.append((f"{res}_sel2", self._get_sel_width(res, 1)))
+            fields.append((f"{res}_op", self._get_op_width(self.resources[res][0].node.op_type)))
+        for reg_name, writers in self.register_writers.items():
+            fields.append((f"{reg_name}_en", 1))
+            if len(writers) > 1:
+                fields.append((f"{reg_name}_wsel", self._get_wsel_width(reg_name)))
+        return fields
+
+    def control_ports(self) -> list[tuple]:
+        '''
+            (signal, width) of every port from the controller to the datapath.
+        '''
+        return self._control_fields() + [("done_next", 1), ("result_en", 1)]
+
+    def _datapath_lines(self):
+
+        yield "module datapath("
+        yield "  input clk, rst,"
+
+        yield "  // Data Inputs"
+        for name in sorted(self.inputs):
+            yield f"  input [31:0] {name},"
+
+        yield "  // Control Signals from Controller"
+        yield from self._unit_control_ports("input")
+
+        yield "  input done_next,"
+        yield "  input result_en,"
+        for reg_name, writers in self.register_writers.items():
+            yield f"  input {reg_name}_en,"
+            if len(writers) > 1:
+                yield f"  input [{self._get_wsel_width(reg_name) - 1}:0] {reg_name}_wsel,"
+
+        yield "  // Outputs"
+        for name, _ in self.outputs:
+            yield f"  output reg [31:0] {name},"
+        yield "  output reg done"
+        yield ");\n"
+
+        yield "// Wires for FU outputs and Mux outputs"
         for res in sorted(self.resources.keys()):
-            op_width = self._get_op_width(res)
-            lines.append(f"  input [3:0] {res}_sel1, {res}_sel2,")
-            if op_width > 1:
-                lines.append(f"  input [{op_width-1}:0] {res}_op,")
-            elif op_width == 1:
-                lines.append(f"  input {res}_op,")
+            yield f"wire [31:0] {res}_out;"
+            yield f"wire [31:0] {res}_op1, {res}_op2;"
+
+        yield "\n// Registers for intermediate values"
+        for reg_name in self.register_writers:
+            yield f"reg [31:0] {reg_name};"
+
+        yield from self._unit_lines()
+
+        yield "// Register update logic"
+        yield "always @(posedge clk or posedge rst) begin"
+        yield "  if (rst) begin"
+        for reg_name in self.register_writers:
+            yield f"    {reg_name} <= 0;"
+        for name, _ in self.outputs:
+            yield f"    {name} <= 0;"
+        yield "    done <= 0;"
+        yield "  end else begin"
+        yield "    done <= done_next;"
+        for reg_name, writers in self.register_writers.items():
+            if len(writers) == 1:
+                yield f"    if ({reg_name}_en) {reg_name} <= {writers[0]}_out;"
+                continue
+            width = self._get_wsel_width(reg_name)
+            yield f"    if ({reg_name}_en) begin"
+            yield f"      case ({reg_name}_wsel)"
+            for wsel, res in enumerate(writers):
+                yield f"        {width}'d{wsel}: {reg_name} <= {res}_out;"
+            yield "      endcase"
+            yield "    end"
+        for name, node in self.outputs:
+            yield f"    if (result_en) {name} <= {self._get_operand_source(node)};"
+        yield "  end"
+        yield "end\n"
+        yield "endmodule"
+
+    def _controller_ports(self):
+        yield "module controller("
+        yield "  input clk, rst, start,"
+        yield "  output reg op_ready,"
+
+        yield from self._unit_control_ports("output reg")
+
+        yield "  output reg done_next, result_en" + ("," if self.register_writers else "")
+        # the last port has no comma
+        remaining = sum(2 if len(writers) > 1 else 1 for writers in self.register_writers.values())
+        for reg_name, writers in self.register_writers.items():
+            ports = [f"  output reg {reg_name}_en"]
+            if len(writers) > 1:
+                ports.append(f"  output reg [{self._get_wsel_width(reg_name) - 1}:0] {reg_name}_wsel")
+            for port in ports:
+                remaining -= 1
+                yield port + ("," if remaining else "")
+        yield ");\n"
+
+    def _controller_lines(self):
+        if self.fsm_encoding == "rom":
+            yield from self._rom_controller_lines()
+            return
+
+        runs = self._state_runs()
+        done = len(runs) + 1
+        onehot = self.fsm_encoding == "onehot"
+        state_width = done + 1 if onehot else max(1, done.bit_length())
+        count_width = max([length - 1 for _, length in runs], default=0).bit_length()
+        # one-hot: S_* is the bit of a state, the case tests that bit
+        encode = (lambda name: f"ONE << {name}") if onehot else (lambda name: name)
+        label = (lambda name: f"state[{name}]") if onehot else (lambda name: name)
+
+        yield from self._controller_ports()
+
+        yield f"reg [{state_width - 1}:0] state, next_state;"
+        if onehot:
+            yield f"localparam [{state_width - 1}:0] ONE = 1;"
+        yield f"localparam S_IDLE = 0, S_DONE = {done};"
+        # a state is named after the first cycle of its run
+        for index, (first, _) in enumerate(runs, start=1): yield f"localparam S_CYCLE_{first} = {index};"
+        if count_width:
+            yield "// cycles already spent in the current state"
+            yield f"reg [{count_width - 1}:0] count;"
+
+        yield "\n// State transition logic"
+        yield "always @(posedge clk or posedge rst) begin"
+        if count_width:
+            yield "  if (rst) begin"
+            yield f"    state <= {encode('S_IDLE')};"
+            yield "    count <= 0;"
+            yield "  end else begin"
+            yield "    state <= next_state;"
+            yield "    count <= (next_state == state) ? count + 1 : 0;"
+            yield "  end"
+        else:
+            yield f"  if (rst) state <= {encode('S_IDLE')};"
+            yield "  else state <= next_state;"
+        yield "end"
+
+        yield "\n// Next state and output logic"
+        yield "always @(*) begin"
+        yield "  op_ready = 1'b0;"
+        yield "  next_state = state;"
+        for reg_name, writers in self.register_writers.items():
+            yield f"  {reg_name}_en = 0;" + (f" {reg_name}_wsel = 0;" if len(writers) > 1 else "")
+        for res in sorted(self.resources.keys()): yield f"  {res}_sel1 = 0; {res}_sel2 = 0; {res}_op = 0;"
+        yield "  result_en = 0;"
+        yield "  done_next = 0;\n"
+
+        yield "  case (1'b1) // synopsys parallel_case" if onehot else "  case (state)"
+        yield f"    {label('S_IDLE')}: begin"
+        yield "      op_ready = 1'b1;"
+        yield f"      if (start) next_state = {encode(f'S_CYCLE_{runs[0][0]}' if runs else 'S_DONE')};"
+        yield "    end"
+
+        for index, (first, length) in enumerate(runs):
+            following = f"S_CYCLE_{runs[index + 1][0]}" if index + 1 < len(runs) else "S_DONE"
+            yield f"    {label(f'S_CYCLE_{first}')}: begin"
+            yield from self._state_lines(first)
+            if length > 1: yield f"      if (count == {count_width}'d{length - 1}) next_state = {encode(following)};"
+            else: yield f"      next_state = {encode(following)};"
+            yield "    end"
+
+        yield f"    {label('S_DONE')}: begin"
+        yield "      result_en = 1'b1;"
+        yield "      done_next = 1'b1;"
+        yield f"      next_state = {encode('S_IDLE')};"
+        yield "    end"
+        if onehot:
+            # no bit set before reset or several after an upset: the defaults above, then back to idle
+            yield "    default: begin"
+            yield f"      next_state = {encode('S_IDLE')};"
+            yield "    end"
+        yield "  endcase"
+        yield "end"
+        yield "endmodule"
+
+    def _rom_controller_lines(self):
+        '''
+            Microcode controller: word holds the control word of run pc and how many cycles it is held after the
+            first. pc == RUNS is the done state.
+        '''
+        runs = self._state_runs()
+        fields = self._control_fields()
+        control_width = sum(width for _, width in fields)
+        repeat_width = max(1, max([length - 1 for _, length in runs], default=0).bit_length())
+        word_width = control_width + repeat_width
+        pc_width = max(1, len(runs).bit_length())
+
+        yield from self._controller_ports()
+
+        yield f"localparam RUNS = {len(runs)};"
+        yield "reg busy;"
+        yield f"reg [{pc_width - 1}:0] pc;"
+        yield f"reg [{repeat_width - 1}:0] count;"
+        yield "// control word of run pc, then the number of cycles it is held after the first"
+        yield f"reg [{word_width - 1}:0] word;"
+
+        yield "\n// Sequencer"
+        yield "always @(posedge clk or posedge rst) begin"
+        yield "  if (rst) begin"
+        yield "    busy <= 0;"
+        yield "    pc <= 0;"
+        yield "    count <= 0;"
+        yield "  end else if (!busy) begin"
+        yield "    busy <= start;"
+        yield "    pc <= 0;"
+        yield "    count <= 0;"
+        yield "  end else if (pc == RUNS) begin"
+        yield "    busy <= 0;"
+        yield f"  end else if (count == word[{repeat_width - 1}:0]) begin"
+        yield "    pc <= pc + 1;"
+        yield "    count <= 0;"
+        yield "  end else begin"
+        yield "    count <= count + 1;"
+        yield "  end"
+        yield "end"
+
+        yield "\n// Microcode ROM"
+        yield "always @(*) begin"
+        yield "  word = 0;"
+        yield "  if (busy) begin"
+        yield "    case (pc)"
+        for index, (first, length) in enumerate(runs):
+            values = self.control_word(first)
+            word = 0
+            for signal, width in fields:
+                word = (word << width) | (values.get(signal, 0) & ((1 << width) - 1))
+            word = (word << repeat_width) | (length - 1)
+            yield f"      {index}: word = {word_width}'h{word:x};"
+        yield "      default: word = 0;"
+        yield "    endcase"
+        yield "  end"
+        yield "end"
+
+        yield "\n// Output logic"
+        yield "always @(*) begin"
+        yield "  op_ready = !busy;"
+        low = word_width
+        for signal, width in fields:
+            low -= width
+            yield f"  {signal} = word[{low + width - 1}:{low}];" if width > 1 else f"  {signal} = word[{low}];"
+        yield "  result_en = busy && (pc == RUNS);"
+        yield "  done_next = result_en;"
+        yield "end"
+        yield "endmodule"
+
+class ModuloVerilogGenerator(VerilogGenerator):
+    '''
+        Generates a pipelined datapath and controller from a modulo schedule (ModuloScheduler), which start a new
+        evaluation every initiation_interval cycles.
+
+        The controller counts phases modulo the II. In phase p it drives the units for every cycle t of the schedule
+        with (t - 1) mod II == p, each for the evaluation that is in that cycle; the modulo reservation table keeps
+        them apart. Inputs and start are sampled in the last phase, while op_ready is high, and a valid bit per
+        pipeline stage follows every started evaluation until its outputs are written and done is raised.
+
+        Every value is written again by the next evaluation II cycles later, so results and inputs that are read
+        later than that are kept in shift register chains (see register_chains) instead of shared registers.
+    '''
+
+    def __init__(self, schedule_info: list[ScheduledNodeInfo], initiation_interval : int, intervals : dict = None,
+                 outputs : list[tuple] = None, index : ScheduleIndex = None):
+        self.initiation_interval = initiation_interval
+        super().__init__(schedule_info, intervals=intervals, share_registers=False, outputs=outputs, index=index)
+
+    def _allocate_registers(self, share_registers : bool):
+        self.schedule_length = self.index.max_time
+        self.chains = register_chains(self.schedule_info, self.initiation_interval, self.intervals,
+                                      outputs=[node for _, node in self.outputs])
+
+        # {node id: name of its chain}, results before inputs
+        self.chain_names = {info.node.id: f"reg_{info.node.op_type}{info.node.id}" for info in self.schedule_info}
+        # {node id: port name} of the inputs
+        self.input_ports = {}
+        identifiers = [operand for info in self.schedule_info for operand in info.node.operands] + [node for _, node in self.outputs]
+        for node in identifiers:
+            if isinstance(node, IdentifierNode) and node.id in self.chains:
+                self.chain_names[node.id] = f"in_{node.name}"
+                self.input_ports[node.id] = node.name
+        self.reg_names = {node_id: f"{name}_0" for node_id, name in self.chain_names.items()}
+        self.register_writers = {}
+
+    @property
+    def register_count(self):
+        return sum(self.chains.values())
+
+    def control_ports(self) -> list[tuple]:
+        # no register_writers, _control_fields only has the unit selects
+        chain_enables = [(f"{self.chain_names[info.node.id]}_en", 1) for info in self.schedule_info]
+        return self._control_fields() + [("in_en", 1)] + chain_enables + [("done_next", 1), ("result_en", 1)]
+
+    def _chain_registers(self, node_id):
+        return [f"{self.chain_names[node_id]}_{index}" for index in range(self.chains[node_id])]
+
+    def _get_operand_source(self, operand, consumer : ScheduledNodeInfo = None, cycle : int = None):
+        '''
+            Register of the chain that holds operand in cycle, by default the cycle the outputs are written in.
+        '''
+        if cycle is None:
+            cycle = self.schedule_length + 1
+        if isinstance(operand, IdentifierNode) and operand.value is None:
+            return f"{self.chain_names[operand.id]}_{chain_index(0, cycle, self.initiation_interval)}"
+        if isinstance(operand, OperatorNode) and operand.id in self.node_map:
+            produced = self._get_finish_time(self.node_map[operand.id])
+            return f"{self.chain_names[operand.id]}_{chain_index(produced, cycle, self.initiation_interval)}"
+        return super()._get_operand_source(operand)
+
+    def _build_mux_tables(self):
+        for resource_name, nodes in self.resources.items():
+            for op_idx in [0, 1]:
+                table = self.mux_tables[resource_name][op_idx]
+                for info in nodes:
+                    if not info.node.operands[op_idx]:
+                        continue
+                    for cycle in read_cycles(info, self.intervals):
+                        table.setdefault(self._get_operand_source(info.node.operands[op_idx], info, cycle), len(table))
+
+    def _build_state_tables(self):
+        '''
+            As in VerilogGenerator, but a state is a phase: cycle t of the schedule is driven in phase (t - 1) mod II.
+        '''
+        self.driven_at = defaultdict(list)
+        self.finished_at = defaultdict(list)
+        for info in self.schedule_info:
+            for cycle in read_cycles(info, self.intervals):
+                self.driven_at[(cycle - 1) % self.initiation_interval].append((info, cycle))
+            self.finished_at[(self._get_finish_time(info) - 1) % self.initiation_interval].append(info)
+
+    def _enable_assignments(self, info : ScheduledNodeInfo):
+        yield f"{self.chain_names[info.node.id]}_en", 1, "1'b1"
+
+    def _datapath_lines(self):
+
+        yield "module datapath("
+        yield "  input clk, rst,"
+
+        yield "  // Data Inputs"
+        for name in sorted(self.inputs):
+            yield f"  input [31:0] {name},"
+
+        yield "  // Control Signals from Controller"
+        yield from self._unit_control_ports("input")
+        yield "  input in_en,"
+        for info in self.schedule_info:
+            yield f"  input {self.chain_names[info.node.id]}_en,"
+        yield "  input done_next,"
+        yield "  input result_en,"
+
+        yield "  // Outputs"
+        for name, _ in self.outputs:
+            yield f"  output reg [31:0] {name},"
+        yield "  output reg done"
+        yield ");\n"
+
+        yield "// Wires for FU outputs and Mux outputs"
+        for res in sorted(self.resources.keys()):
+            yield f"wire [31:0] {res}_out;"
+            yield f"wire [31:0] {res}_op1, {res}_op2;"
+
+        yield "\n// Shift register chains of the values of overlapping evaluations"
+        for node_id in self.chain_names:
+            yield f"reg [31:0] {', '.join(self._chain_registers(node_id))};"
+
+        yield from self._unit_lines()
+
+        yield "// Register update logic"
+        yield "always @(posedge clk or posedge rst) begin"
+        yield "  if (rst) begin"
+        for node_id in self.chain_names:
+            for reg_name in self._chain_registers(node_id):
+                yield f"    {reg_name} <= 0;"
+        for name, _ in self.outputs:
+            yield f"    {name} <= 0;"
+        yield "    done <= 0;"
+        yield "  end else begin"
+        yield "    done <= done_next;"
+
+        # a write shifts the values of the earlier evaluations one register down the chain
+        for node_id, name in self.chain_names.items():
+            registers = self._chain_registers(node_id)
+            if node_id in self.node_map:
+                enable, source = f"{name}_en", f"{self._get_resource_name(self.node_map[node_id])}_out"
             else:
-                pass
-        
-        lines.append("  input done_next, result_en,")
+                enable, source = "in_en", self.input_ports[node_id]
+            yield f"    if ({enable}) begin"
+            yield f"      {registers[0]} <= {source};"
+            for previous, register in zip(registers, registers[1:]):
+                yield f"      {register} <= {previous};"
+            yield "    end"
+        for name, node in self.outputs:
+            yield f"    if (result_en) {name} <= {self._get_operand_source(node)};"
+        yield "  end"
+        yield "end\n"
+        yield "endmodule"
+
+    def _controller_lines(self):
+        interval = self.initiation_interval
+        length = self.schedule_length
+        phase_width = max(1, (interval - 1).bit_length())
+        # stage of the cycle after the last one, in which the outputs are written
+        stages = length // interval + 1
+
+        yield "module controller("
+        yield "  input clk, rst, start,"
+        yield "  output reg op_ready,"
+        yield from self._unit_control_ports("output reg")
+        yield "  output reg in_en,"
+        for info in self.schedule_info:
+            yield f"  output reg {self.chain_names[info.node.id]}_en,"
+        yield "  output reg done_next, result_en"
+        yield ");\n"
+
+        yield f"localparam II = {interval}, LAST_PHASE = {interval - 1};"
+        yield f"reg [{phase_width - 1}:0] phase;"
+        yield "// valid[s]: the evaluation in pipeline stage s was started"
+        yield f"reg [{stages - 1}:0] valid;"
+
+        yield "\n// Phase and valid bits"
+        yield "always @(posedge clk or posedge rst) begin"
+        yield "  if (rst) begin"
+        yield "    phase <= 0;"
+        yield "    valid <= 0;"
+        yield "  end else begin"
+        yield "    phase <= (phase == LAST_PHASE) ? 0 : phase + 1;"
+        if stages > 1:
+            yield f"    if (phase == LAST_PHASE) valid <= {{valid[{stages - 2}:0], start}};"
+        else:
+            yield "    if (phase == LAST_PHASE) valid <= start;"
+        yield "  end"
+        yield "end"
+
+        yield "\n// Output logic"
+        yield "always @(*) begin"
+        yield "  op_ready = (phase == LAST_PHASE);"
+        yield "  in_en = (phase == LAST_PHASE);"
         for info in self.schedule_info:
-            lines.append(f"  input {self._get_reg_name(info.node.id)}_en,")
-        
-        lines.append("  // Outputs")    
-        lines.append("  output reg [31:0] result,")
-        lines.append("  output reg done")
-        lines.append(");\n")
-
-    #     for res in sorted(self.resources.keys()):
-    #         lines.append(f"wire [31:0] {res}_out, {res}_op1, {res}_op2;")
-    #         if "alu" in res.lower():
-    #             lines.append(f"wire {res}_zero, {res}_greater, {res}_less;")
-    #         if "logic" in res.lower():
-    #             lines.append(f"wire {res}_eq;") # برای Eq, NotEq
-
-    #     lines.append("\n// Registers")
-    #     for info in self.schedule_info:
-    #         lines.append(f"reg [31:0] {self._get_reg_name(info.node.id)};")
-
-    #     lines.append("\n// Muxing Logic")
-    #     for res in sorted(self.resources.keys()):
-    #         for op_idx in [0, 1]:
-    #             suffix = "1" if op_idx == 0 else "2"
-    #             lines.append(f"reg [31:0] {res}_op{suffix}_reg;")
-    #             lines.append(f"always @(*) begin")
-    #             lines.append(f"  case ({res}_sel{suffix})")
-    #             for src, sel_val in self.mux_tables[res][op_idx].items():
-    #                 lines.append(f"    4'd{sel_val}: {res}_op{suffix}_reg = {src};")
-    #             lines.append(f"    default: {res}_op{suffix}_reg = 0;")
-    #             lines.append(f"  endcase")
-    #             lines.append(f"end")
-    #             lines.append(f"assign {res}_op{suffix} = {res}_op{suffix}_reg;")
-
-    #     lines.append("\n// Functional Units Logic")
-    #     for res in sorted(self.resources.keys()):
-    #         res_lower = res.lower()
-    #         lines.append(f"// {res.upper()} Unit")
-    #         lines.append(f"reg [31:0] {res}_out_reg;")
-            
-    #         if "alu" in res_lower:
-    #             lines.append(f"wire [31:0] {res}_diff = {res}_op1 - {res}_op2;")
-    #             lines.append(f"assign {res}_zero = ({res}_diff == 0);")
-    #             lines.append(f"assign {res}_less = {res}_diff[31];") # علامت منفی
-    #             lines.append(f"assign {res}_greater = (!{res}_diff[31] && !{res}_zero);")
-                
-    #             lines.append(f"always @(*) begin")
-    #             lines.append(f"  case ({res}_op)")
-    #             lines.append(f"    2'd0: {res}_out_reg = {res}_op1 + {res}_op2;")
-    #             lines.append(f"    2'd1: {res}_out_reg = {res}_diff;") # Sub
-    #             lines.append(f"    2'd2: {res}_out_reg = -{res}_op1;")  # USub
-    #             lines.append(f"    default: {res}_out_reg = 0;")
-    #             lines.append(f"  endcase")
-    #             lines.append(f"end")
-            
-    #         elif "logic" in res_lower:
-    #             lines.append(f"assign {res}_eq = ({res}_op1 == {res}_op2);")
-                
-    #             lines.append(f"always @(*) begin")
-    #             lines.append(f"  case ({res}_op)")
-    #             lines.append(f"    2'd0: {res}_out_reg = {res}_op1 & {res}_op2;")
-    #             lines.append(f"    2'd1: {res}_out_reg = {res}_op1 | {res}_op2;")
-    #             lines.append(f"    2'd2: {res}_out_reg = {res}_op1 ^ {res}_op2;")
-    #             lines.append(f"    2'd3: {res}_out_reg = ~{res}_op1;")
-    #             lines.append(f"    default: {res}_out_reg = 0;")
-    #             lines.append(f"  endcase")
-    #             lines.append(f"end")
-            
-    #         elif "mul" in res_lower:
-    #             lines.append(f"always @(*) case ({res}_op)")
-    #             lines.append(f"  1'd0: {res}_out_reg = {res}_op1 * {res}_op2;")
-    #             lines.append(f"  1'd1: {res}_out_reg = {res}_op1 / {res}_op2;")
-    #             lines.append(f"  default: {res}_out_reg = 0;")
-    #             lines.append(f"endcase")
-    #         elif "shift" in res_lower:
-    #             lines.append(f"always @(*) case ({res}_op)")
-    #             lines.append(f"  1'd0: {res}_out_reg = {res}_op1 << {res}_op2;")
-    #             lines.append(f"  1'd1: {res}_out_reg = {res}_op1 >> {res}_op2;")
-    #             lines.append(f"  default: {res}_out_reg = 0;")
-    #             lines.append(f"endcase")
-
-    #         lines.append(f"assign {res}_out = {res}_out_reg;")
-
-    #     lines.append("\n// Register Update Logic")
-    #     lines.append("always @(posedge clk or posedge rst) begin")
-    #     lines.append("  if (rst) begin")
-    #     for info in self.schedule_info: lines.append(f"    {self._get_reg_name(info.node.id)} <= 0;")
-    #     lines.append("    result <= 0; done <= 0;")
-    #     lines.append("  end else begin")
-    #     lines.append("    done <= done_next;")
-        
-    #     for info in self.schedule_info:
-    #         reg_name = self._get_reg_name(info.node.id)
-    #         res_prefix = f"{info.node.op_type}{info.resource_num}" # e.g. alu1
-    #         op_type = type(info.node.op)
-            
-            
-    #         source_wire = f"{res_prefix}_out" 
-    #         if op_type == ast.Lt:   source_wire = f"{{31'b0, {res_prefix}_less}}"
-    #         elif op_type == ast.Gt: source_wire = f"{{31'b0, {res_prefix}_greater}}"
-    #         elif op_type == ast.LtE: source_wire = f"{{31'b0, ({res_prefix}_less | {res_prefix}_zero)}}" # L or Z
-    #         elif op_type == ast.GtE: source_wire = f"{{31'b0, ({res_prefix}_greater | {res_prefix}_zero)}}" # G or Z
-            
-    #         elif op_type == ast.Eq:    source_wire = f"{{31'b0, {res_prefix}_eq}}"
-    #         elif op_type == ast.NotEq: source_wire = f"{{31'b0, !{res_prefix}_eq}}"
-            
-    #         lines.append(f"    if ({reg_name}_en) {reg_name} <= {source_wire};")
-
-    #     lines.append("    if (result_en) result <= alu1_out; // Simplification")
-    #     lines.append("  end")
-    #     lines.append("end")
-    #     lines.append("endmodule")
-    #     return "\n".join(lines)
-
-    # def generate_controller(self):
-    #     lines = []
-    #     max_time = max([info.scheduled_time for info in self.schedule_info]) if self.schedule_info else 0
-        
-    #     lines.append("module controller(")
-    #     lines.append("  input clk, rst, start,")
-    #     lines.append("  output reg op_ready,")
-        
-    #     output_decls = []
-    #     for res in sorted(self.resources.keys()):
-    #         op_width = self.get_op_width(res)
-    #         output_decls.append(f"  output reg [3:0] {res}_sel1, {res}_sel2")
-    #         output_decls.append(f"  output reg [{op_width-1}:0] {res}_op")
-    #     if output_decls: lines.append(",\n".join(output_decls) + ",")
-        
-    #     lines.append("  output reg done_next, result_en,")
-    #     reg_enables = [f"  output reg {self._get_reg_name(info.node.id)}_en" for info in self.schedule_info]
-    #     if reg_enables: lines.append(",\n".join(reg_enables))
-    #     lines.append(");\n")
-
-    #     lines.append("reg [31:0] state, next_state;")
-    #     lines.append("localparam S_IDLE = 0, S_DONE = 1000;")
-    #     for t in range(1, max_time + 1): lines.append(f"localparam S_CYCLE_{t} = {t};")
-        
-    #     lines.append("\nalways @(posedge clk or posedge rst) begin")
-    #     lines.append("  if (rst) state <= S_IDLE; else state <= next_state;")
-    #     lines.append("end")
-
-    #     lines.append("\nalways @(*) begin")
-    #     lines.append("  op_ready = 0; next_state = state; result_en = 0; done_next = 0;")
-    #     for info in self.schedule_info: lines.append(f"  {self._get_reg_name(info.node.id)}_en = 0;")
-    #     for res in self.resources: lines.append(f"  {res}_sel1 = 0; {res}_sel2 = 0; {res}_op = 0;")
-
-    #     lines.append("  case (state)")
-    #     lines.append("    S_IDLE: begin op_ready = 1; if (start) next_state = S_CYCLE_1; end")
-        
-    #     nodes_by_time = defaultdict(list)
-    #     for info in self.schedule_info: nodes_by_time[info.scheduled_time].append(info)
-
-    #     for t in range(1, max_time + 1):
-    #         lines.append(f"    S_CYCLE_{t}: begin")
-    #         for info in nodes_by_time[t]:
-    #             res = f"{info.node.op_type}{info.resource_num}"
-    #             reg_name = self._get_reg_name(info.node.id)
-    #             op_val = self.op_codes.get(type(info.node.op), 0)
-    #             op_width = self.get_op_width(res)
-                
-    #             lines.append(f"      {res}_op = {op_width}'d{op_val};")
-                
-    #             if info.node.operands[0]:
-    #                 src = self.get_operand_source(info.node.operands[0])
-    #                 lines.append(f"      {res}_sel1 = {self.mux_tables[res][0].get(src, 0)};")
-    #             if info.node.operands[1]:
-    #                 src = self.get_operand_source(info.node.operands[1])
-    #                 lines.append(f"      {res}_sel2 = {self.mux_tables[res][1].get(src, 0)};")
-                
-    #             lines.append(f"      {reg_name}_en = 1;")
-            
-    #         if t < max_time: lines.append(f"      next_state = S_CYCLE_{t+1};")
-    #         else: lines.append("      result_en = 1; next_state = S_DONE;")
-    #         lines.append("    end")
-
-    #     lines.append("    S_DONE: begin done_next = 1; next_state = S_IDLE; end")
-    #     lines.append("  endcase")
-    #     lines.append("end")
-    #     lines.append("endmodule")
-    #     return "\n".join(lines)
-
-def generate_verilog(folder_path : str, schedule_info : list[ScheduledNodeInfo]):
-    
-    generator = VerilogGenerator(schedule_info)
-    
-    datapath_code = generator.generate_datapath()
-    controller_code = generator.generate_controller()
-    
+            yield f"  {self.chain_names[info.node.id]}_en = 0;"
+        for res in sorted(self.resources.keys()): yield f"  {res}_sel1 = 0; {res}_sel2 = 0; {res}_op = 0;"
+
+        yield "\n  case (phase)"
+        for phase in range(interval):
+            yield f"    {phase}: begin"
+            yield from self._state_lines(phase)
+            yield "    end"
+        yield "  endcase\n"
+
+        yield f"  result_en = (phase == {length % interval}) && valid[{length // interval}];"
+        yield "  done_next = result_en;"
+        yield "end"
+        yield "endmodule"
+
+def generate_verilog(folder_path : str, schedule_info : list[ScheduledNodeInfo], intervals : dict = None, share_registers : bool = True,
+                     outputs : list[tuple] = None, initiation_interval : int = None, index : ScheduleIndex = None,
+                     fsm_encoding : str = "binary", merge_runs : bool = False):
+
+    if initiation_interval is not None:
+        # the phase counter of a pipelined controller has no per-cycle states to encode
+        generator = ModuloVerilogGenerator(schedule_info, initiation_interval=initiation_interval, intervals=intervals, outputs=outputs, index=index)
+    else:
+        generator = VerilogGenerator(schedule_info, intervals=intervals, share_registers=share_registers, outputs=outputs, index=index,
+                                     fsm_encoding=fsm_encoding, merge_runs=merge_runs)
+
     output_dir = os.path.join(folder_path, "codes")
     os.makedirs(output_dir, exist_ok=True)
-    
+
+    # streamed, a design with thousands of states never has the text of a module in memory
     with open(os.path.join(output_dir, "Datapath.v"), "w") as f:
-        f.write(datapath_code)
-        
+        generator.write_datapath(f)
+
     with open(os.path.join(output_dir, "Controller.v"), "w") as f:
-        f.write(controller_code)
-        
-    print("Verilog generated")
\ No newline at end of file
+        generator.write_controller(f)
+
+    print(f"Verilog generated ({generator.register_count} registers for {len(schedule_info)} operators)")
+    return generator
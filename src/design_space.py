@@ -0,0 +1,222 @@
+import os
+import csv
+import json
+import math
+import itertools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from .dfg_creator import BaseNode, outputs_of
+from .dfg_analysis import DFGAnalysis
+from .dfg_store import DFGStore
+from .scheduler import MinLatencyScheduler, MinResourceScheduler, chained_latencies
+from .register_allocation import value_lifetimes, left_edge
+from typing import List, Optional
+
+MIN_RESOURCE_RUN = "MinResourceLatencyConstrained"
+MIN_LATENCY_RUN = "MinLatencyResourceContrained"
+
+PARETO_CSV_FIELDS = ["latency", "fu_count", "registers", "algorithm", "bound", "resources"]
+
+# DFG, analysis and unit timing of the current process, set once per worker so every run reuses them
+_state = {}
+
+
+def dominates(point : dict, other : dict) -> bool:
+    '''
+        True if point is at least as good as other in latency, FU count and registers, and better in one of them.
+    '''
+    keys = ("latency", "fu_count", "registers")
+    return all(point[key] <= other[key] for key in keys) and any(point[key] < other[key] for key in keys)
+
+
+def pareto_front(points : List[dict]) -> List[dict]:
+    '''
+        Returns the points that no other point dominates, one per (latency, FU count, registers), sorted by latency.
+    '''
+    front = {}
+    for point in sorted(points, key=lambda point: (point["latency"], point["fu_count"], point["registers"])):
+        if any(dominates(other, point) for other in front.values()):
+            continue
+        front.setdefault((point["latency"], point["fu_count"], point["registers"]), point)
+    return list(front.values())
+
+
+def _init_worker(store : DFGStore, timing : dict) -> None:
+    root = store.root()
+    _state["root"] = root
+    _state["analysis"] = DFGAnalysis(root, latencies=timing["latencies"])
+    _state["timing"] = timing
+
+
+def _run_point(algorithm : str, bound) -> Optional[dict]:
+    '''
+        Schedules the DFG of this process once and measures the result. bound is MaxTime for MIN_RESOURCE_RUN and a
+        resource vector for MIN_LATENCY_RUN. Returns None if the bound cannot be met.
+    '''
+    root, analysis, timing = _state["root"], _state["analysis"], _state["timing"]
+    try:
+        if algorithm == MIN_RESOURCE_RUN:
+            scheduler = MinResourceScheduler(dfg_root=root, numof_resources=None, max_time=bound, analysis=analysis, **timing)
+        else:
+            scheduler = MinLatencyScheduler(dfg_root=root, numof_resources=dict(bound), analysis=analysis, **timing)
+        scheduler.schedule()
+    except RuntimeError:
+        return None
+
+    schedule_info = scheduler.scheduled_nodes_info
+    scheduled = {info.node.id for info in schedule_info}
+    outputs = [node.id for node in outputs_of(root) if node.id in scheduled]
+    used_types = {node.op_type for node in analysis.nodes}
+    resources = {resource_type: scheduler.numof_resources.get(resource_type, 0) for resource_type in sorted(used_types)}
+    return {
+        "algorithm": algorithm,
+        "bound": bound,
+        "latency": max((info.scheduled_time + info.duration_cycles - 1 for info in schedule_info), default=0),
+        "fu_count": sum(resources.values()),
+        # the registers the code generator allocates, left edge on the same lifetimes
+        "registers": len(set(left_edge(value_lifetimes(schedule_info, timing["intervals"], outputs=outputs)).values())),
+        "resources": resources,
+    }
+
+
+class DesignSpaceExplorer:
+    '''
+        Sweeps latency bounds with MinResourceScheduler and resource vectors with MinLatencyScheduler and keeps the
+        Pareto front of (latency, FU count, registers).
+
+        The DFG is parsed once. Worker processes get it as a DFGStore and analyze it once, so every run only pays for
+        the list scheduling itself. Runs are submitted in order of their bounds, and a run is skipped when a point
+        already found is at least as good as the best latency and FU count that run could reach. Registers are not
+        known before a run, so the pruning is on latency and FU count only; prune=False runs every bound.
+    '''
+
+    def __init__(self, dfg_root : BaseNode, analysis : DFGAnalysis = None, workers : int = None,
+                 latencies : dict = None, intervals : dict = None, clock_period : float = None, delays : dict = None):
+        self.root = dfg_root
+        # the latencies the schedulers use, with the types slower than the clock period
+        self.latencies = chained_latencies(latencies, clock_period, delays)
+        self.intervals = intervals or {}
+        # keyword arguments of the schedulers for multi-cycle units and chaining
+        self.timing = {"latencies": self.latencies, "intervals": self.intervals, "clock_period": clock_period, "delays": delays}
+        self.analysis = analysis if analysis is not None else DFGAnalysis(dfg_root, latencies=self.latencies)
+        self.workers = workers
+
+        self.counts = {}
+        for node in self.analysis.nodes:
+            self.counts[node.op_type] = self.counts.get(node.op_type, 0) + 1
+
+        self.points : List[dict] = []
+        self.pruned = 0
+        self.infeasible = 0
+
+    def default_latency_bounds(self) -> List[int]:
+        critical_path = self.analysis.critical_path
+        return list(range(critical_path, 2 * critical_path + 1))
+
+    def default_resource_vectors(self) -> List[dict]:
+        '''
+            Every vector from one unit per resource type up to the widest ASAP level of that type.
+        '''
+        widths = {}
+        for node in self.analysis.nodes:
+            key = (node.op_type, self.analysis.asap[node.id])
+            widths[key] = widths.get(key, 0) + 1
+        limits = {resource_type: max(count for (key_type, _), count in widths.items() if key_type == resource_type)
+                  for resource_type in self.counts}
+        return self.resource_vectors({resource_type: [1, limit] for resource_type, limit in limits.items()})
+
+    def resource_vectors(self, ranges : dict) -> List[dict]:
+        '''
+            Expands {resource_type: [low, high]} into all resource vectors, smallest totals first.
+        '''
+        resource_types = sorted(ranges)
+        vectors = [dict(zip(resource_types, counts)) for counts in
+                   itertools.product(*(range(ranges[resource_type][0], ranges[resource_type][1] + 1) for resource_type in resource_types))]
+        return sorted(vectors, key=lambda vector: (sum(vector.values()), sorted(vector.items())))
+
+    def _lower_bounds(self, algorithm : str, bound) -> tuple:
+        '''
+            Best (latency, FU count) a run could reach.
+        '''
+        critical_path = self.analysis.critical_path
+        if algorithm == MIN_RESOURCE_RUN:
+            return critical_path, sum(max(1, math.ceil(count / bound)) for count in self.counts.values())
+
+        latency = critical_path
+        for resource_type, count in self.counts.items():
+            if bound.get(resource_type, 0) <= 0:
+                return math.inf, 0
+            # the last of the issues on the busiest unit starts after the ones before it and still has to finish
+            cycles = self.latencies.get(resource_type, 1)
+            interval = self.intervals.get(resource_type, cycles)
+            latency = max(latency, (math.ceil(count / bound[resource_type]) - 1) * interval + cycles)
+        return latency, sum(bound.get(resource_type, 0) for resource_type in self.counts)
+
+    def _is_dominated(self, algorithm : str, bound) -> bool:
+        latency, fu_count = self._lower_bounds(algorithm, bound)
+        if latency == math.inf:
+            return True
+        return any(point["latency"] <= latency and point["fu_count"] <= fu_count for point in self.points)
+
+    def explore(self, latency_bounds : List[int] = None, resource_vectors : List[dict] = None, prune : bool = True) -> List[dict]:
+        '''
+            Runs the sweep and returns the Pareto front. All measured points are kept in self.points.
+        '''
+        if latency_bounds is None:
+            latency_bounds = self.default_latency_bounds()
+        if resource_vectors is None:
+            resource_vectors = self.default_resource_vectors()
+
+        runs = [(MIN_RESOURCE_RUN, bound) for bound in sorted(latency_bounds)] + \
+            [(MIN_LATENCY_RUN, vector) for vector in resource_vectors]
+
+        def submit_next(submit) -> bool:
+            while runs:
+                algorithm, bound = runs.pop(0)
+                if prune and self._is_dominated(algorithm, bound):
+                    self.pruned += 1
+                    continue
+                submit(algorithm, bound)
+                return True
+            return False
+
+        def record(point : Optional[dict]) -> None:
+            if point is None:
+                self.infeasible += 1
+            else:
+                self.points.append(point)
+
+        if self.workers == 1:
+            _state["root"], _state["analysis"] = self.root, self.analysis
+            _state["timing"] = self.timing
+            while submit_next(lambda algorithm, bound: record(_run_point(algorithm, bound))):
+                pass
+            return pareto_front(self.points)
+
+        # only a few runs are in flight at a time, so later runs can be pruned by the points of earlier ones
+        window = 2 * (self.workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(DFGStore.from_dfg(self.root), self.timing)) as executor:
+            pending = set()
+            while runs or pending:
+                while len(pending) < window and submit_next(lambda algorithm, bound: pending.add(executor.submit(_run_point, algorithm, bound))):
+                    pass
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    record(future.result())
+
+        return pareto_front(self.points)
+
+    def save(self, folder_path : str) -> None:
+        '''
+            Writes every measured point and the Pareto front to dse.json and the front alone to pareto.csv.
+        '''
+        front = pareto_front(self.points)
+        with open(folder_path + "/dse.json", "w") as file:
+            json.dump({"pareto_front": front, "points": self.points, "pruned": self.pruned, "infeasible": self.infeasible}, file, indent=4)
+
+        with open(folder_path + "/pareto.csv", "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=PARETO_CSV_FIELDS)
+            writer.writeheader()
+            for point in front:
+                writer.writerow({**point, "bound": json.dumps(point["bound"]), "resources": json.dumps(point["resources"])})
@@ -0,0 +1,205 @@
+from .dfg_creator import BaseNode, OperatorNode, OutputNode, outputs_of
+from typing import List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# the level-by-level NumPy pass runs one step per DFG level, so it only pays off for large and wide DFGs
+VECTORIZE_MIN_NODES = 10000
+VECTORIZE_MIN_WIDTH = 32
+
+
+def topological_order(root : BaseNode, ids : list = None) -> List[OperatorNode]:
+    '''
+        Returns the OperatorNodes reachable from root, every node after all of its operands.
+        Shared nodes are visited once, so the pass is linear in the size of the DAG.
+        An OutputNode root is not returned, only the nodes of its outputs.
+        With an ids list, the id, left and right operand id of every returned node are appended to it in the same
+        pass, -1 for a missing operand.
+    '''
+    order = []
+    visited = set()
+    stack = [(root, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            order.append(node)
+            if ids is not None:
+                left, right = node.operands
+                ids.append(node.id)
+                ids.append(left.id if left is not None else -1)
+                ids.append(right.id if right is not None else -1)
+            continue
+
+        if isinstance(node, OutputNode):
+            for operand in reversed(node.operands):
+                stack.append((operand, False))
+            continue
+
+        if not isinstance(node, OperatorNode) or node.id in visited:
+            continue
+
+        visited.add(node.id)
+        stack.append((node, True))
+        for operand in reversed(node.operands):
+            stack.append((operand, False))
+
+    return order
+
+
+class DFGAnalysis:
+    '''
+        Static timing analysis of a DFG, computed once and shared by the schedulers and the visualizers.
+        All per-node values are flat lists indexed by node id; entries of IdentifierNode ids are 0.
+
+        priorities  - cycles from the start of the node to the end of the last output it feeds, minus one; with
+                      single-cycle units this is the length of the longest path from the node up to an output
+                      (outputs have priority 0)
+        asap        - earliest clock cycle of the node, i.e. the number of operators on the longest path down to a leaf
+        min_latency - longest path from the root down to a leaf, counting the leaf
+
+        latencies maps a resource type to the number of cycles its operations take, 1 for missing types.
+    '''
+
+    def __init__(self, root : BaseNode, vectorized : bool = None, latencies : dict = None):
+        self.root = root
+        self.latencies = latencies or {}
+        # (id, left, right operand id) of every node, collected by the topological pass for the vectorized pass
+        self._ids = []
+        self.nodes : List[OperatorNode] = topological_order(root, ids=self._ids)
+
+        self.num_ids = 1 + max(root.id, max(self._ids, default=-1))
+        self.priorities : List[int] = [0] * self.num_ids
+        self.asap : List[int] = [0] * self.num_ids
+        self.min_latency = 1
+
+        single_cycle = all(latency == 1 for latency in self.latencies.values())
+        if vectorized is None:
+            vectorized = np is not None and single_cycle and len(self.nodes) >= VECTORIZE_MIN_NODES and \
+                len(self.nodes) >= VECTORIZE_MIN_WIDTH * (1 + max(node.depth for node in self.nodes))
+        elif vectorized and np is None:
+            raise ImportError("the vectorized DFG analysis needs numpy")
+        elif vectorized and not single_cycle:
+            raise ValueError("the vectorized DFG analysis only supports single-cycle units")
+
+        if vectorized:
+            self._analyze_vectorized()
+        else:
+            self._analyze()
+
+    def latency(self, node : OperatorNode) -> int:
+        return self.latencies.get(node.op_type, 1)
+
+    def _analyze(self) -> None:
+        for node in self.nodes:
+            earliest = 1
+            for operand in node.operands:
+                if isinstance(operand, OperatorNode):
+                    earliest = max(earliest, self.asap[operand.id] + self.latency(operand))
+            self.asap[node.id] = earliest
+
+        for output in outputs_of(self.root):
+            if isinstance(output, OperatorNode):
+                self.priorities[output.id] = max(self.priorities[output.id], self.latency(output) - 1)
+        for node in reversed(self.nodes):
+            level = self.priorities[node.id]
+            for operand in node.operands:
+                if isinstance(operand, OperatorNode):
+                    self.priorities[operand.id] = max(self.priorities[operand.id], level + self.latency(operand))
+                else:
+                    self.min_latency = max(self.min_latency, level + 2)
+
+    def _analyze_vectorized(self) -> None:
+        ids = np.array(self._ids, dtype=np.int64).reshape(-1, 3)
+        operator_ids, left, right = ids[:, 0], ids[:, 1], ids[:, 2]
+
+        asap, priorities, self.min_latency = vectorized_levels(self.num_ids, operator_ids, left, right)
+        self.asap = asap.tolist()
+        self.priorities = priorities.tolist()
+
+    @property
+    def critical_path(self) -> int:
+        '''
+            Number of cycles of the shortest possible schedule.
+        '''
+        return max([self.asap[node.id] + self.latency(node) - 1 for node in self.nodes], default=0)
+
+    def alap(self, max_time : int) -> List[int]:
+        '''
+            Latest start cycle of every node for a schedule that must end by max_time.
+        '''
+        return [max_time - priority for priority in self.priorities]
+
+    def mobility(self, max_time : int) -> List[int]:
+        '''
+            Number of cycles every node can be delayed past its ASAP time without exceeding max_time.
+        '''
+        return [latest - earliest for latest, earliest in zip(self.alap(max_time), self.asap)]
+
+
+def vectorized_levels(num_ids : int, operator_ids, left, right) -> tuple:
+    '''
+        Computes ASAP times and priorities with level-by-level NumPy reductions.
+
+        operator_ids - ids of the operator nodes
+        left, right  - operand ids of every operator, -1 if there is no operand; together they are a CSR
+                       operand matrix with a fixed row width of 2, so no indptr array is needed
+        Returns (asap, priorities, min_latency), the arrays are indexed by node id like DFGAnalysis's lists.
+    '''
+    count = len(operator_ids)
+    is_operator = np.zeros(num_ids, dtype=bool)
+    is_operator[operator_ids] = True
+    position = np.full(num_ids, -1, dtype=np.int64)
+    position[operator_ids] = np.arange(count)
+
+    # operand positions of every operator, -1 for identifiers and missing operands
+    operands = np.stack([left, right], axis=1)
+    operand_is_operator = (operands >= 0) & is_operator[np.maximum(operands, 0)]
+    operand_pos = np.where(operand_is_operator, position[np.maximum(operands, 0)], -1)
+
+    # successor CSR: for every operator, the operators that use its result
+    edge_mask = operand_is_operator.ravel()
+    edge_src = operand_pos.ravel()[edge_mask]
+    edge_dst = np.repeat(np.arange(count), 2)[edge_mask]
+    successors = edge_dst[np.argsort(edge_src, kind="stable")]
+    successor_ptr = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(edge_src, minlength=count), out=successor_ptr[1:])
+
+    # ASAP: peel the DAG level by level, a node is ready once all of its operator operands are done
+    pending = operand_is_operator.sum(axis=1)
+    asap = np.zeros(count, dtype=np.int64)
+    levels = []
+    frontier = np.flatnonzero(pending == 0)
+    level = 1
+    while frontier.size:
+        asap[frontier] = level
+        levels.append(frontier)
+
+        starts = successor_ptr[frontier]
+        sizes = successor_ptr[frontier + 1] - starts
+        total = int(sizes.sum())
+        if total == 0:
+            break
+        users = successors[np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(total)]
+        np.subtract.at(pending, users, 1)
+        users = np.unique(users)
+        frontier = users[pending[users] == 0]
+        level += 1
+
+    # priorities: every user sits on a higher level than its operands, so walk the levels top down
+    priorities = np.zeros(count, dtype=np.int64)
+    for frontier in reversed(levels):
+        rows = operand_pos[frontier]
+        mask = rows >= 0
+        np.maximum.at(priorities, rows[mask], np.repeat(priorities[frontier], 2)[mask.ravel()] + 1)
+
+    has_leaf = ~operand_is_operator.all(axis=1)
+    min_latency = int(priorities[has_leaf].max()) + 2 if has_leaf.any() else 1
+
+    asap_by_id = np.zeros(num_ids, dtype=np.int64)
+    asap_by_id[operator_ids] = asap
+    priorities_by_id = np.zeros(num_ids, dtype=np.int64)
+    priorities_by_id[operator_ids] = priorities
+    return asap_by_id, priorities_by_id, min_latency
@@ -4,6 +4,9 @@ from typing import Optional, List
 
 OP_TYPES = ["ALU", "mult", "shift", "logic", "pow"]
 
+# combinational delay of every op class in ns, used to chain operations within a clock period
+OP_DELAYS = {"ALU": 2.5, "mult": 8.0, "shift": 1.5, "logic": 1.0, "pow": 20.0}
+
 op_map = {
     ast.Add: "ALU", ast.Sub: "ALU",
     ast.Mult: "mult", ast.Div: "mult", ast.FloorDiv: "mult", ast.Mod: "mult",
@@ -11,7 +14,7 @@ op_map = {
     ast.LShift: "shift", ast.RShift: "shift",
     ast.BitAnd: "logic", ast.BitOr: "logic", ast.BitXor: "logic",
     ast.Invert: "logic", 
-    ast.USub: "َALU", #-x = (~x) + 1
+    ast.USub: "ALU", #-x = (~x) + 1
     ast.Eq: "logic", ast.NotEq: "logic", ast.Lt: "ALU", ast.LtE: "ALU", ast.Gt: "ALU", ast.GtE: "ALU",
 }
 
@@ -39,6 +42,9 @@ symbols = {
     }
 
 class BaseNode(ABC):
+    # nodes are created once per operator, so they skip the per-instance __dict__
+    __slots__ = ("operands", "depth", "id", "name")
+
     def __init__(self, depth : int, id : int, name : str):
         self.operands: List[Optional['BaseNode']] = []
         self.depth = depth
@@ -50,6 +56,8 @@ class BaseNode(ABC):
         pass
 
 class IdentifierNode(BaseNode):
+    __slots__ = ("value",)
+
     def __init__(self, name: str, depth: int, id: int, value=None):
         super().__init__(depth=depth, id=id, name=str(name))
         self.operands = [None, None]
@@ -61,10 +69,13 @@ class IdentifierNode(BaseNode):
         return f"[id={self.id}] {self.name}"
     
 class OperatorNode(BaseNode):
+    __slots__ = ("op_type", "op")
+
     def __init__(self, op_type: str, op: ast.operator | ast.unaryop | ast.cmpop, left_operand: BaseNode, right_operand: Optional[BaseNode], depth : int, id : int, name :str):
         super().__init__(depth=depth, id=id, name=name)
-        if op_type not in op_map.values():
-            raise ValueError(f"op_type must be one of {list(op_map.values())}")
+        # the unit types the schedulers and the code generator know, a typo in op_map fails here
+        if op_type not in OP_TYPES:
+            raise ValueError(f"op_type must be one of {OP_TYPES}")
 
         self.op_type = op_type
         self.op = op 
@@ -81,6 +92,27 @@ class OperatorNode(BaseNode):
         left_name = get_operand_name(self.operands[0])
         right_name = get_operand_name(self.operands[1]) if self.operands[1] else ""
         return f"{self.op_type} ['{left_name}', '{right_name}'] (depth={self.depth})"
+
+class OutputNode(BaseNode):
+    '''
+        Sink of a multi-output DFG. Its operands are the nodes computing the outputs, names their port names.
+        It is not an operation, so it is never scheduled.
+    '''
+    __slots__ = ("names",)
+
+    def __init__(self, names : List[str], roots : List[BaseNode], id : int):
+        super().__init__(depth=-1, id=id, name="outputs")
+        self.names = list(names)
+        self.operands = list(roots)
+
+    def __repr__(self) -> str:
+        return f"[id={self.id}] outputs {self.names}"
+
+def outputs_of(root : BaseNode) -> List[BaseNode]:
+    '''
+        The nodes computing the outputs of a DFG: the operands of an OutputNode, or the root itself.
+    '''
+    return root.operands if isinstance(root, OutputNode) else [root]
   
 def resource_allocator(node : OperatorNode) -> str:
     return "mult" if (node.op_type == "mult") else node.op_type
@@ -88,105 +120,119 @@ def resource_allocator(node : OperatorNode) -> str:
 class GraphBuilder:
     def __init__(self):
         self.all_nodes = []
+        # identifiers and ids are kept across build calls, so the expressions of build_outputs share their inputs
+        self.visited_identifiers = dict()
+        self.next_id = 0
         
-    def build(self, tree):
+    def build_outputs(self, assignments : List[tuple], outputs : List[str] = None) -> OutputNode:
+        '''
+            Builds one DFG for a list of (name, expression AST) assignments and returns its OutputNode.
+            A name assigned earlier in the list refers to the node computing it, so outputs share their subexpressions.
+            Every assigned name is an output, or only the names in outputs if it is given; a name assigned twice
+            outputs its last value.
+        '''
+        assigned = dict()
+        for name, tree in assignments:
+            assigned[name] = self.build(tree, assigned=assigned)
 
-        visited_identifiers = dict()
-        node_id = 0
+        names = [name for name in assigned if outputs is None or name in outputs]
+        if outputs is not None:
+            missing = [name for name in outputs if name not in assigned]
+            if missing:
+                raise ValueError(f"outputs {missing} are never assigned")
+
+        root = OutputNode(names=names, roots=[assigned[name] for name in names], id=self.next_id)
+        self.next_id += 1
+        return root
+
+    def build(self, tree, assigned : dict = None):
+        '''
+            Builds the DFG of an expression AST and returns its root.
+            The AST is walked with an explicit stack instead of recursion, so very deep expressions
+            (e.g. long left-associated sums) are built in linear time without hitting the recursion limit.
+            Nodes are numbered in post-order, operands from left to right.
+            Names in assigned resolve to the given nodes instead of inputs.
+        '''
+
+        visited_identifiers = self.visited_identifiers
+        node_id = self.next_id
+
+        # tasks are (action, ast node, depth, op); results holds the DFG nodes built so far
+        tasks = [("visit", tree, 0, None)]
+        results = []
+
+        def add_operator(op, left_operand, right_operand, depth):
+            nonlocal node_id
+            new_node = OperatorNode(
+                op_type=        op_map.get(type(op), '?'),
+                op=             op,
+                left_operand=   left_operand,
+                right_operand=  right_operand,
+                depth=          depth,
+                id=             node_id,
+                name=           symbols[type(op)]
+            )
+            node_id += 1
+            self.all_nodes.append(new_node)
+            return new_node
+
+        def add_identifier(key, name, depth, value=None):
+            nonlocal node_id
+            if key in visited_identifiers.keys():
+                existing_node = visited_identifiers[key]
+                existing_node.depth = max(depth, existing_node.depth)
+                return existing_node
+
+            new_node = IdentifierNode(name=name, depth=depth, id=node_id, value=value)
+            node_id += 1
+            visited_identifiers[key] = new_node
+            self.all_nodes.append(new_node)
+            return new_node
+
+        while tasks:
+            action, node, depth, op = tasks.pop()
+
+            if action == "binop":
+                rop = results.pop()
+                lop = results.pop()
+                results.append(add_operator(op, lop, rop, depth))
+
+            elif action == "unaryop":
+                opn = results.pop()
+                results.append(add_operator(op, opn, None, depth))
+
+            elif node is None:
+                results.append(None)
+
+            elif isinstance(node, ast.BinOp):
+                tasks.append(("binop", node, depth, node.op))
+                tasks.append(("visit", node.right, depth+1, None))
+                tasks.append(("visit", node.left,  depth+1, None))
 
-        def recursively_build_DFG(node : BaseNode, depth : int):
-            
-            nonlocal visited_identifiers, node_id
-            
-            if node is None:
-                return None
-                        
-            if isinstance(node, ast.BinOp):
-                lop = recursively_build_DFG(node=node.left,  depth=depth+1)
-                rop = recursively_build_DFG(node=node.right, depth=depth+1)
-
-                new_node = OperatorNode(
-                    op_type=        op_map.get(type(node.op), '?'),
-                    op=             node.op,
-                    left_operand=   lop,
-                    right_operand=  rop,
-                    depth=          depth,
-                    id=             node_id,
-                    name=           symbols[type(node.op)]
-                )
-                
-                node_id += 1        
-                self.all_nodes.append(new_node)
-                return new_node
-            
             elif isinstance(node, ast.UnaryOp):
-                opn = recursively_build_DFG(node=node.operand, depth=depth+1)
-                new_node = OperatorNode(
-                    op_type=        op_map.get(type(node.op), '?'),
-                    op=             node.op,
-                    left_operand=   opn,
-                    right_operand=  None,
-                    depth=          depth,
-                    id=             node_id,
-                    name=           symbols[type(node.op)]
-                )
-                node_id += 1
-                self.all_nodes.append(new_node)
-                return new_node
-        
+                tasks.append(("unaryop", node, depth, node.op))
+                tasks.append(("visit", node.operand, depth+1, None))
+
             elif isinstance(node, ast.Compare):
-                lop = recursively_build_DFG(node.left, depth+1)
-                current_node = lop
-                
-                for op_item, right in zip(node.ops, node.comparators):
-                    rop = recursively_build_DFG(node=right, depth=depth+1)
-                    
-                    new_node = OperatorNode(
-                        op_type=        op_map.get(type(op_item), '?'),
-                        op=             op_item,
-                        left_operand=   current_node,
-                        right_operand=  rop,
-                        depth=          depth,
-                        id=             node_id,
-                        name=           symbols[type(node.op)]
-                    )
-                    
-                    node_id += 1
-                    self.all_nodes.append(new_node)
-                    current_node = new_node
-        
-                return current_node
+                # a < b < c is built as a chain: (a < b) < c
+                for op_item, right in reversed(list(zip(node.ops, node.comparators))):
+                    tasks.append(("binop", node, depth, op_item))
+                    tasks.append(("visit", right, depth+1, None))
+                tasks.append(("visit", node.left, depth+1, None))
+
+            elif isinstance(node, ast.Name) and assigned and node.id in assigned:
+                results.append(assigned[node.id])
 
             elif isinstance(node, ast.Name):
-                if node.id in visited_identifiers.keys():
-                    existing_node = visited_identifiers[node.id]
-                    existing_node.depth = max(depth, existing_node.depth)
-                    return existing_node
-                else:
-                    new_node = IdentifierNode(name=node.id, depth=depth, id=node_id)
-                    node_id += 1
-                    visited_identifiers[new_node.name] = new_node
-                    self.all_nodes.append(new_node)
-                    return new_node
-            
+                results.append(add_identifier(key=node.id, name=node.id, depth=depth))
+
             elif isinstance(node, ast.Constant):
-                if node.value in visited_identifiers.keys():
-                    existing_node = visited_identifiers[node.value]
-                    existing_node.depth = max(depth, existing_node.depth)
-                    return existing_node
-                else:
-                    new_node = IdentifierNode(
-                        name=str(node.value),
-                        depth=depth, 
-                        id=node_id, 
-                        value=node.value
-                    )
-                    node_id += 1
-                    visited_identifiers[node.value] = new_node
-                    self.all_nodes.append(new_node)
-                    return new_node
+                results.append(add_identifier(key=node.value, name=str(node.value), depth=depth, value=node.value))
+
             else:
                 print(node)
                 print("Unknown Node")
+                results.append(None)
 
-        return recursively_build_DFG(tree, 0)
+        self.next_id = node_id
+        return results.pop()
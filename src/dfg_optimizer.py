@@ -0,0 +1,123 @@
+import ast
+from .dfg_creator import BaseNode, OperatorNode, IdentifierNode, OutputNode, outputs_of
+from .dfg_analysis import topological_order
+from .word_arithmetic import SCALAR_OPERATIONS, WORD_MASK
+from typing import Optional, List
+
+COMMUTATIVE_OPS = (ast.Add, ast.Mult, ast.BitAnd, ast.BitOr, ast.BitXor, ast.Eq, ast.NotEq)
+
+# constants are folded with the arithmetic of the datapath on 32-bit words, so optimizing never changes the result
+evaluators = SCALAR_OPERATIONS
+
+
+class DFGOptimizer:
+    '''
+        Rewrites a DFG before scheduling:
+            - constant folding: operators whose operands are all constants are replaced by a constant
+            - common-subexpression elimination: operators are hash-consed on (op, operand ids), with the
+              operands of commutative ops in canonical order, so repeated subexpressions become one shared node
+        Surviving nodes keep their ids, so a DFG without redundancy is left unchanged. Folded constants get new ids.
+    '''
+
+    def __init__(self):
+        self.all_nodes : List[BaseNode] = []
+        self.merged = 0
+        self.folded = 0
+
+    def _fold(self, node : OperatorNode, operands : list) -> Optional[int]:
+        '''
+            Returns the word node computes if all of its operands are constants, otherwise None.
+        '''
+        present = [operand for operand in operands if operand is not None]
+        if not all(isinstance(operand, IdentifierNode) and isinstance(operand.value, int) for operand in present):
+            return None
+        # a negative constant is its two's complement word, as in the datapath
+        values = [operand.value & WORD_MASK for operand in present]
+
+        evaluate = evaluators.get(type(node.op))
+        if evaluate is None:
+            return None
+
+        # unary operators ignore their second operand
+        return evaluate(values[0], values[-1])
+
+    def optimize(self, root : BaseNode) -> BaseNode:
+        '''
+            Returns the root of the optimized DFG. Nodes are rewritten in place.
+        '''
+        order = topological_order(root)
+
+        constants : dict = {}
+        next_id = root.id + 1
+        for node in order:
+            for operand in node.operands:
+                if isinstance(operand, IdentifierNode):
+                    next_id = max(next_id, operand.id + 1)
+                    if operand.value is not None:
+                        constants.setdefault(operand.value, operand)
+            next_id = max(next_id, node.id + 1)
+
+        # old node id -> node that replaces it
+        replacement : dict[int, BaseNode] = {}
+        unique_nodes : dict[tuple, OperatorNode] = {}
+
+        for node in order:
+            operands = [replacement.get(operand.id, operand) if operand is not None else None for operand in node.operands]
+
+            value = self._fold(node, operands)
+            if value is not None:
+                if value not in constants:
+                    constants[value] = IdentifierNode(name=str(value), depth=node.depth, id=next_id, value=value)
+                    next_id += 1
+                replacement[node.id] = constants[value]
+                self.folded += 1
+                continue
+
+            operand_ids = [operand.id if operand is not None else None for operand in operands]
+            if isinstance(node.op, COMMUTATIVE_OPS):
+                operand_ids.sort()
+            key = (type(node.op), *operand_ids)
+
+            if key in unique_nodes:
+                replacement[node.id] = unique_nodes[key]
+                self.merged += 1
+                continue
+
+            node.operands = operands
+            unique_nodes[key] = node
+
+        if isinstance(root, OutputNode):
+            root.operands = [replacement.get(output.id, output) for output in root.operands]
+            new_root = root
+        else:
+            new_root = replacement.get(root.id, root)
+        self._update_depths(new_root)
+        return new_root
+
+    def _update_depths(self, root : BaseNode) -> None:
+        '''
+            Sets the depth of every node to its longest distance from an output, as GraphBuilder does for shared identifiers.
+        '''
+        order = topological_order(root)
+        seen = set()
+        for output in outputs_of(root):
+            output.depth = 0
+            seen.add(output.id)
+        self.all_nodes = []
+
+        for node in reversed(order):
+            self.all_nodes.append(node)
+            for operand in node.operands:
+                if operand is None:
+                    continue
+                if operand.id not in seen:
+                    seen.add(operand.id)
+                    operand.depth = node.depth + 1
+                    if isinstance(operand, IdentifierNode):
+                        self.all_nodes.append(operand)
+                else:
+                    operand.depth = max(operand.depth, node.depth + 1)
+
+        for output in outputs_of(root):
+            if isinstance(output, IdentifierNode) and output not in self.all_nodes:
+                self.all_nodes.append(output)
@@ -0,0 +1,187 @@
+import sys
+from array import array
+from .dfg_creator import BaseNode, OperatorNode, IdentifierNode, OutputNode, outputs_of, op_map, symbols
+from .dfg_analysis import topological_order
+from .scheduler import ScheduledNodeInfo
+from typing import List
+
+OP_CLASSES = list(symbols.keys())
+OP_INSTANCES = [op_class() for op_class in OP_CLASSES]
+RESOURCE_CLASSES = sorted(set(op_map.values()))
+
+KIND_NONE = 0
+KIND_IDENTIFIER = 1
+KIND_OPERATOR = 2
+
+
+class DFGStore:
+    '''
+        Compact, column-oriented storage of a DFG for very large designs.
+        Every column is an array indexed by node id, so a node costs a few bytes instead of a Python object:
+            kind          - KIND_NONE for unused ids, KIND_IDENTIFIER or KIND_OPERATOR
+            op_code       - index into OP_CLASSES (-1 for identifiers)
+            resource      - index into RESOURCE_CLASSES (-1 for identifiers)
+            left, right   - operand ids (-1 if there is no operand)
+            depth         - as in BaseNode.depth
+            schedule_time - clock cycle after set_schedule (0 if unscheduled)
+        Identifier names and constant values are kept in a dict, since they are few compared to operators.
+
+        node() returns thin __slots__ views that subclass OperatorNode / IdentifierNode, so the schedulers,
+        the analysis and the code generator can run on a store without any change.
+    '''
+
+    def __init__(self, size : int):
+        self.kind = array("b", bytes(size))
+        self.op_code = array("b", [-1]) * size
+        self.resource = array("b", [-1]) * size
+        self.left = array("i", [-1]) * size
+        self.right = array("i", [-1]) * size
+        self.depth = array("i", [0]) * size
+        self.schedule_time = array("i", [0]) * size
+        self.resource_num = array("i", [0]) * size
+        # id -> (name, value)
+        self.identifiers : dict[int, tuple] = {}
+        self.root_id = -1
+        # (names, output ids) when the root is an OutputNode
+        self.outputs : tuple = None
+
+    @classmethod
+    def from_dfg(cls, root : BaseNode) -> 'DFGStore':
+        '''
+            Copies the DFG reachable from root into a new store. Node ids are kept.
+        '''
+        operators = topological_order(root)
+        identifiers = {}
+        for node in operators:
+            for operand in node.operands:
+                if isinstance(operand, IdentifierNode):
+                    identifiers[operand.id] = operand
+        for output in outputs_of(root):
+            if isinstance(output, IdentifierNode):
+                identifiers[output.id] = output
+
+        size = 1 + max([node.id for node in operators] + list(identifiers.keys()))
+        store = cls(size)
+        store.root_id = root.id
+        if isinstance(root, OutputNode):
+            store.outputs = (list(root.names), [output.id for output in root.operands])
+
+        for node in identifiers.values():
+            store.kind[node.id] = KIND_IDENTIFIER
+            store.depth[node.id] = node.depth
+            store.identifiers[node.id] = (node.name, node.value)
+
+        for node in operators:
+            left, right = node.operands
+            store.kind[node.id] = KIND_OPERATOR
+            store.op_code[node.id] = OP_CLASSES.index(type(node.op))
+            store.resource[node.id] = RESOURCE_CLASSES.index(node.op_type)
+            store.left[node.id] = left.id if left is not None else -1
+            store.right[node.id] = right.id if right is not None else -1
+            store.depth[node.id] = node.depth
+
+        return store
+
+    def node(self, node_id : int) -> BaseNode:
+        if node_id < 0:
+            return None
+        if self.kind[node_id] == KIND_OPERATOR:
+            return StoredOperatorNode(self, node_id)
+        if self.kind[node_id] == KIND_IDENTIFIER:
+            return StoredIdentifierNode(self, node_id)
+        return None
+
+    def root(self) -> BaseNode:
+        if self.outputs is not None:
+            names, output_ids = self.outputs
+            return OutputNode(names=names, roots=[self.node(output_id) for output_id in output_ids], id=self.root_id)
+        return self.node(self.root_id)
+
+    def set_schedule(self, schedule_info : List[ScheduledNodeInfo]) -> None:
+        '''
+            Records a schedule in the schedule_time and resource_num columns.
+        '''
+        for info in schedule_info:
+            self.schedule_time[info.node.id] = info.scheduled_time
+            self.resource_num[info.node.id] = info.resource_num
+
+    def nbytes(self) -> int:
+        '''
+            Approximate memory used by the store.
+        '''
+        columns = (self.kind, self.op_code, self.resource, self.left, self.right, self.depth, self.schedule_time, self.resource_num)
+        total = sum(sys.getsizeof(column) for column in columns) + sys.getsizeof(self.identifiers)
+        for node_id, (name, value) in self.identifiers.items():
+            total += sys.getsizeof((name, value)) + sys.getsizeof(name)
+        return total
+
+
+class StoredOperatorNode(OperatorNode):
+    '''
+        View of one operator of a DFGStore with the OperatorNode API. Views are created on demand and are equal
+        when they point at the same node of the same store.
+    '''
+    __slots__ = ("store", "index")
+
+    def __init__(self, store : DFGStore, index : int):
+        self.store = store
+        self.index = index
+
+    id = property(lambda self: self.index)
+    name = property(lambda self: symbols[OP_CLASSES[self.store.op_code[self.index]]])
+    op = property(lambda self: OP_INSTANCES[self.store.op_code[self.index]])
+    op_type = property(lambda self: RESOURCE_CLASSES[self.store.resource[self.index]])
+
+    @property
+    def depth(self) -> int:
+        return self.store.depth[self.index]
+
+    @depth.setter
+    def depth(self, value : int):
+        self.store.depth[self.index] = value
+
+    @property
+    def operands(self) -> List[BaseNode]:
+        return [self.store.node(self.store.left[self.index]), self.store.node(self.store.right[self.index])]
+
+    @operands.setter
+    def operands(self, value : List[BaseNode]):
+        left, right = value
+        self.store.left[self.index] = left.id if left is not None else -1
+        self.store.right[self.index] = right.id if right is not None else -1
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, StoredOperatorNode) and other.store is self.store and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.store), self.index))
+
+
+class StoredIdentifierNode(IdentifierNode):
+    '''
+        View of one identifier or constant of a DFGStore with the IdentifierNode API.
+    '''
+    __slots__ = ("store", "index")
+
+    def __init__(self, store : DFGStore, index : int):
+        self.store = store
+        self.index = index
+
+    id = property(lambda self: self.index)
+    name = property(lambda self: self.store.identifiers[self.index][0])
+    value = property(lambda self: self.store.identifiers[self.index][1])
+    operands = property(lambda self: [None, None])
+
+    @property
+    def depth(self) -> int:
+        return self.store.depth[self.index]
+
+    @depth.setter
+    def depth(self, value : int):
+        self.store.depth[self.index] = value
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, StoredIdentifierNode) and other.store is self.store and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.store), self.index))
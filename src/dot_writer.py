@@ -0,0 +1,94 @@
+from typing import TextIO
+from .dfg_creator import IdentifierNode, OperatorNode
+from .scheduler import ScheduleView
+
+
+def _quote(text : str) -> str:
+    return '"' + str(text).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def _identifier_label(node : IdentifierNode) -> str:
+    if node.name.isdigit():
+        return f"const={node.name}"
+    return node.name
+
+
+def _operator_label(node : OperatorNode, view : ScheduleView) -> str:
+    info = view.get(node.id)
+    return (
+        f"{node.name}\ntime_cycle: {info.scheduled_time}\n"
+        f"resource: {node.op_type} {info.resource_num}"
+    )
+
+
+def write_scheduled_graph(view : ScheduleView, file : TextIO, version : int = 1, ranked : bool = True) -> None:
+    '''
+        Streams the DOT source of a scheduled DFG to file, without building it in memory first.
+        Nodes, ranks and edges are written as the schedule is traversed, one cycle at a time.
+
+        version 1 - every use of an identifier gets its own node
+        version 2 - identifiers with the same label are merged into one node, constants are never merged
+        ranked    - inputs are placed in a source rank and every clock cycle in its own cycle_N rank,
+                    as in visualize_scheduled_graph_ranked
+    '''
+
+    def identifier_id(operand : IdentifierNode, parent : OperatorNode, slot : int) -> str:
+        if version == 2 and not _identifier_label(operand).startswith("const="):
+            return f"in{operand.id}"
+        return f"in{operand.id}_{parent.id}_{slot}"
+
+    file.write("// Scheduled Graph Ranked\n" if ranked else "// Scheduled Graph\n")
+    file.write("digraph {\n")
+    file.write("\trankdir=TB\n")
+    file.write("\tnewrank=true\n" if ranked else "\tsize=\"8,8\"\n")
+
+    cycles = view.cycles()
+
+    # inputs
+    first_input = None
+    written_inputs = set()
+    if ranked:
+        file.write("\tsubgraph cluster_inputs {\n\t\tstyle=invis\n\t\trank=source\n")
+    for cycle in cycles:
+        for info in view.at_cycle(cycle):
+            for slot, operand in enumerate(info.node.operands):
+                if not isinstance(operand, IdentifierNode):
+                    continue
+                nid = identifier_id(operand, info.node, slot)
+                if nid in written_inputs:
+                    continue
+                written_inputs.add(nid)
+                first_input = first_input or nid
+                file.write(f"\t\t{nid} [label={_quote(_identifier_label(operand))}]\n")
+    if ranked:
+        file.write("\t}\n")
+
+    # operators, one rank per clock cycle
+    first_of_cycle = []
+    for cycle in cycles:
+        infos = view.at_cycle(cycle)
+        if ranked:
+            file.write(f"\tsubgraph cycle_{cycle} {{\n\t\trank=same\n")
+        for info in infos:
+            file.write(f"\t\top{info.node.id} [label={_quote(_operator_label(info.node, view))}]\n")
+        if ranked:
+            file.write("\t}\n")
+        if infos:
+            first_of_cycle.append(f"op{infos[0].node.id}")
+
+    # invisible edges keep the ranks in order
+    if ranked:
+        chain = ([first_input] if first_input else []) + first_of_cycle
+        for src, dst in zip(chain, chain[1:]):
+            file.write(f"\t{src} -> {dst} [style=invis weight=10]\n")
+
+    # data edges, operand -> operator
+    for cycle in cycles:
+        for info in view.at_cycle(cycle):
+            for slot, operand in enumerate(info.node.operands):
+                if isinstance(operand, IdentifierNode):
+                    file.write(f"\t{identifier_id(operand, info.node, slot)} -> op{info.node.id}\n")
+                elif isinstance(operand, OperatorNode):
+                    file.write(f"\top{operand.id} -> op{info.node.id}\n")
+
+    file.write("}\n")
@@ -0,0 +1,230 @@
+import math
+import time
+import itertools
+from .dfg_creator import BaseNode, OperatorNode, OP_TYPES
+from .dfg_analysis import DFGAnalysis
+from .scheduler import TimeAssignedScheduler, MinLatencyScheduler, ForceDirectedScheduler
+from typing import List, Optional
+
+
+class _BudgetExhausted(Exception):
+    pass
+
+
+class _SearchDone(Exception):
+    pass
+
+
+class BranchAndBoundScheduler(TimeAssignedScheduler):
+    '''
+        Exact scheduler for small DFGs, a depth-first branch-and-bound over clock cycles.
+        Give either numof_resources or max_time:
+            numof_resources - minimum latency with these resources, the problem of MinLatencyScheduler
+            max_time        - minimum total number of resources that finish by max_time, the problem of MinResourceScheduler
+
+        Every operation takes one cycle, so some optimal schedule never leaves a resource idle while a node of its
+        type is ready; the search only branches on which ready nodes fill the resources of a cycle. Branches are cut
+        by the ASAP/ALAP path bound, by the number of remaining nodes per resource, and by a table of the earliest
+        cycle every set of finished nodes was reached at.
+
+        The search starts from the list (or force-directed) schedule, so there is always a valid result. When
+        time_budget seconds run out, the best schedule found so far is kept and optimality_gap tells how far its
+        cost can be from the optimum.
+    '''
+
+    def __init__(self, dfg_root : BaseNode, numof_resources : dict = None, max_time : int = None,
+                 time_budget : float = 10.0, analysis : DFGAnalysis = None):
+        if (numof_resources is None) == (max_time is None):
+            raise ValueError("give either numof_resources (minimum latency) or max_time (minimum resources)")
+
+        super().__init__(dfg_root=dfg_root,
+                         numof_resources=dict(numof_resources) if numof_resources is not None else {op: 0 for op in OP_TYPES},
+                         analysis=analysis)
+        self.objective = "latency" if max_time is None else "resources"
+        self.max_time = max_time
+        self.time_budget = time_budget
+        self.deadline = None
+
+        # cost of the schedule found (cycles or resources), a proven lower bound on the optimum and whether they meet
+        self.best_cost : Optional[int] = None
+        self.lower_bound : Optional[int] = None
+        self.optimal = False
+
+        # nodes by position in topological order, dependencies as bitmasks of positions
+        self.position = {node.id: index for index, node in enumerate(self.nodes)}
+        self.operand_masks : List[int] = []
+        for node in self.nodes:
+            mask = 0
+            for operand in node.operands:
+                if isinstance(operand, OperatorNode):
+                    mask |= 1 << self.position[operand.id]
+            self.operand_masks.append(mask)
+        self.counts = {}
+        for node in self.nodes:
+            self.counts[node.op_type] = self.counts.get(node.op_type, 0) + 1
+
+    @property
+    def optimality_gap(self) -> float:
+        '''
+            Relative distance between the cost found and the lower bound, 0.0 once the schedule is proven optimal.
+        '''
+        if not self.best_cost:
+            return 0.0
+        return (self.best_cost - self.lower_bound) / self.best_cost
+
+    def _check_budget(self) -> None:
+        if time.monotonic() > self.deadline:
+            raise _BudgetExhausted()
+
+    def _latency_bound(self, capacity : dict) -> int:
+        '''
+            Lower bound on the number of cycles with the given resources.
+        '''
+        bound = self.analysis.critical_path
+        for resource_type, count in self.counts.items():
+            bound = max(bound, math.ceil(count / capacity[resource_type]))
+        return bound
+
+    def _search(self, capacity : dict, limit : int, first_only : bool) -> Optional[dict]:
+        '''
+            Looks for a schedule that ends before cycle limit with the given resources.
+            Returns {node id: cycle} of the shortest one (of the first one if first_only), None if there is none.
+            On _BudgetExhausted the best schedule found so far is left in self._found.
+        '''
+        nodes = self.nodes
+        priorities = [self.priorities[node.id] for node in nodes]
+        all_done = (1 << len(nodes)) - 1
+        bound = self._latency_bound(capacity)
+        earliest_seen : dict[int, int] = {}
+        cycles = [0] * len(nodes)
+        self._found = None
+
+        def visit(cycle : int, done : int) -> None:
+            nonlocal limit
+            if done == all_done:
+                limit = cycle - 1
+                self._found = {node.id: cycles[index] for index, node in enumerate(nodes)}
+                if first_only or limit <= bound:
+                    raise _SearchDone()
+                return
+
+            self._check_budget()
+            if earliest_seen.get(done, limit) <= cycle:
+                return
+            earliest_seen[done] = cycle
+
+            ready = {}
+            remaining = {}
+            longest_path = 0
+            for index, node in enumerate(nodes):
+                if done >> index & 1:
+                    continue
+                remaining[node.op_type] = remaining.get(node.op_type, 0) + 1
+                longest_path = max(longest_path, priorities[index])
+                if self.operand_masks[index] & ~done == 0:
+                    ready.setdefault(node.op_type, []).append(index)
+
+            lower = cycle + longest_path
+            for resource_type, count in remaining.items():
+                lower = max(lower, cycle - 1 + math.ceil(count / capacity[resource_type]))
+            if lower >= limit:
+                return
+
+            # highest priority first, so the first branch is the list schedule
+            choices = []
+            for resource_type, indices in ready.items():
+                indices.sort(key=lambda index: -priorities[index])
+                choices.append(itertools.combinations(indices, min(capacity[resource_type], len(indices))))
+
+            for picks in itertools.product(*choices):
+                mask = 0
+                for pick in picks:
+                    for index in pick:
+                        mask |= 1 << index
+                        cycles[index] = cycle
+                visit(cycle + 1, done | mask)
+
+        try:
+            visit(1, 0)
+        except _SearchDone:
+            pass
+        return self._found
+
+    def _assign_times(self) -> None:
+        self.deadline = time.monotonic() + self.time_budget
+        if self.objective == "latency":
+            self._minimize_latency()
+        else:
+            self._minimize_resources()
+        self.optimal = self.best_cost == self.lower_bound
+
+    def _minimize_latency(self) -> None:
+        for resource_type in self.counts:
+            if self.numof_resources.get(resource_type, 0) <= 0:
+                raise RuntimeError(f"No resources available for ready resource types ['{resource_type}'].")
+
+        list_scheduler = MinLatencyScheduler(dfg_root=self.root, numof_resources=dict(self.numof_resources), analysis=self.analysis)
+        list_scheduler.schedule()
+        self.assigned_times = {info.node.id: info.scheduled_time for info in list_scheduler.scheduled_nodes_info}
+        self.best_cost = max(self.assigned_times.values(), default=0)
+        self.lower_bound = self._latency_bound(self.numof_resources)
+
+        try:
+            found = self._search(self.numof_resources, limit=self.best_cost, first_only=False)
+            if found:
+                self.assigned_times = found
+                self.best_cost = max(found.values())
+            self.lower_bound = self.best_cost
+        except _BudgetExhausted:
+            if self._found:
+                self.assigned_times = self._found
+                self.best_cost = max(self._found.values())
+
+    def _minimize_resources(self) -> None:
+        force_directed = ForceDirectedScheduler(dfg_root=self.root, max_time=self.max_time, analysis=self.analysis)
+        force_directed._assign_times()
+        self.assigned_times = force_directed.assigned_times
+
+        resource_types = sorted(self.counts)
+        upper = {resource_type: 0 for resource_type in resource_types}
+        usage = {}
+        for node in self.nodes:
+            key = (self.assigned_times[node.id], node.op_type)
+            usage[key] = usage.get(key, 0) + 1
+            upper[node.op_type] = max(upper[node.op_type], usage[key])
+        lower = {resource_type: math.ceil(self.counts[resource_type] / self.max_time) for resource_type in resource_types}
+
+        self.best_cost = sum(upper.values())
+        self.lower_bound = sum(lower.values())
+
+        # every total below the one being tried has been proven infeasible
+        try:
+            for total in range(self.lower_bound, self.best_cost):
+                self.lower_bound = total
+                for capacity in self._capacities(resource_types, lower, upper, total):
+                    self._check_budget()
+                    if self._latency_bound(capacity) > self.max_time:
+                        continue
+                    found = self._search(capacity, limit=self.max_time + 1, first_only=True)
+                    if found:
+                        self.assigned_times = found
+                        self.best_cost = total
+                        return
+            self.lower_bound = self.best_cost
+        except _BudgetExhausted:
+            pass
+
+    def _capacities(self, resource_types : List[str], lower : dict, upper : dict, total : int):
+        '''
+            Yields every resource count vector between lower and upper whose sum is total.
+        '''
+        if not resource_types:
+            if total == 0:
+                yield {}
+            return
+        first, rest = resource_types[0], resource_types[1:]
+        rest_lower = sum(lower[resource_type] for resource_type in rest)
+        rest_upper = sum(upper[resource_type] for resource_type in rest)
+        for count in range(max(lower[first], total - rest_upper), min(upper[first], total - rest_lower) + 1):
+            for capacity in self._capacities(rest, lower, upper, total - count):
+                yield {first: count, **capacity}
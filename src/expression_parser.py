@@ -0,0 +1,148 @@
+import re
+import ast
+import io
+import tokenize
+from typing import List, Optional, Tuple
+
+# binding power of binary operators, from loosest to tightest (same order as Python's grammar)
+binary_ops = {
+    "|": (ast.BitOr, 2),
+    "^": (ast.BitXor, 3),
+    "&": (ast.BitAnd, 4),
+    "<<": (ast.LShift, 5), ">>": (ast.RShift, 5),
+    "+": (ast.Add, 6), "-": (ast.Sub, 6),
+    "*": (ast.Mult, 7), "/": (ast.Div, 7), "//": (ast.FloorDiv, 7), "%": (ast.Mod, 7),
+    "**": (ast.Pow, 9),
+}
+
+compare_ops = {
+    "==": ast.Eq, "!=": ast.NotEq,
+    "<": ast.Lt, "<=": ast.LtE, ">": ast.Gt, ">=": ast.GtE,
+}
+
+unary_ops = {"-": ast.USub, "+": ast.UAdd, "~": ast.Invert}
+
+# "name = expression", the = must not be the start of ==
+assignment_pattern = re.compile(r"^\s*([A-Za-z_]\w*)\s*=(?!=)(.*)$", re.S)
+
+COMPARE_PRECEDENCE = 1
+UNARY_PRECEDENCE = 8
+POW_PRECEDENCE = 9
+
+
+def _reduce(operator, operands : list, closed : set):
+    '''
+        Applies one operator from the operator stack to the operand stack.
+    '''
+    kind, op_type, _ = operator
+
+    if kind == "unary":
+        operands.append(ast.UnaryOp(op=op_type(), operand=operands.pop()))
+        return
+
+    right = operands.pop()
+    left = operands.pop()
+
+    if kind == "compare":
+        # a < b < c is one Compare node, unless the left side was parenthesized
+        if isinstance(left, ast.Compare) and id(left) not in closed:
+            left.ops.append(op_type())
+            left.comparators.append(right)
+            operands.append(left)
+        else:
+            operands.append(ast.Compare(left=left, ops=[op_type()], comparators=[right]))
+        return
+
+    operands.append(ast.BinOp(left=left, op=op_type(), right=right))
+
+
+def parse_deep_expression(expression : str) -> ast.expr:
+    '''
+        Parses an arithmetic expression into the same AST shape as ast.parse(expression, mode="eval").body.
+        It uses operator-precedence parsing with explicit stacks, so it handles expressions that are too deep for
+        Python's own parser (e.g. a0 + a1 + ... + a20000). Only names, numbers, parentheses and the operators in
+        the DFG op map are supported.
+    '''
+    operands = []
+    # each entry is (kind, ast op type, precedence) or ("paren", None, 0)
+    operators = []
+    closed = set()
+    expect_operand = True
+
+    for token in tokenize.generate_tokens(io.StringIO(expression).readline):
+        if token.type in (tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER, tokenize.INDENT, tokenize.DEDENT):
+            continue
+
+        text = token.string
+
+        if expect_operand:
+            if token.type == tokenize.NAME:
+                operands.append(ast.Name(id=text, ctx=ast.Load()))
+                expect_operand = False
+            elif token.type == tokenize.NUMBER:
+                operands.append(ast.Constant(value=ast.literal_eval(text)))
+                expect_operand = False
+            elif text == "(":
+                operators.append(("paren", None, 0))
+            elif text in unary_ops:
+                operators.append(("unary", unary_ops[text], UNARY_PRECEDENCE))
+            else:
+                raise SyntaxError(f"unexpected token '{text}' at column {token.start[1]}")
+            continue
+
+        if text == ")":
+            while operators and operators[-1][0] != "paren":
+                _reduce(operators.pop(), operands, closed)
+            if not operators:
+                raise SyntaxError(f"unmatched ')' at column {token.start[1]}")
+            operators.pop()
+            closed.add(id(operands[-1]))
+            continue
+
+        if text in binary_ops:
+            op_type, precedence = binary_ops[text]
+            kind = "binary"
+        elif text in compare_ops:
+            op_type, precedence = compare_ops[text], COMPARE_PRECEDENCE
+            kind = "compare"
+        else:
+            raise SyntaxError(f"unexpected token '{text}' at column {token.start[1]}")
+
+        # ** is right associative, everything else is left associative
+        while operators and operators[-1][0] != "paren":
+            top_precedence = operators[-1][2]
+            if top_precedence > precedence or (top_precedence == precedence and precedence != POW_PRECEDENCE):
+                _reduce(operators.pop(), operands, closed)
+            else:
+                break
+
+        operators.append((kind, op_type, precedence))
+        expect_operand = True
+
+    if expect_operand:
+        raise SyntaxError("unexpected end of expression")
+
+    while operators:
+        operator = operators.pop()
+        if operator[0] == "paren":
+            raise SyntaxError("unmatched '('")
+        _reduce(operator, operands, closed)
+
+    return operands.pop()
+
+
+def split_assignments(source : str) -> Optional[List[Tuple[str, str]]]:
+    '''
+        Splits a block of assignments, e.g. "y1 = a + b; y2 = y1 * c", into (name, expression) pairs.
+        Statements are separated by newlines or semicolons. Returns None if source is a single expression.
+    '''
+    statements = [statement for statement in re.split(r"[;\n]", source) if statement.strip()]
+    assignments = []
+    for statement in statements:
+        match = assignment_pattern.match(statement)
+        if match is None:
+            if len(statements) == 1:
+                return None
+            raise SyntaxError(f"expected an assignment 'name = expression', got '{statement.strip()}'")
+        assignments.append((match.group(1), match.group(2).strip()))
+    return assignments
@@ -1,8 +1,13 @@
+import os
 import ast
 import graphviz
-from .scheduler import ScheduledNodeInfo
+from .scheduler import ScheduledNodeInfo, ScheduleView
 from .dfg_creator import *
+from .expression_parser import parse_deep_expression, split_assignments
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+RENDER_MODES = ["sync", "background", "deferred", "off"]
 
 
 def determine_operation_type(op) -> str:
@@ -58,6 +63,9 @@ def determine_operation_type(op) -> str:
 
 
 def visualize_graph(root, version=1):
+    '''
+        Draws an expression AST, or a list of (name, AST) assignments with a box per output name.
+    '''
     dot = graphviz.Digraph(comment="Abstract Syntax Tree")
     dot.attr(rankdir="TB", size="8,8")
 
@@ -65,37 +73,31 @@ def visualize_graph(root, version=1):
     visited_identifiers = dict()
     identifier_nodes = []
 
-    def add_node_and_edges(node, parent_id=None):
-        nonlocal node_counter
-        nonlocal visited_identifiers
-        cur_node_id = str(node_counter)
-        node_counter += 1
-
+    def label_of(node):
         if isinstance(node, ast.BinOp):
-            label = f"{determine_operation_type(node.op)}"
-            add_node_and_edges(node.left, cur_node_id)
-            add_node_and_edges(node.right, cur_node_id)
-
+            return f"{determine_operation_type(node.op)}"
         elif isinstance(node, ast.UnaryOp):
-            label = f"{determine_operation_type(node.op)}"
-            add_node_and_edges(node.operand, cur_node_id)
-            
+            return f"{determine_operation_type(node.op)}"
         elif isinstance(node, ast.Compare):
-            label = f"{determine_operation_type(node.ops[0])}"
-
-            add_node_and_edges(node.left, cur_node_id)
-
-            for comp in node.comparators:
-                add_node_and_edges(comp, cur_node_id)
-
+            return f"{determine_operation_type(node.ops[0])}"
         elif isinstance(node, ast.Name):
-            label = f"{node.id}"
-
+            return f"{node.id}"
         elif isinstance(node, ast.Constant):
-            label = f"const= {node.value}"
-
+            return f"const= {node.value}"
         else:
-            label = type(node).__name__
+            return type(node).__name__
+
+    def children_of(node):
+        if isinstance(node, ast.BinOp):
+            return [node.left, node.right]
+        elif isinstance(node, ast.UnaryOp):
+            return [node.operand]
+        elif isinstance(node, ast.Compare):
+            return [node.left] + node.comparators
+        return []
+
+    def add_node_and_edges(node, cur_node_id, parent_id=None):
+        label = label_of(node)
 
         if (
             version == 2
@@ -120,7 +122,25 @@ def visualize_graph(root, version=1):
         if parent_id is not None:
             dot.edge(cur_node_id, parent_id)
 
-    add_node_and_edges(root)
+    # explicit-stack pre-order numbering with post-order emission, so deep trees do not hit the recursion limit
+    stack = []
+    for name, tree in reversed(root if isinstance(root, list) else [(None, root)]):
+        output_id = None
+        if name is not None:
+            output_id = f"out_{name}"
+            dot.node(output_id, name, shape="box")
+        stack.append((False, tree, None, output_id))
+    while stack:
+        emit, node, cur_node_id, parent_id = stack.pop()
+        if emit:
+            add_node_and_edges(node, cur_node_id, parent_id)
+            continue
+
+        cur_node_id = str(node_counter)
+        node_counter += 1
+        stack.append((True, node, cur_node_id, parent_id))
+        for child in reversed(children_of(node)):
+            stack.append((False, child, None, cur_node_id))
 
     if version == 2 and identifier_nodes:
         with dot.subgraph() as s:
@@ -131,14 +151,10 @@ def visualize_graph(root, version=1):
 
 
 def visualize_scheduled_graph(
-    root_id, schedule_info: List[ScheduledNodeInfo], version=1
+    root_id, schedule_info: List[ScheduledNodeInfo], version=1, view: ScheduleView = None
 ):
-
-    def find_node_by_id(id) -> ScheduledNodeInfo:
-        for sched_node in schedule_info:
-            if sched_node.node.id == id:
-                return sched_node
-        return None
+    if view is None:
+        view = ScheduleView(root_id=root_id, schedule_info=schedule_info)
 
     dot = graphviz.Digraph(comment="Scheduled Graph")
     dot.attr(rankdir="TB", size="8,8")
@@ -146,13 +162,13 @@ def visualize_scheduled_graph(
     node_counter = 0
     visited_identifiers = dict()
     identifier_nodes = []
+    # operators shared by several parents (after CSE) are drawn once
+    drawn_operators = dict()
 
     def add_node_and_edges(
         node_sched: ScheduledNodeInfo, node: BaseNode, parent_id=None
     ):
         nonlocal node_counter
-        nonlocal visited_identifiers
-        nonlocal identifier_nodes
         cur_node_id = str(node_counter)
         node_counter += 1
 
@@ -196,15 +212,25 @@ def visualize_scheduled_graph(
         if parent_id is not None:
             dot.edge(cur_node_id, parent_id)
 
-        if node_sched is not None and isinstance(node_sched.node, OperatorNode):
-            for child_node in node_sched.node.operands:
-                child_sched = find_node_by_id(child_node.id)
-                add_node_and_edges(
-                    node_sched=child_sched, node=child_node, parent_id=cur_node_id
-                )
+        return cur_node_id
 
-    root_sched = find_node_by_id(root_id)
-    add_node_and_edges(node_sched=root_sched, node=root_sched.node)
+    # explicit-stack pre-order walk, children are pushed in reverse to keep the left-to-right order
+    root_ids = root_id if isinstance(root_id, list) else [root_id]
+    stack = [(view.get(node_id), view.get(node_id).node, None) for node_id in reversed(root_ids) if view.get(node_id)]
+    while stack:
+        node_sched, node, parent_id = stack.pop()
+
+        if node_sched is not None and node.id in drawn_operators:
+            dot.edge(drawn_operators[node.id], parent_id)
+            continue
+
+        cur_node_id = add_node_and_edges(node_sched=node_sched, node=node, parent_id=parent_id)
+
+        if node_sched is not None and isinstance(node_sched.node, OperatorNode):
+            drawn_operators[node.id] = cur_node_id
+            for child_node in reversed(node_sched.node.operands):
+                if child_node is not None:
+                    stack.append((view.get(child_node.id), child_node, cur_node_id))
 
     if version == 2 and identifier_nodes:
         with dot.subgraph() as s:
@@ -214,12 +240,9 @@ def visualize_scheduled_graph(
 
     return dot
 
-def visualize_scheduled_graph_ranked(root_id, schedule_info: list, version=1):
-    def find_node_by_id(id):
-        for sched_node in schedule_info:
-            if sched_node.node.id == id:
-                return sched_node
-        return None
+def visualize_scheduled_graph_ranked(root_id, schedule_info: list, version=1, view: ScheduleView = None):
+    if view is None:
+        view = ScheduleView(root_id=root_id, schedule_info=schedule_info)
 
     dot = graphviz.Digraph(comment="Scheduled Graph Ranked")
     dot.attr(rankdir="TB")
@@ -230,13 +253,10 @@ def visualize_scheduled_graph_ranked(root_id, schedule_info: list, version=1):
     layers = defaultdict(list)
     edges = []
     node_labels = {}
+    drawn_operators = dict()
 
     def add_node_and_edges(node_sched, node, parent_id=None):
         nonlocal node_counter
-        nonlocal visited_identifiers
-        nonlocal layers
-        nonlocal edges
-        nonlocal node_labels
 
         label = ""
         cycle_key = None 
@@ -298,16 +318,24 @@ def visualize_scheduled_graph_ranked(root_id, schedule_info: list, version=1):
         if parent_id is not None:
             edges.append((cur_node_id, parent_id))
 
-        if node_sched is not None and hasattr(node, 'operands'):
-            for child_node in node.operands:
-                child_sched = find_node_by_id(child_node.id)
-                add_node_and_edges(
-                    node_sched=child_sched, node=child_node, parent_id=cur_node_id
-                )
+        return cur_node_id
+
+    root_ids = root_id if isinstance(root_id, list) else [root_id]
+    stack = [(view.get(node_id), view.get(node_id).node, None) for node_id in reversed(root_ids) if view.get(node_id)]
+    while stack:
+        node_sched, node, parent_id = stack.pop()
+
+        if node_sched is not None and node.id in drawn_operators:
+            edges.append((drawn_operators[node.id], parent_id))
+            continue
 
-    root_sched = find_node_by_id(root_id)
-    if root_sched:
-        add_node_and_edges(node_sched=root_sched, node=root_sched.node)
+        cur_node_id = add_node_and_edges(node_sched=node_sched, node=node, parent_id=parent_id)
+
+        if node_sched is not None and hasattr(node, 'operands'):
+            drawn_operators[node.id] = cur_node_id
+            for child_node in reversed(node.operands):
+                if child_node is not None:
+                    stack.append((view.get(child_node.id), child_node, cur_node_id))
     
     if "source" in layers:
         with dot.subgraph(name="cluster_inputs") as s:
@@ -345,14 +373,97 @@ def visualize_scheduled_graph_ranked(root_id, schedule_info: list, version=1):
     return dot
 
 
+class GraphRenderer:
+    '''
+        Writes the DFG pictures according to the rendering mode:
+            sync       - renders the PNG with dot before returning
+            background - dispatches the dot calls to a thread pool, wait() blocks until all PNGs are written
+            deferred   - only writes the .dot sources, they can be rendered later with `dot -Tpng`
+            off        - writes nothing, callers should check enabled and skip building the graphs
+    '''
+
+    def __init__(self, mode : str = "sync", workers : int = None):
+        if mode not in RENDER_MODES:
+            raise ValueError(f"render mode must be one of {RENDER_MODES}")
+
+        self.mode = mode
+        self.executor = ThreadPoolExecutor(max_workers=workers) if mode == "background" else None
+        self.pending = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "off"
+
+    def render(self, dot : graphviz.Digraph, path : str) -> None:
+        if self.mode == "sync":
+            dot.render(path, format='png', view=False, cleanup=True)
+
+        elif self.mode == "background":
+            # dot runs as a subprocess, so threads render in parallel with the rest of the pipeline
+            self.pending.append(self.executor.submit(dot.render, path, format='png', view=False, cleanup=True))
+
+        elif self.mode == "deferred":
+            dot.save(path + ".dot")
+
+    def source_path(self, path : str) -> str:
+        '''
+            Returns where a DOT source for the picture at path should be written before calling render_file.
+        '''
+        return path + ".dot"
+
+    def render_file(self, source_path : str, path : str) -> None:
+        '''
+            Renders a DOT source that was already written to disk, e.g. by the streaming DOT writer.
+            In deferred mode the source is kept as it is.
+        '''
+        if self.mode == "sync":
+            self._render_file(source_path, path)
+
+        elif self.mode == "background":
+            self.pending.append(self.executor.submit(self._render_file, source_path, path))
+
+    @staticmethod
+    def _render_file(source_path : str, path : str) -> None:
+        graphviz.render("dot", "png", source_path, outfile=path + ".png")
+        os.remove(source_path)
+
+    def wait(self) -> None:
+        '''
+            Blocks until the background renders are done and re-raises the first rendering error.
+        '''
+        try:
+            for future in self.pending:
+                future.result()
+        finally:
+            self.pending = []
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+
 def parse_expression(expression):
     try:
         tree = ast.parse(expression, mode="eval").body
         return tree
+    except RecursionError:
+        # too deep for Python's parser, e.g. a long left-associated sum
+        return parse_deep_expression(expression)
     except SyntaxError as e:
         print(f"Error parsing expression: {e}")
         return
 
 
 def expression_to_graph(expression):
-    return parse_expression(expression)
+    '''
+        Parses the Expression of an input file. A single expression gives its AST. A block of assignments, a list of
+        "name = expression" strings or a {name: expression} dict gives a list of (name, AST) pairs.
+    '''
+    if isinstance(expression, dict):
+        expression = [f"{name} = {value}" for name, value in expression.items()]
+    if isinstance(expression, list):
+        expression = "\n".join(expression)
+
+    assignments = split_assignments(expression)
+    if assignments is None:
+        return parse_expression(expression)
+    return [(name, parse_expression(value)) for name, value in assignments]
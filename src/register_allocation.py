@@ -0,0 +1,115 @@
+import heapq
+from .dfg_creator import BaseNode, OperatorNode, IdentifierNode
+from .scheduler import ScheduledNodeInfo
+from typing import List, Dict, Tuple
+
+
+def read_cycles(info : ScheduledNodeInfo, intervals : dict = None) -> range:
+    '''
+        Cycles in which an operation reads its operands: all of its cycles, or only the first on a pipelined unit.
+    '''
+    intervals = intervals or {}
+    pipelined = info.duration_cycles > 1 and intervals.get(info.node.op_type, info.duration_cycles) < info.duration_cycles
+    return range(info.scheduled_time, info.scheduled_time + (1 if pipelined else info.duration_cycles))
+
+
+def value_lifetimes(schedule_info : List[ScheduledNodeInfo], intervals : dict = None,
+                    outputs : List[int] = None) -> Dict[int, Tuple[int, int]]:
+    '''
+        Returns {node id: (first, last)}, the clock cycles a register has to hold the result of every operator.
+        A result is written at the end of its last cycle, so it is held from the next one until the last cycle it is
+        read in. A consumer reads its operands for all of its cycles, or only in its issue cycle when its unit is
+        pipelined (intervals[type] < latency). Chained consumers read the unit output instead of the register, and the
+        outputs of the design (by default the operators nobody reads) are read in the state after the last cycle.
+        A value that is never read from a register gets last < first.
+    '''
+    node_map = {info.node.id: info for info in schedule_info}
+    finish = {info.node.id: info.scheduled_time + info.duration_cycles - 1 for info in schedule_info}
+    last_read = dict(finish)
+
+    used = set()
+    for info in schedule_info:
+        read_until = read_cycles(info, intervals)[-1]
+        for operand in info.node.operands:
+            if not isinstance(operand, OperatorNode) or operand.id not in node_map:
+                continue
+            used.add(operand.id)
+            if node_map[operand.id].scheduled_time == info.scheduled_time:
+                continue
+            last_read[operand.id] = max(last_read[operand.id], read_until)
+
+    done_state = max(finish.values(), default=0) + 1
+    if outputs is None:
+        outputs = [node_id for node_id in finish if node_id not in used]
+    for node_id in outputs:
+        last_read[node_id] = done_state
+
+    return {node_id: (finish[node_id] + 1, last_read[node_id]) for node_id in finish}
+
+
+def left_edge(lifetimes : Dict[int, Tuple[int, int]]) -> Dict[int, int]:
+    '''
+        Left-edge register allocation: values sorted by the start of their lifetime go into a register that is free
+        again by then, a new register only when none is. Returns {node id: register index}; values without a lifetime
+        get no register. For interval lifetimes this uses as many registers as values are alive at the busiest cycle.
+    '''
+    allocation = {}
+    # (last busy cycle, register index) of every register
+    busy = []
+    count = 0
+    for node_id, (first, last) in sorted(lifetimes.items(), key=lambda item: (item[1][0], item[1][1], item[0])):
+        if last < first:
+            continue
+        if busy and busy[0][0] < first:
+            _, register = heapq.heappop(busy)
+        else:
+            register, count = count, count + 1
+        allocation[node_id] = register
+        heapq.heappush(busy, (last, register))
+    return allocation
+
+
+def chain_index(produced : int, read : int, initiation_interval : int) -> int:
+    '''
+        In a pipeline that starts an evaluation every initiation_interval cycles, a value written at the end of cycle
+        produced is shifted one register down its chain every time a later evaluation writes it again. Returns the
+        register of the chain that holds it in cycle read.
+    '''
+    return -(-(read - produced) // initiation_interval) - 1
+
+
+def register_chains(schedule_info : List[ScheduledNodeInfo], initiation_interval : int, intervals : dict = None,
+                    outputs : List[BaseNode] = None) -> Dict[int, int]:
+    '''
+        Returns {node id: number of registers} of the shift register chains of a modulo schedule. Every operator
+        result gets a chain, every input a chain written in cycle 0. A chain is as long as the number of evaluations
+        that write the value before its last read; the outputs (by default the operators nobody reads) are read in
+        the cycle after the last one.
+    '''
+    finish = {info.node.id: info.scheduled_time + info.duration_cycles - 1 for info in schedule_info}
+    done_state = max(finish.values(), default=0) + 1
+    chains = {node_id: 1 for node_id in finish}
+
+    def read(operand, cycle : int) -> None:
+        if isinstance(operand, OperatorNode) and operand.id in finish:
+            produced = finish[operand.id]
+        elif isinstance(operand, IdentifierNode) and operand.value is None:
+            produced = 0
+        else:
+            return
+        chains[operand.id] = max(chains.get(operand.id, 1), chain_index(produced, cycle, initiation_interval) + 1)
+
+    used = set()
+    for info in schedule_info:
+        for operand in info.node.operands:
+            if operand is None:
+                continue
+            used.add(operand.id)
+            for cycle in read_cycles(info, intervals):
+                read(operand, cycle)
+
+    if outputs is None:
+        outputs = [info.node for info in schedule_info if info.node.id not in used]
+    for output in outputs:
+        read(output, done_state)
+    return chains
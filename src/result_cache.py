@@ -0,0 +1,150 @@
+import os
+import json
+import shutil
+import pickle
+import hashlib
+from typing import List, Optional
+
+DEFAULT_CACHE_DIR = ".hls_cache"
+DEFAULT_CACHE_SIZE = 512 * 1024 * 1024
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+OBJECT_FILE = "object.pickle"
+FILES_DIR = "files"
+
+
+def tool_version(*paths : str) -> str:
+    '''
+        Hash of the sources of this package and of the given files, so a cache entry is never reused by another
+        version of the tool.
+    '''
+    digest = hashlib.sha256()
+    sources = sorted(os.path.join(PACKAGE_DIR, name) for name in os.listdir(PACKAGE_DIR) if name.endswith(".py"))
+    for path in sources + list(paths):
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def written_files(folder_path : str, since : float, exclude : tuple = ("input.json",)) -> List[str]:
+    '''
+        Paths relative to folder_path of the files modified at or after the time since (seconds, as time.time()).
+    '''
+    files = []
+    for directory, _, names in os.walk(folder_path):
+        for name in names:
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, folder_path).replace(os.sep, "/")
+            if relative not in exclude and os.stat(path).st_mtime >= since:
+                files.append(relative)
+    return sorted(files)
+
+
+class ResultCache:
+    '''
+        Persistent, content-addressed cache of pipeline results shared by all runs and batch workers.
+
+        An entry is a directory named by the hash of its key, holding copies of the files a stage wrote into the
+        design folder and optionally one pickled object (e.g. a DFGStore). Entries are written to a temporary
+        directory and renamed into place, so concurrent workers never see half-written entries. Every hit touches
+        the entry, and after every store the least recently used entries are removed until the cache is at most
+        max_bytes large. Pickles are loaded as they are, so the cache directory must not be shared with untrusted users.
+    '''
+
+    def __init__(self, directory : str = DEFAULT_CACHE_DIR, max_bytes : int = DEFAULT_CACHE_SIZE, version : str = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = version if version is not None else tool_version()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, *parts) -> str:
+        '''
+            Hash of the JSON of parts and the tool version.
+        '''
+        text = json.dumps([self.version, *parts], sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def _entry_path(self, key : str) -> str:
+        return os.path.join(self.directory, key)
+
+    def restore(self, key : str, folder_path : str) -> Optional[tuple]:
+        '''
+            Copies the files of an entry back into folder_path. Returns (files, object) on a hit, None on a miss.
+        '''
+        entry = self._entry_path(key)
+        try:
+            files_dir = os.path.join(entry, FILES_DIR)
+            files = [os.path.relpath(os.path.join(directory, name), files_dir).replace(os.sep, "/")
+                     for directory, _, names in os.walk(files_dir) for name in names]
+            value = None
+            if os.path.exists(os.path.join(entry, OBJECT_FILE)):
+                with open(os.path.join(entry, OBJECT_FILE), "rb") as file:
+                    value = pickle.load(file)
+            for relative in files:
+                target = os.path.join(folder_path, relative)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                # a fresh modification time, the restored files are written by this run
+                shutil.copyfile(os.path.join(files_dir, relative), target)
+            os.utime(entry)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            # missing, or evicted by another process while it was read
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return files, value
+
+    def store(self, key : str, folder_path : str, files : List[str], value = None) -> None:
+        '''
+            Stores copies of files (relative to folder_path) and value under key, then evicts old entries.
+        '''
+        entry = self._entry_path(key)
+        if os.path.isdir(entry):
+            os.utime(entry)
+            return
+
+        temporary = os.path.join(self.directory, f"tmp-{key}-{os.getpid()}")
+        os.makedirs(os.path.join(temporary, FILES_DIR), exist_ok=True)
+        try:
+            for relative in files:
+                target = os.path.join(temporary, FILES_DIR, relative)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(os.path.join(folder_path, relative), target)
+            if value is not None:
+                with open(os.path.join(temporary, OBJECT_FILE), "wb") as file:
+                    pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(temporary, entry)
+        except OSError:
+            # another worker stored the same key first
+            shutil.rmtree(temporary, ignore_errors=True)
+            if not os.path.isdir(entry):
+                raise
+        self.evict()
+
+    def evict(self) -> int:
+        '''
+            Removes the least recently used entries until the cache fits in max_bytes. Returns how many were removed.
+        '''
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            entry = os.path.join(self.directory, name)
+            if name.startswith("tmp-") or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(directory, file_name))
+                           for directory, _, names in os.walk(entry) for file_name in names)
+                entries.append((os.stat(entry).st_mtime, size, entry))
+            except OSError:
+                continue
+            total += size
+
+        removed = 0
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
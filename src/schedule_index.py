@@ -0,0 +1,62 @@
+from collections import defaultdict
+from .dfg_creator import OperatorNode
+from .scheduler import ScheduledNodeInfo, ScheduleView
+from .register_allocation import value_lifetimes, left_edge, read_cycles
+from typing import Dict, List, Tuple
+
+
+class ScheduleIndex(ScheduleView):
+    '''
+        Everything the code generators, the visualizers and save_result look up in a finished (and bound) schedule,
+        built in one pass over schedule_info. On top of the ScheduleView tables it holds:
+            by_unit        - {unit name: infos it runs, by node id}, a unit name is op_type + resource_num
+            unit_latencies - {unit name: cycles of its longest operation}
+            finish         - {node id: last cycle of the operation}, max_time the last cycle of the schedule
+            reads_at       - {cycle: (info, cycle) of the operations reading their operands in it}
+            finished_at    - {cycle: infos whose result is written at its end}
+            roots          - ids of the operators no other operator reads
+        Register lifetimes and the left-edge register of every node depend on which nodes are outputs, they are
+        computed on first use and kept per set of outputs.
+    '''
+
+    def __init__(self, schedule_info : List[ScheduledNodeInfo], intervals : dict = None, root_id : int = None):
+        super().__init__(root_id=root_id, schedule_info=schedule_info)
+        self.intervals = intervals or {}
+
+        self.by_unit : Dict[str, List[ScheduledNodeInfo]] = defaultdict(list)
+        self.finish : Dict[int, int] = {}
+        self.reads_at : Dict[int, List[tuple]] = defaultdict(list)
+        self.finished_at : Dict[int, List[ScheduledNodeInfo]] = defaultdict(list)
+        used = set()
+        for info in sorted(schedule_info, key=lambda x: x.node.id):
+            self.by_unit[f"{info.node.op_type}{info.resource_num}"].append(info)
+            self.finish[info.node.id] = info.scheduled_time + info.duration_cycles - 1
+            for cycle in read_cycles(info, self.intervals):
+                self.reads_at[cycle].append((info, cycle))
+            self.finished_at[self.finish[info.node.id]].append(info)
+            used.update(operand.id for operand in info.node.operands if isinstance(operand, OperatorNode))
+
+        self.unit_latencies = {unit: max(info.duration_cycles for info in infos) for unit, infos in self.by_unit.items()}
+        self.max_time = max(self.finish.values(), default=0)
+        self.roots = [node_id for node_id in self.finish if node_id not in used]
+
+        self._lifetimes : Dict[tuple, Dict[int, Tuple[int, int]]] = {}
+        self._registers : Dict[tuple, Dict[int, int]] = {}
+
+    def lifetimes(self, outputs : List[int] = None) -> Dict[int, Tuple[int, int]]:
+        '''
+            value_lifetimes of the schedule with the given output node ids (by default the roots).
+        '''
+        key = tuple(outputs) if outputs is not None else None
+        if key not in self._lifetimes:
+            self._lifetimes[key] = value_lifetimes(self.schedule_info, self.intervals, outputs=outputs)
+        return self._lifetimes[key]
+
+    def registers(self, outputs : List[int] = None) -> Dict[int, int]:
+        '''
+            {node id: register index} of the left-edge allocation of lifetimes(outputs).
+        '''
+        key = tuple(outputs) if outputs is not None else None
+        if key not in self._registers:
+            self._registers[key] = left_edge(self.lifetimes(outputs))
+        return self._registers[key]
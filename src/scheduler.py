@@ -1,8 +1,27 @@
+import math
+import heapq
 from abc import ABC, abstractmethod
-from .dfg_creator import BaseNode, OperatorNode, resource_allocator, OP_TYPES
-from typing import List
+from collections import defaultdict
+from .dfg_creator import BaseNode, OperatorNode, resource_allocator, OP_TYPES, OP_DELAYS
+from .dfg_analysis import DFGAnalysis
+from typing import Callable, Iterable, List, Optional
+
+def chained_latencies(latencies : dict = None, clock_period : float = None, delays : dict = None) -> dict:
+    '''
+        latencies completed for a clock_period (ns): a resource type without a latency of its own whose delay (delays
+        over OP_DELAYS) is longer than the period takes ceil(delay / clock_period) cycles.
+    '''
+    latencies = dict(latencies or {})
+    if clock_period is not None:
+        for resource_type, delay in {**OP_DELAYS, **(delays or {})}.items():
+            if resource_type not in latencies and delay > clock_period:
+                latencies[resource_type] = math.ceil(delay / clock_period)
+    return latencies
+
 
 class ScheduledNodeInfo:
+    __slots__ = ("node", "scheduled_time", "duration_cycles", "resource_num")
+
     def __init__(self, node : OperatorNode, scheduled_time : int, resource_num : int, duration_cycles :int = 1):
         self.node = node
         self.scheduled_time = scheduled_time
@@ -10,27 +29,200 @@ class ScheduledNodeInfo:
         self.resource_num = resource_num
 
 
+class ScheduleView:
+    '''
+        Read-only view of a finished schedule, built once and shared by the visualizers.
+        Holds an id -> ScheduledNodeInfo index, so looking up a node is O(1) instead of a scan of schedule_info.
+    '''
+
+    def __init__(self, root_id : int, schedule_info : List[ScheduledNodeInfo]):
+        self.root_id = root_id
+        self.schedule_info = schedule_info
+        self.by_id : dict[int, ScheduledNodeInfo] = {info.node.id: info for info in schedule_info}
+        self.by_time : dict[int, List[ScheduledNodeInfo]] = defaultdict(list)
+        for info in schedule_info:
+            self.by_time[info.scheduled_time].append(info)
+
+    def get(self, node_id : int) -> Optional[ScheduledNodeInfo]:
+        '''
+            Returns the scheduling information of a node, or None for IdentifierNodes.
+        '''
+        return self.by_id.get(node_id)
+
+    def cycles(self) -> List[int]:
+        '''
+            Returns the clock cycles that have at least one scheduled node, in ascending order.
+        '''
+        return sorted(time for time, infos in self.by_time.items() if infos)
+
+    def at_cycle(self, cycle : int) -> List[ScheduledNodeInfo]:
+        return self.by_time.get(cycle, [])
+
+    def __iter__(self):
+        return iter(self.schedule_info)
+
+    def __len__(self) -> int:
+        return len(self.schedule_info)
+
+
+class ReadyList:
+    '''
+        Event-driven frontier of a DFG.
+        Keeps the number of unscheduled operator operands of every node and an index of its successors.
+        A node is pushed into the ready heap of its resource type in the cycle after its last operand finishes,
+        so each cycle only costs as much as the work it schedules instead of a rescan of the whole graph.
+
+        With a clock_period (ns), operations are chained: a node whose operands are all single-cycle and finished
+        by the current cycle becomes ready in the same cycle if the path delay through its operands and itself still
+        fits in the period. delays gives the combinational delay of every resource type that can be chained.
+    '''
+
+    def __init__(self, nodes : Iterable[OperatorNode], key : Callable[[OperatorNode], int],
+                 delays : dict = None, clock_period : float = None):
+        self.key = key
+        self.delays = delays or {}
+        self.clock_period = clock_period
+        # {node id: (cycle it was scheduled in, ns into that cycle its result is ready)}, single-cycle nodes only
+        self.arrivals : dict[int, tuple] = {}
+        self.pending_operands : dict[int, int] = {}
+        self.successors : dict[int, List[OperatorNode]] = defaultdict(list)
+        self.heaps : dict[str, list] = {}
+        self.cycle = 0
+        # {cycle: nodes whose operands have all finished by then}
+        self.releases : dict[int, List[OperatorNode]] = defaultdict(list)
+        self.ready_cycles : dict[int, int] = {}
+
+        for node in nodes:
+            count = 0
+            for operand in node.operands:
+                if isinstance(operand, OperatorNode):
+                    count += 1
+                    self.successors[operand.id].append(node)
+
+            self.pending_operands[node.id] = count
+            if count == 0:
+                self.releases[1].append(node)
+
+    def advance(self) -> None:
+        '''
+            Starts the next cycle and moves the nodes that become ready in it into their ready heaps.
+            Ties on the key are broken by descending node id so schedules are reproducible.
+        '''
+        self.cycle += 1
+        for node in self.releases.pop(self.cycle, ()):
+            self._push(node)
+
+    def _push(self, node : OperatorNode) -> None:
+        resource_type = resource_allocator(node)
+        if resource_type not in self.heaps:
+            self.heaps[resource_type] = []
+        heapq.heappush(self.heaps[resource_type], (self.key(node), -node.id, node))
+
+    @property
+    def chaining(self) -> bool:
+        return self.clock_period is not None
+
+    def _chained_arrival(self, node : OperatorNode) -> float:
+        '''
+            Time into the current cycle at which the operands of node are all available; 0 if they come from registers.
+        '''
+        arrival = 0.0
+        for operand in node.operands:
+            if isinstance(operand, OperatorNode) and operand.id in self.arrivals:
+                cycle, ready = self.arrivals[operand.id]
+                if cycle == self.cycle:
+                    arrival = max(arrival, ready)
+        return arrival
+
+    def complete(self, node : OperatorNode, duration_cycles : int = 1) -> None:
+        '''
+            Records that node is scheduled in the current cycle and takes duration_cycles cycles.
+            Successors become ready in the cycle after their last operand finishes, or in this cycle if they can be chained.
+        '''
+        finish = self.cycle + duration_cycles
+        if self.chaining and duration_cycles == 1:
+            self.arrivals[node.id] = (self.cycle, self._chained_arrival(node) + self.delays.get(node.op_type, 0.0))
+
+        for successor in self.successors.get(node.id, ()):
+            self.pending_operands[successor.id] -= 1
+            self.ready_cycles[successor.id] = max(self.ready_cycles.get(successor.id, 0), finish)
+            if self.pending_operands[successor.id] == 0:
+                ready_cycle = self.ready_cycles.pop(successor.id)
+                if self.chaining and ready_cycle == self.cycle + 1 and successor.op_type in self.delays and \
+                        all(not isinstance(operand, OperatorNode) or operand.id in self.arrivals for operand in successor.operands) and \
+                        self._chained_arrival(successor) + self.delays.get(successor.op_type, 0.0) <= self.clock_period:
+                    self._push(successor)
+                else:
+                    self.releases[ready_cycle].append(successor)
+
+    def has_pending(self) -> bool:
+        '''
+            True if some nodes wait for operands that are still being computed.
+        '''
+        return bool(self.releases)
+
+    def resource_types(self) -> List[str]:
+        return [resource_type for resource_type, heap in self.heaps.items() if heap]
+
+    def has_ready(self, resource_type : str) -> bool:
+        return bool(self.heaps.get(resource_type))
+
+    def peek(self, resource_type : str) -> OperatorNode:
+        return self.heaps[resource_type][0][2]
+
+    def pop(self, resource_type : str) -> OperatorNode:
+        return heapq.heappop(self.heaps[resource_type])[2]
+
+    def __len__(self) -> int:
+        return sum(len(heap) for heap in self.heaps.values())
+
+
 class ListScheduler(ABC):
+    '''
+        latencies - cycles an operation of a resource type takes, 1 for missing types
+        intervals - initiation interval of a resource type, i.e. cycles between two operations started on the same
+                    unit; pipelined units have an interval below their latency. Defaults to the latency (not pipelined).
+        clock_period - if given (ns), dependent single-cycle operations are chained into one cycle while their
+                    accumulated delay fits; delays overrides the per-type delays of OP_DELAYS. A type slower than
+                    the period gets a latency of ceil(delay / clock_period) unless latencies has one for it.
+    '''
     
-    def __init__(self, dfg_root : BaseNode, numof_reources : dict):
+    def __init__(self, dfg_root : BaseNode, numof_reources : dict, analysis : DFGAnalysis = None,
+                 latencies : dict = None, intervals : dict = None, clock_period : float = None, delays : dict = None):
         self.root = dfg_root
         if numof_reources is None:
             self.numof_resources = {op: 1 for op in OP_TYPES}
         else:
             self.numof_resources = numof_reources
 
+        self.latencies = chained_latencies(latencies, clock_period, delays)
+        self.intervals = intervals or {}
+        self.clock_period = clock_period
+        self.delays = {**OP_DELAYS, **(delays or {})}
+        # {resource_type: [last cycle every unit is busy]}
+        self.busy_until : dict[str, List[int]] = defaultdict(list)
+
         self.scheduled_nodes_info : List[ScheduledNodeInfo] = []
-        self.min_latency = 0
         
-        self.nodes :set[OperatorNode] = set()
-        self.priorities = {}
-        self.scheduled_ids = set()
+        # the analysis only depends on the DFG, so it can be shared between several scheduler runs
+        self.analysis = analysis if analysis is not None else DFGAnalysis(dfg_root, latencies=self.latencies)
+        self.min_latency = self.analysis.min_latency
         
-        self._get_all_nodes(self.root)
-        self._calculate_priorities()
+        self.nodes : List[OperatorNode] = self.analysis.nodes
+        self.priorities : List[int] = self.analysis.priorities
+        self.scheduled_ids = set()
+        self.ready_list : ReadyList = None
         
         self.current_time = 1
 
+        if clock_period is not None:
+            # only a latency given for a type can be too short
+            for node in self.nodes:
+                delay = self.delays.get(node.op_type, 0.0)
+                if self._get_latency(node) * clock_period < delay:
+                    raise ValueError(f"a {node.op_type} operation takes {delay} ns and does not fit in its Latency of "
+                                     f"{self._get_latency(node)} cycles of {clock_period} ns, raise or remove the Latency")
+
     def _mark_as_scheduled(self, node: OperatorNode, res_idx: int, duration_cycles: int = 1):
         '''
             For a node, records its execution cycle and index of the resource to be executed on.
@@ -38,75 +230,58 @@ class ListScheduler(ABC):
         recorded_info = ScheduledNodeInfo(node=node, scheduled_time=self.current_time, resource_num=res_idx, duration_cycles=duration_cycles)
         self.scheduled_nodes_info.append(recorded_info)
         self.scheduled_ids.add(node.id)
+        self.ready_list.complete(node, duration_cycles)
         
+    def _get_latency(self, node : OperatorNode) -> int:
+        return self.latencies.get(node.op_type, 1)
 
-    def _get_all_nodes(self, root: BaseNode) -> None:
+    def _free_units(self, resource_type : str) -> List[int]:
         '''
-            Recursively collects all OperatorNodes in the DFG starting from root.
+            Returns the 0-based indices of the units of resource_type that can start an operation in the current cycle.
         '''
-        if isinstance(root, OperatorNode):
-            self.nodes.add(root)
-        
-            for child in root.operands:
-                if child is not None:
-                    self._get_all_nodes(child)    
-    
+        busy_until = self.busy_until[resource_type]
+        return [index for index in range(self.numof_resources.get(resource_type, 0))
+                if index >= len(busy_until) or busy_until[index] < self.current_time]
+
+    def _occupy_unit(self, resource_type : str, index : int) -> None:
+        '''
+            Marks a unit as busy for the initiation interval of its resource type, starting in the current cycle.
+        '''
+        busy_until = self.busy_until[resource_type]
+        while len(busy_until) <= index:
+            busy_until.append(0)
+        interval = self.intervals.get(resource_type, self.latencies.get(resource_type, 1))
+        busy_until[index] = self.current_time + interval - 1
+
+    def _units_in_use(self) -> bool:
+        return any(cycle >= self.current_time for busy_until in self.busy_until.values() for cycle in busy_until)
+
+
     def _get_node_priority(self, node: OperatorNode) -> int:
         '''
             Returns the priority of a node.
         '''
-        return self.priorities.get(node.id, 0)
+        return self.priorities[node.id]
 
-    def _calculate_priorities(self) -> dict[int, int]:
+    @abstractmethod
+    def _get_ready_key(self, node : OperatorNode) -> int:
         '''
-            Calculates priorities for each node based on its distance from the root.
-            The priority is defined as the length of the longest path from the node to any leaf node.
+            Returns the key a ready node is ordered by inside its resource type; smaller keys are selected first.
         '''
-        def assign_levels(node : BaseNode, level : int):
-             
-            if not isinstance(node, OperatorNode):
-                self.min_latency =  max(self.min_latency, level + 1)
-                return
-
-            if node.id in self.priorities:
-                self.priorities[node.id] = max(self.priorities[node.id], level)
-            else:
-                self.priorities[node.id] = level
-
-            for child in node.operands:
-                assign_levels(child, level + 1)
+        pass
 
-        assign_levels(self.root, 0)
-    
-    def _find_candidate_nodes(self) -> List[OperatorNode]:
+    def _build_ready_list(self) -> None:
         '''
-            Returns a list of nodes that are ready to execute at the time.
-            Operands of these nodes are either an IdentifierNode or the result of an already executed OperatorNode.
+            Creates the ready list over all nodes. Nodes without operator operands are ready in the first cycle.
         '''
-        candidates = []
-        
-        for node in self.nodes:
- 
-            if node.id in self.scheduled_ids:
-                continue
-                
-            is_ready = True
-            for operand in node.operands:                
-                if isinstance(operand, OperatorNode):
-                    if operand.id not in self.scheduled_ids:
-                        is_ready = False
-                        break
-                        
-            if is_ready:
-                candidates.append(node)
-                
-        return candidates
-    
+        # a multi-cycle unit reads its operands for several cycles, so only single-cycle types are chained
+        chained_delays = {resource_type: delay for resource_type, delay in self.delays.items() if self.latencies.get(resource_type, 1) == 1}
+        self.ready_list = ReadyList(self.nodes, key=self._get_ready_key, delays=chained_delays, clock_period=self.clock_period)
+
     @abstractmethod
-    def _select_from_frontier(self, frontier : list[OperatorNode]) -> List[OperatorNode]:
+    def _select_from_frontier(self) -> List[OperatorNode]:
         '''
-            Based on the algorithm, it selects nodes from frontier to be executed on the currently available resources.
-            Frontier is the output of find_candidate_nodes.
+            Based on the algorithm, it selects nodes from the ready list to be executed on the currently available resources.
         '''
         pass
 
@@ -127,68 +302,81 @@ class ListScheduler(ABC):
 
 class MinResourceScheduler(ListScheduler):
     
-    def __init__(self, dfg_root : BaseNode, numof_resources : dict, max_time : int):
+    def __init__(self, dfg_root : BaseNode, numof_resources : dict, max_time : int, analysis : DFGAnalysis = None,
+                 latencies : dict = None, intervals : dict = None, clock_period : float = None, delays : dict = None):
         
-        super().__init__(dfg_root=dfg_root, numof_reources=numof_resources)
+        super().__init__(dfg_root=dfg_root, numof_reources=numof_resources, analysis=analysis, latencies=latencies, intervals=intervals,
+                         clock_period=clock_period, delays=delays)
         self.max_time = max_time
-        self.latest_times : dict[int : int] = {}  
+        self.latest_times : List[int] = []
 
         self._find_latest_times()
         
     def _get_node_slack(self, node: OperatorNode) -> int:
-        return self.latest_times.get(node.id, self.max_time) - self.current_time
+        return self.latest_times[node.id] - self.current_time
 
     def _find_latest_times(self):
-        for node in self.nodes:
-            p = self._get_node_priority(node)
-            self.latest_times[node.id] = self.max_time - p
+        self.latest_times = self.analysis.alap(self.max_time)
             
-    def _select_from_frontier(self, frontier: List[OperatorNode]) -> List[OperatorNode]:
-        frontier.sort(key=self._get_node_slack)
-        return frontier
+    def _get_ready_key(self, node: OperatorNode) -> int:
+        # slack only differs from the latest time by the current cycle, so the heap order stays valid
+        return self.latest_times[node.id]
+
+    def _select_from_frontier(self) -> List[OperatorNode]:
+        '''
+            Pops, per resource type, the nodes that either fit the free units or have no slack left.
+        '''
+        selected_nodes = []
+        for resource_type in self.ready_list.resource_types():
+            available_count = len(self._free_units(resource_type))
+
+            while self.ready_list.has_ready(resource_type):
+                node = self.ready_list.peek(resource_type)
+                if available_count <= 0 and self._get_node_slack(node) > 0:
+                    break
+
+                selected_nodes.append(self.ready_list.pop(resource_type))
+                available_count -= 1
 
+        return selected_nodes
     
     def schedule(self) -> None:
         
-        # {cycle: {resource_type: count}}
-        resource_usage_per_cycle = {}
+        self._build_ready_list()
 
         while len(self.scheduled_ids) < len(self.nodes):
             
             if self.current_time > self.max_time:
                 raise RuntimeError("schedule need more cycle!!!")
             
-            if self.current_time not in resource_usage_per_cycle:
-                resource_usage_per_cycle[self.current_time] = {op: 0 for op in OP_TYPES}
-            
-            candidates = self._find_candidate_nodes()
-            
-            sorted_candidates = self._select_from_frontier(candidates)
+            self.ready_list.advance()
             
-            for node in sorted_candidates:
-                
-                resource_type = resource_allocator(node)
-                current_res_count = resource_usage_per_cycle[self.current_time][resource_type]
-                
-                slack = self._get_node_slack(node)
-                
-                if current_res_count < self.numof_resources.get(resource_type, 1):
-                    resource_usage_per_cycle[self.current_time][resource_type] += 1
-                    self._mark_as_scheduled(
-                        node=node,
-                        res_idx=resource_usage_per_cycle[self.current_time][resource_type]
-                    )
-                
-                elif slack > 0 :
-                    pass
+            # with chaining, scheduling a node can make its successors ready in the same cycle
+            selected = self._select_from_frontier()
+            while selected:
+                for node in selected:
                     
-                elif slack <= 0:
-                    self.numof_resources[resource_type] += 1
-                    resource_usage_per_cycle[self.current_time][resource_type] += 1
+                    resource_type = resource_allocator(node)
+                    duration_cycles = self._get_latency(node)
+                    if self.current_time + duration_cycles - 1 > self.max_time:
+                        raise RuntimeError("schedule need more cycle!!!")
+
+                    free_units = self._free_units(resource_type)
+                    if free_units:
+                        index = free_units[0]
+                    else:
+                        # no slack left and every unit is busy, so one more unit is needed
+                        index = self.numof_resources.get(resource_type, 0)
+                        self.numof_resources[resource_type] = index + 1
+
+                    self._occupy_unit(resource_type, index)
                     self._mark_as_scheduled(
                         node=node,
-                        res_idx=self.numof_resources[resource_type]
+                        res_idx=index + 1,
+                        duration_cycles=duration_cycles
                     )
+
+                selected = self._select_from_frontier() if self.ready_list.chaining else []
                     
             self.current_time += 1
             
@@ -197,61 +385,342 @@ class MinResourceScheduler(ListScheduler):
 
 class MinLatencyScheduler(ListScheduler):
     
-    def __init__(self, dfg_root: BaseNode, numof_resources: dict):
-        super().__init__(dfg_root=dfg_root, numof_reources=numof_resources)
-        self.resource_queues: dict[str, list] = {}
+    def __init__(self, dfg_root: BaseNode, numof_resources: dict, analysis : DFGAnalysis = None,
+                 latencies : dict = None, intervals : dict = None, clock_period : float = None, delays : dict = None):
+        super().__init__(dfg_root=dfg_root, numof_reources=numof_resources, analysis=analysis, latencies=latencies, intervals=intervals,
+                         clock_period=clock_period, delays=delays)
+
+    def _get_ready_key(self, node: OperatorNode) -> int:
+        return -self._get_node_priority(node)
 
-    def _select_from_frontier(self, condidates: List[OperatorNode]) -> List[OperatorNode]:
+    def _select_from_frontier(self) -> List[OperatorNode]:
         
         selected_nodes = []
-        self.resource_queues = {}
-        
-        for node in condidates:
             
-            resource_type = resource_allocator(node)
+        for resource_type in self.ready_list.resource_types():
             
-            if resource_type not in self.resource_queues:
-                self.resource_queues[resource_type] = []
-                
-            self.resource_queues[resource_type].append(node)
+            available_count = len(self._free_units(resource_type))
             
-        for resource_type, nodes in self.resource_queues.items():
-            nodes.sort(key=self._get_node_priority, reverse=True)
-            
-            available_count = self.numof_resources.get(resource_type, 0)
-            
-            nodes_to_pick = nodes[:available_count]
-            
-            selected_nodes.extend(nodes_to_pick)
+            while available_count > 0 and self.ready_list.has_ready(resource_type):
+                selected_nodes.append(self.ready_list.pop(resource_type))
+                available_count -= 1
         
         return selected_nodes
             
     def schedule(self) -> None:
         
+        self._build_ready_list()
         
         while len(self.scheduled_ids) < len(self.nodes):
             
-            resource_usage = {op: 0 for op in self.numof_resources.keys()}
+            self.ready_list.advance()
             
-            candidates = self._find_candidate_nodes()
-            
-            if (not candidates):
+            if (not self.ready_list and not self.ready_list.has_pending()):
                 raise RuntimeError("Deadlock detected or disconnected graph.")
 
             
-            selected = self._select_from_frontier(candidates)
+            selected = self._select_from_frontier()
+            
+            if (not selected and self.ready_list and not self._units_in_use()):
+                raise RuntimeError(f"No resources available for ready resource types {self.ready_list.resource_types()}.")
+
+            # with chaining, scheduling a node can make its successors ready in the same cycle
+            while selected:
+                free_units = {}
+                for node in selected:  
+                                  
+                    resource_type = resource_allocator(node)
+                    if resource_type not in self.numof_resources:
+                            raise KeyError(f"Resource '{resource_type}' required for node {node.id} but not found in numof_resources.")
+
+                    if resource_type not in free_units:
+                        free_units[resource_type] = self._free_units(resource_type)
+                    index = free_units[resource_type].pop(0)
+
+                    self._occupy_unit(resource_type, index)
+                    self._mark_as_scheduled(
+                        node=node,
+                        res_idx=index,
+                        duration_cycles=self._get_latency(node)
+                    )
 
-            for node in selected:  
-                              
+                selected = self._select_from_frontier() if self.ready_list.chaining else []
+            
+            self.current_time += 1
+
+
+class ModuloScheduler(MinLatencyScheduler):
+    '''
+        Modulo scheduling for streaming designs: one evaluation of the DFG is scheduled so that successive evaluations
+        can overlap, a new one starting every initiation interval (II) cycles.
+        Nodes are list-scheduled by priority as in MinLatencyScheduler, but units are reserved in a modulo reservation
+        table: an operation started in cycle t holds its unit in rows t mod II up to (t + interval - 1) mod II, so two
+        overlapping evaluations never use a unit in the same cycle.
+
+        The search starts at the larger of the target II and the resource bound (operations of a type times the cycles
+        each holds a unit, over the number of units) and raises the II until every node fits. Evaluations do not
+        depend on each other, so there is no recurrence bound.
+    '''
+
+    def __init__(self, dfg_root : BaseNode, numof_resources : dict, initiation_interval : int = None, analysis : DFGAnalysis = None,
+                 latencies : dict = None, intervals : dict = None):
+        super().__init__(dfg_root=dfg_root, numof_resources=numof_resources, analysis=analysis, latencies=latencies, intervals=intervals)
+        self.target_interval = initiation_interval or 1
+        self.initiation_interval : int = None
+        self.resource_bound : int = None
+        # {resource_type: [rows reserved on every unit]}
+        self.reservation_table : dict[str, List[set]] = {}
+
+    def _get_occupancy(self, resource_type : str) -> int:
+        return self.intervals.get(resource_type, self.latencies.get(resource_type, 1))
+
+    def _rows(self, resource_type : str) -> set:
+        return {(self.current_time + offset) % self.initiation_interval for offset in range(self._get_occupancy(resource_type))}
+
+    def _free_units(self, resource_type : str) -> List[int]:
+        rows = self._rows(resource_type)
+        return [index for index, reserved in enumerate(self.reservation_table.get(resource_type, [])) if not rows & reserved]
+
+    def _occupy_unit(self, resource_type : str, index : int) -> None:
+        self.reservation_table[resource_type][index] |= self._rows(resource_type)
+
+    def _try_interval(self) -> bool:
+        '''
+            Schedules all nodes with the current initiation_interval. Returns False if a node can never get a unit.
+        '''
+        self.scheduled_nodes_info = []
+        self.scheduled_ids = set()
+        self.current_time = 1
+        self.reservation_table = {resource_type: [set() for _ in range(count)] for resource_type, count in self.numof_resources.items()}
+        self._build_ready_list()
+
+        # consecutive cycles a resource type had ready nodes and placed none of them
+        stalled = defaultdict(int)
+        while len(self.scheduled_ids) < len(self.nodes):
+            self.ready_list.advance()
+
+            placed = set()
+            free_units = {}
+            for node in self._select_from_frontier():
                 resource_type = resource_allocator(node)
-                if resource_type not in resource_usage:
-                        raise KeyError(f"Resource '{resource_type}' required for node {node.id} but not found in numof_resources.")
+                if resource_type not in free_units:
+                    free_units[resource_type] = self._free_units(resource_type)
+                index = free_units[resource_type].pop(0)
+
+                self._occupy_unit(resource_type, index)
+                self._mark_as_scheduled(node=node, res_idx=index, duration_cycles=self._get_latency(node))
+                placed.add(resource_type)
+
+            for resource_type in self.ready_list.resource_types():
+                stalled[resource_type] = 0 if resource_type in placed else stalled[resource_type] + 1
+                # the table of that type has not changed for a whole period, so it never will have a free row
+                if stalled[resource_type] >= self.initiation_interval:
+                    return False
+
+            self.current_time += 1
+        return True
+
+    def schedule(self) -> None:
+        counts = {}
+        for node in self.nodes:
+            counts[node.op_type] = counts.get(node.op_type, 0) + 1
+
+        self.resource_bound = 1
+        for resource_type, count in counts.items():
+            units = self.numof_resources.get(resource_type, 0)
+            if units <= 0:
+                raise RuntimeError(f"No resources available for ready resource types ['{resource_type}'].")
+            # an operation must also leave its unit before the next evaluation starts it again
+            occupancy = self._get_occupancy(resource_type)
+            self.resource_bound = max(self.resource_bound, occupancy, math.ceil(count * occupancy / units))
+
+        self.initiation_interval = max(self.target_interval, self.resource_bound)
+        while not self._try_interval():
+            self.initiation_interval += 1
+
+
+class TimeAssignedScheduler(ListScheduler):
+    '''
+        Base of the schedulers that first choose a clock cycle for every node in _assign_times and then replay those
+        cycles through the ready list, one cycle at a time, to assign resource indices.
+        numof_resources ends up as the peak usage of every resource type.
+    '''
+
+    def __init__(self, dfg_root : BaseNode, numof_resources : dict, analysis : DFGAnalysis = None):
+        super().__init__(dfg_root=dfg_root, numof_reources=numof_resources, analysis=analysis)
+        self.assigned_times : dict[int, int] = {}
+
+    @abstractmethod
+    def _assign_times(self) -> None:
+        '''
+            Fills assigned_times with the clock cycle of every node.
+        '''
+        pass
+
+    def _get_ready_key(self, node : OperatorNode) -> int:
+        return self.assigned_times[node.id]
+
+    def _select_from_frontier(self) -> List[OperatorNode]:
+        '''
+            Pops the ready nodes whose assigned time is the current cycle.
+        '''
+        selected_nodes = []
+        for resource_type in self.ready_list.resource_types():
+            while self.ready_list.has_ready(resource_type) and \
+                    self._get_ready_key(self.ready_list.peek(resource_type)) <= self.current_time:
+                selected_nodes.append(self.ready_list.pop(resource_type))
+        return selected_nodes
+
+    def schedule(self) -> None:
+
+        self._assign_times()
+        self._build_ready_list()
+
+        while len(self.scheduled_ids) < len(self.nodes):
+
+            resource_usage = {op: 0 for op in OP_TYPES}
 
+            self.ready_list.advance()
+
+            for node in self._select_from_frontier():
+
+                resource_type = resource_allocator(node)
+                resource_usage[resource_type] = resource_usage.get(resource_type, 0) + 1
+                self.numof_resources[resource_type] = max(self.numof_resources.get(resource_type, 0), resource_usage[resource_type])
                 self._mark_as_scheduled(
                     node=node,
-                    res_idx= resource_usage[resource_type]
+                    res_idx=resource_usage[resource_type]
                 )
-            
-                resource_usage[resource_type] += 1
-            
-            self.current_time += 1
\ No newline at end of file
+
+            self.current_time += 1
+
+
+class ForceDirectedScheduler(TimeAssignedScheduler):
+    '''
+        Latency-constrained force-directed scheduling (Paulin & Knight).
+        Every unfixed node is spread uniformly over its [ASAP, ALAP] frame. The distribution graph of a resource type
+        is the sum of those probabilities per cycle, and the force of placing a node at a cycle is how much it raises
+        the distribution graphs of its own and its direct neighbours' frames. Nodes are fixed one at a time at the
+        placement with the lowest force, which evens out the operations per cycle and so the number of resources.
+
+        Forces are kept in a heap and only re-evaluated when their node reaches the top: a node is fixed once its
+        fresh force is still the smallest in the heap. Fixing a node only updates the distribution graphs over the
+        frames that shrank, so a step costs about the frame width instead of a pass over the whole DFG.
+    '''
+
+    def __init__(self, dfg_root : BaseNode, max_time : int, analysis : DFGAnalysis = None):
+        super().__init__(dfg_root=dfg_root, numof_resources={op: 0 for op in OP_TYPES}, analysis=analysis)
+        self.max_time = max_time
+
+        self.earliest : dict[int, int] = {}
+        self.latest : dict[int, int] = {}
+        self.successors : dict[int, List[OperatorNode]] = defaultdict(list)
+        self.predecessors : dict[int, List[OperatorNode]] = defaultdict(list)
+        # {resource_type: [expected number of operations in every cycle]}
+        self.distribution : dict[str, List[float]] = {}
+
+    def _spread(self, node : OperatorNode, weight : int) -> None:
+        '''
+            Adds (weight=1) or removes (weight=-1) the uniform probability of node over its frame.
+        '''
+        earliest, latest = self.earliest[node.id], self.latest[node.id]
+        share = weight / (latest - earliest + 1)
+        graph = self.distribution[node.op_type]
+        for time in range(earliest, latest + 1):
+            graph[time] += share
+
+    def _frame_load(self, node : OperatorNode, earliest : int, latest : int) -> float:
+        '''
+            Expected distribution-graph value seen by node if it were spread over [earliest, latest].
+        '''
+        graph = self.distribution[node.op_type]
+        return sum(graph[earliest:latest + 1]) / (latest - earliest + 1)
+
+    def _force(self, node : OperatorNode, time : int) -> float:
+        '''
+            Self force of fixing node at time plus the forces on the direct neighbours whose frames would shrink.
+        '''
+        earliest, latest = self.earliest[node.id], self.latest[node.id]
+        force = self.distribution[node.op_type][time] - self._frame_load(node, earliest, latest)
+
+        for successor in self.successors[node.id]:
+            if successor.id not in self.assigned_times and self.earliest[successor.id] <= time:
+                force += self._frame_load(successor, time + 1, self.latest[successor.id]) - \
+                    self._frame_load(successor, self.earliest[successor.id], self.latest[successor.id])
+
+        for predecessor in self.predecessors[node.id]:
+            if predecessor.id not in self.assigned_times and self.latest[predecessor.id] >= time:
+                force += self._frame_load(predecessor, self.earliest[predecessor.id], time - 1) - \
+                    self._frame_load(predecessor, self.earliest[predecessor.id], self.latest[predecessor.id])
+
+        return force
+
+    def _best_placement(self, node : OperatorNode) -> tuple:
+        '''
+            Returns (force, time) of the cheapest cycle in the frame of node; ties go to the earlier cycle.
+        '''
+        return min((self._force(node, time), time) for time in range(self.earliest[node.id], self.latest[node.id] + 1))
+
+    def _fix(self, node : OperatorNode, time : int) -> None:
+        '''
+            Fixes node at time and shrinks the frames of all nodes that depend on it, directly or not.
+        '''
+        self._spread(node, -1)
+        self.earliest[node.id] = self.latest[node.id] = time
+        self._spread(node, 1)
+        self.assigned_times[node.id] = time
+
+        stack = [(successor, time + 1) for successor in self.successors[node.id]]
+        while stack:
+            successor, earliest = stack.pop()
+            if self.earliest[successor.id] >= earliest:
+                continue
+            self._spread(successor, -1)
+            self.earliest[successor.id] = earliest
+            self._spread(successor, 1)
+            stack.extend((user, earliest + 1) for user in self.successors[successor.id])
+
+        stack = [(predecessor, time - 1) for predecessor in self.predecessors[node.id]]
+        while stack:
+            predecessor, latest = stack.pop()
+            if self.latest[predecessor.id] <= latest:
+                continue
+            self._spread(predecessor, -1)
+            self.latest[predecessor.id] = latest
+            self._spread(predecessor, 1)
+            stack.extend((operand, latest - 1) for operand in self.predecessors[predecessor.id])
+
+    def _assign_times(self) -> None:
+        if self.analysis.critical_path > self.max_time:
+            raise RuntimeError("schedule need more cycle!!!")
+
+        latest_times = self.analysis.alap(self.max_time)
+        for node in self.nodes:
+            self.earliest[node.id] = self.analysis.asap[node.id]
+            self.latest[node.id] = latest_times[node.id]
+            self.distribution.setdefault(node.op_type, [0.0] * (self.max_time + 2))
+            for operand in node.operands:
+                if isinstance(operand, OperatorNode):
+                    self.successors[operand.id].append(node)
+                    self.predecessors[node.id].append(operand)
+
+        for node in self.nodes:
+            self._spread(node, 1)
+
+        nodes_by_id = {node.id: node for node in self.nodes}
+        heap = [(*self._best_placement(node), node.id) for node in self.nodes]
+        heapq.heapify(heap)
+
+        while heap:
+            _, _, node_id = heapq.heappop(heap)
+            if node_id in self.assigned_times:
+                continue
+
+            node = nodes_by_id[node_id]
+            force, time = self._best_placement(node)
+            if heap and force > heap[0][0]:
+                # another node may be cheaper now, check it first
+                heapq.heappush(heap, (force, time, node_id))
+                continue
+
+            self._fix(node, time)
\ No newline at end of file
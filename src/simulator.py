@@ -0,0 +1,561 @@
+import ast
+import copy
+import time
+import contextlib
+import random
+import operator
+from .dfg_creator import BaseNode, IdentifierNode, OutputNode
+from .dfg_analysis import topological_order
+from .code_generator import VerilogGenerator, ModuloVerilogGenerator
+from .word_arithmetic import WORD_BITS, WORD_MASK, SIGN_BIT, SCALAR_OPERATIONS
+from typing import List
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# vectors simulated at once by the NumPy path, bounds the memory of the values alive at the same time
+DEFAULT_BATCH = 1 << 16
+
+# failing vectors written to the report
+MAX_EXAMPLES = 10
+
+# operations of every unit type in the order of their op select, see VerilogGenerator._functional_unit;
+# a unit of another type passes its first operand through
+UNIT_OPERATIONS = {
+    "ALU": [ast.Add, ast.Sub, ast.USub, ast.Lt, ast.LtE, ast.Gt, ast.GtE],
+    "mult": [ast.Mult, ast.FloorDiv, ast.Mod],
+    "logic": [ast.BitAnd, ast.BitOr, ast.BitXor, ast.Invert, ast.Eq, ast.NotEq],
+    "shift": [ast.LShift, ast.RShift],
+    "pow": [ast.Pow],
+}
+UNARY_OPERATIONS = (ast.USub, ast.Invert, ast.UAdd)
+
+
+def _array_operations() -> dict:
+    '''
+        SCALAR_OPERATIONS on NumPy uint32 arrays of words, whose arithmetic already wraps around like the datapath.
+    '''
+    zero = np.uint32(0)
+
+    def compare(relation):
+        return lambda a, b: relation(a ^ SIGN_BIT, b ^ SIGN_BIT).astype(np.uint32)
+
+    def divide(a, b):
+        return np.where(b == 0, zero, a // np.maximum(b, 1))
+
+    return {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.USub: lambda a, b: zero - a,
+        ast.UAdd: lambda a, b: a,
+        ast.Lt: compare(operator.lt),
+        ast.LtE: compare(operator.le),
+        ast.Gt: compare(operator.gt),
+        ast.GtE: compare(operator.ge),
+        ast.Mult: operator.mul,
+        ast.Div: divide,
+        ast.FloorDiv: divide,
+        ast.Mod: lambda a, b: np.where(b == 0, zero, a % np.maximum(b, 1)),
+        ast.Pow: np.power,
+        ast.LShift: lambda a, b: np.where(b < WORD_BITS, a << np.minimum(b, WORD_BITS - 1), zero),
+        ast.RShift: lambda a, b: np.where(b < WORD_BITS, a >> np.minimum(b, WORD_BITS - 1), zero),
+        ast.BitAnd: lambda a, b: a & b,
+        ast.BitOr: lambda a, b: a | b,
+        ast.BitXor: lambda a, b: a ^ b,
+        ast.Invert: lambda a, b: ~a,
+        ast.Eq: lambda a, b: (a == b).astype(np.uint32),
+        ast.NotEq: lambda a, b: (a != b).astype(np.uint32),
+    }
+
+
+class WordArithmetic:
+    '''
+        The operations of the datapath on words, as Python ints (one vector) or as NumPy uint32 arrays (vectorized,
+        one array element per vector).
+    '''
+
+    def __init__(self, vectorized : bool):
+        if vectorized and np is None:
+            raise ImportError("the vectorized simulator needs numpy")
+        self.vectorized = vectorized
+        self.operations = _array_operations() if vectorized else SCALAR_OPERATIONS
+
+    def constant(self, value : int):
+        if not isinstance(value, int):
+            raise ValueError(f"{value!r} is not an integer, the datapath only computes on {WORD_BITS}-bit words")
+        return np.uint32(value & WORD_MASK) if self.vectorized else value & WORD_MASK
+
+    def wrapping(self):
+        '''
+            Context in which words wrap around silently, NumPy warns when a uint32 scalar (a constant) overflows.
+        '''
+        return np.errstate(over="ignore") if self.vectorized else contextlib.nullcontext()
+
+    def random_generator(self, seed : int = 0):
+        return np.random.default_rng(seed) if self.vectorized else random.Random(seed)
+
+    def random_inputs(self, names : List[str], rng, count : int) -> dict:
+        '''
+            {name: array of count random words}, or {name: word} of one vector without vectorized. Half of the words
+            are any word and half are small (0 to 15), so comparisons, divisions, shifts and powers see interesting operands.
+        '''
+        if self.vectorized:
+            inputs = {}
+            for name in names:
+                wide = rng.integers(0, 1 << WORD_BITS, size=count, dtype=np.uint32)
+                small = rng.integers(0, 16, size=count, dtype=np.uint32)
+                inputs[name] = np.where(rng.random(count) < 0.5, wide, small)
+            return inputs
+        return {name: rng.getrandbits(WORD_BITS) if rng.random() < 0.5 else rng.randrange(16) for name in names}
+
+
+class Word:
+    '''
+        A value of the Expression: a word, or an array of words, with the arithmetic of the datapath. Python ints
+        it meets (the constants of the Expression) are truncated to words.
+    '''
+    __slots__ = ("value", "arithmetic")
+
+    def __init__(self, value, arithmetic : WordArithmetic):
+        self.value = value
+        self.arithmetic = arithmetic
+
+    def _apply(self, op, left, right):
+        operands = []
+        for operand in (left, right):
+            if isinstance(operand, Word):
+                operands.append(operand.value)
+            elif isinstance(operand, int):
+                operands.append(self.arithmetic.constant(operand))
+            else:
+                return NotImplemented
+        return Word(self.arithmetic.operations[op](*operands), self.arithmetic)
+
+    def __bool__(self):
+        # chained comparisons are nested by _word_expression, only and, or, not and if would get here
+        raise ValueError("the datapath has no boolean operators, and, or, not and if can not be evaluated")
+
+    __hash__ = None
+
+    def __neg__(self):
+        return self._apply(ast.USub, self, 0)
+
+    def __pos__(self):
+        return self
+
+    def __invert__(self):
+        return self._apply(ast.Invert, self, 0)
+
+
+def _binary_method(op, reflected : bool):
+    if reflected:
+        return lambda self, other: self._apply(op, other, self)
+    return lambda self, other: self._apply(op, self, other)
+
+
+for _op, _name in [(ast.Add, "add"), (ast.Sub, "sub"), (ast.Mult, "mul"), (ast.Div, "truediv"),
+                   (ast.FloorDiv, "floordiv"), (ast.Mod, "mod"), (ast.Pow, "pow"), (ast.LShift, "lshift"),
+                   (ast.RShift, "rshift"), (ast.BitAnd, "and"), (ast.BitOr, "or"), (ast.BitXor, "xor")]:
+    setattr(Word, f"__{_name}__", _binary_method(_op, reflected=False))
+    setattr(Word, f"__r{_name}__", _binary_method(_op, reflected=True))
+# 1 < x is evaluated as x > 1, so the comparisons need no reflected methods
+for _op, _name in [(ast.Lt, "lt"), (ast.LtE, "le"), (ast.Gt, "gt"), (ast.GtE, "ge"), (ast.Eq, "eq"), (ast.NotEq, "ne")]:
+    setattr(Word, f"__{_name}__", _binary_method(_op, reflected=False))
+
+
+def _word_expression(tree : ast.AST, constant) -> ast.Expression:
+    '''
+        A copy of the expression tree for eval on Words, every constant replaced by the name constant(value) returns,
+        so subexpressions of constants only are computed on words too: (1 - 2) // 2 is 0x7FFFFFFF as in the datapath,
+        not -1. Chained comparisons are nested as GraphBuilder builds them, a < b < c is (a < b) < c and not
+        a < b and b < c. The tree is copied node by node without recursion, deep expressions are no deeper for eval.
+    '''
+    def rewrite(node):
+        if isinstance(node, ast.Constant):
+            return ast.copy_location(ast.Name(id=constant(node.value), ctx=ast.Load()), node)
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                left = ast.copy_location(ast.Compare(left=left, ops=[op], comparators=[right]), node)
+            return left
+        return copy.copy(node)
+
+    expression = ast.Expression(body=rewrite(tree))
+    stack = [expression.body]
+    while stack:
+        node = stack.pop()
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, ast.AST):
+                value = rewrite(value)
+                stack.append(value)
+            elif isinstance(value, list):
+                value = [rewrite(item) if isinstance(item, ast.AST) else item for item in value]
+                stack.extend(item for item in value if isinstance(item, ast.AST))
+            else:
+                continue
+            setattr(node, field, value)
+    return ast.fix_missing_locations(expression)
+
+
+class ReferenceModel:
+    '''
+        The Expression evaluated with Python's eval on Words. trees is what expression_to_graph returns: the AST of
+        a single expression, whose output is "result", or a list of (name, AST) assignments evaluated in order.
+    '''
+
+    def __init__(self, trees, arithmetic : WordArithmetic):
+        self.arithmetic = arithmetic
+        assignments = trees if isinstance(trees, list) else [("result", trees)]
+
+        # {name: Word} of the constants of the Expression
+        self.constants = {}
+        names = {}
+        def constant(value) -> str:
+            if value not in names:
+                names[value] = f"__constant{len(names)}"
+                self.constants[names[value]] = Word(arithmetic.constant(value), arithmetic)
+            return names[value]
+
+        try:
+            self.assignments = [(name, compile(_word_expression(tree, constant), "<Expression>", "eval"))
+                                for name, tree in assignments]
+        except RecursionError:
+            raise ValueError("the Expression is too deep for Python's eval") from None
+
+        # a name read before it is assigned is an input of the DFG too
+        self.inputs = sorted({node.id for _, tree in assignments for node in ast.walk(tree) if isinstance(node, ast.Name)})
+
+    def evaluate(self, inputs : dict) -> dict:
+        '''
+            {name: words} of every assigned name (of "result"), from {input name: words}.
+        '''
+        namespace = dict(self.constants)
+        namespace.update((name, Word(value, self.arithmetic)) for name, value in inputs.items())
+        results = {}
+        with self.arithmetic.wrapping():
+            for name, code in self.assignments:
+                value = eval(code, {"__builtins__": {}}, namespace)
+                namespace[name] = value
+                results[name] = value.value
+        return results
+
+
+def evaluate_dfg(outputs : List[tuple], inputs : dict, arithmetic : WordArithmetic = None) -> dict:
+    '''
+        {output name: words} of a DFG evaluated operator by operator, without any schedule. outputs is a list of
+        (name, node) as VerilogGenerator.outputs, inputs is {input name: words}; by default one vector of ints.
+    '''
+    arithmetic = arithmetic or WordArithmetic(vectorized=False)
+    values = {}
+
+    def value(node : BaseNode):
+        if isinstance(node, IdentifierNode):
+            return inputs[node.name] if node.value is None else arithmetic.constant(node.value)
+        return values[node.id]
+
+    root = OutputNode(names=[name for name, _ in outputs], roots=[node for _, node in outputs], id=-1)
+    with arithmetic.wrapping():
+        for node in topological_order(root):
+            left = value(node.operands[0])
+            right = value(node.operands[1]) if node.operands[1] is not None else left
+            values[node.id] = arithmetic.operations[type(node.op)](left, right)
+    return {name: value(node) for name, node in outputs}
+
+
+class DatapathSimulator:
+    '''
+        Cycle-accurate model of the datapath and controller a VerilogGenerator emits, run directly on its tables.
+        In every cycle of the schedule the control word of the state drives the op and mux selects of the units,
+        and at its end every register whose enable is set takes the output of the unit its write select picks. In
+        the done state the output ports take their sources. A pipelined unit outputs the result of its inputs
+        latency - 1 cycles earlier. A unit that is not pipelined is a multicycle path, its op and operands must stay
+        the same for the latency cycles ending in the cycle a register takes its output; vectors where an operand
+        changes are hazards, and so are all vectors when the op select changes (static_hazards).
+
+        Only values a register or an output depends on are computed. The model is compiled once into a straight-line
+        program over value slots, run on Python ints one vector at a time or on NumPy arrays of a whole batch of
+        vectors (vectorized, the default when NumPy is installed). Modulo schedules are not supported, their
+        evaluations overlap.
+    '''
+
+    def __init__(self, generator : VerilogGenerator, vectorized : bool = None):
+        if isinstance(generator, ModuloVerilogGenerator):
+            raise ValueError("the simulator does not model the overlapping evaluations of a modulo schedule")
+        if vectorized is None:
+            vectorized = np is not None
+
+        self.generator = generator
+        self.arithmetic = WordArithmetic(vectorized)
+        self.inputs = sorted(generator.inputs)
+        self.outputs = [name for name, _ in generator.outputs]
+        self.static_hazards : List[str] = []
+        self._compile()
+
+    def _compile(self):
+        generator = self.generator
+        operations = self.arithmetic.operations
+        copy = operations[ast.UAdd]
+
+        # virtual slots, numbered in the order they are created; constants, inputs and registers are fixed slots
+        slot_count = 0
+        def new_slot():
+            nonlocal slot_count
+            slot_count += 1
+            return slot_count - 1
+
+        constants = {}
+        def constant(value : int) -> int:
+            if value not in constants:
+                constants[value] = new_slot()
+            return constants[value]
+
+        inputs = {name: new_slot() for name in self.inputs}
+        registers = {name: new_slot() for name in generator.register_writers}
+        hazard = new_slot()
+        zero = constant(0)
+        program = []
+
+        def source_slot(source : str, cycle : int):
+            if source in inputs:
+                return inputs[source]
+            if source in registers:
+                # the register as it is in cycle, it is written again later
+                slot = new_slot()
+                program.append((slot, copy, registers[source], registers[source]))
+                return slot
+            if source.endswith("_out") and source[:-len("_out")] in generator.resources:
+                return unit_output(source[:-len("_out")], cycle)
+            negative = source.startswith("-")
+            literal = source.lstrip("-")
+            if not literal.startswith(f"{WORD_BITS}'d"):
+                raise ValueError(f"unknown source {source}")
+            value = int(literal[len(f"{WORD_BITS}'d"):])
+            return constant(-value if negative else value)
+
+        words = {}
+        def control(cycle : int) -> dict:
+            if cycle not in words:
+                words[cycle] = generator.control_word(cycle)
+            return words[cycle]
+
+        sources = {res: [{sel: src for src, sel in generator.mux_tables[res][op_idx].items()} for op_idx in [0, 1]]
+                   for res in generator.resources}
+
+        def operation(res : str, cycle : int):
+            unit_type = generator.resources[res][0].node.op_type
+            codes = UNIT_OPERATIONS.get(unit_type, [ast.UAdd])
+            code = control(cycle).get(f"{res}_op", 0)
+            return codes[code] if code < len(codes) else None
+
+        operands = {}
+        def operand(res : str, op_idx : int, cycle : int) -> int:
+            key = (res, op_idx, cycle)
+            if key not in operands:
+                sel = control(cycle).get(f"{res}_sel{op_idx + 1}", 0)
+                source = sources[res][op_idx].get(sel)
+                operands[key] = source_slot(source, cycle) if source is not None else zero
+            return operands[key]
+
+        results = {}
+        def unit_result(res : str, cycle : int) -> int:
+            key = (res, cycle)
+            if key in results:
+                if results[key] is None:
+                    raise ValueError(f"combinational loop through {res} in cycle {cycle}")
+                return results[key]
+            results[key] = None
+            op = operation(res, cycle)
+            if op is None:
+                slot = zero
+            else:
+                first = operand(res, 0, cycle)
+                second = first if op in UNARY_OPERATIONS else operand(res, 1, cycle)
+                slot = new_slot()
+                program.append((slot, operations[op], first, second))
+            results[key] = slot
+            return slot
+
+        def unit_output(res : str, cycle : int) -> int:
+            if not generator._is_pipelined(res):
+                return unit_result(res, cycle)
+            issued = cycle - generator.unit_latencies[res] + 1
+            # stage registers have no reset, nothing correct reads them before the first issue
+            return results[(res, issued)] if issued >= 1 else zero
+
+        # a pipelined unit is read latency - 1 cycles after it computes, its results are computed in the cycle
+        # they are issued in, while the registers still hold what it read
+        pipelined_reads = {}
+        def read_unit(res : str, cycle : int):
+            if generator._is_pipelined(res):
+                pipelined_reads.setdefault(cycle - generator.unit_latencies[res] + 1, set()).add(res)
+
+        for cycle in range(1, generator.index.max_time + 1):
+            for reg_name, writers in generator.register_writers.items():
+                if control(cycle).get(f"{reg_name}_en", 0):
+                    read_unit(writers[control(cycle).get(f"{reg_name}_wsel", 0)], cycle)
+            for res in generator.resources:
+                for op_idx in [0, 1]:
+                    source = sources[res][op_idx].get(control(cycle).get(f"{res}_sel{op_idx + 1}", 0), "")
+                    if source.endswith("_out") and source[:-len("_out")] in generator.resources:
+                        read_unit(source[:-len("_out")], cycle)
+
+        for cycle in range(1, generator.index.max_time + 1):
+            for res in sorted(pipelined_reads.get(cycle, ())):
+                unit_result(res, cycle)
+
+            writes = []
+            for reg_name, writers in generator.register_writers.items():
+                if not control(cycle).get(f"{reg_name}_en", 0):
+                    continue
+                res = writers[control(cycle).get(f"{reg_name}_wsel", 0)]
+                writes.append((registers[reg_name], unit_output(res, cycle)))
+
+                latency = generator.unit_latencies[res]
+                if generator._is_pipelined(res) or latency == 1:
+                    continue
+                op = operation(res, cycle)
+                for held in range(max(1, cycle - latency + 1), cycle):
+                    if operation(res, held) != op:
+                        self.static_hazards.append(f"{res} changes its op in cycle {held} before {reg_name} takes it in cycle {cycle}")
+                    for op_idx in ([0] if op in UNARY_OPERATIONS else [0, 1]):
+                        before, after = operand(res, op_idx, held), operand(res, op_idx, cycle)
+                        if before != after:
+                            differs = new_slot()
+                            program.append((differs, operator.ne, before, after))
+                            program.append((hazard, operator.or_, hazard, differs))
+
+            # registers are written at the clock edge, after everything in the cycle has read them
+            for register, slot in writes:
+                program.append((register, copy, slot, slot))
+
+        outputs = {}
+        for name, node in generator.outputs:
+            outputs[name] = new_slot()
+            source = generator._get_operand_source(node)
+            slot = registers[source] if source in registers else source_slot(source, generator.index.max_time + 1)
+            program.append((outputs[name], copy, slot, slot))
+
+        fixed = set(constants.values()) | set(inputs.values()) | set(registers.values()) | set(outputs.values()) | {hazard}
+        self._allocate_slots(program, slot_count, fixed)
+        self._constants = {self._slot_map[slot]: value for value, slot in constants.items()}
+        self._inputs = {name: self._slot_map[slot] for name, slot in inputs.items()}
+        self._registers = [self._slot_map[slot] for slot in registers.values()]
+        self._outputs = {name: self._slot_map[slot] for name, slot in outputs.items()}
+        self._hazard = self._slot_map[hazard]
+
+    def _allocate_slots(self, program : list, slot_count : int, fixed : set):
+        '''
+            Renumbers the virtual slots of program so that values that are not alive at the same time share a slot,
+            as register allocation does; fixed slots keep a slot of their own.
+        '''
+        last_use = {}
+        for step, (_, _, first, second) in enumerate(program):
+            last_use[first] = step
+            last_use[second] = step
+
+        self._slot_map = {slot: index for index, slot in enumerate(sorted(fixed))}
+        free = []
+        size = len(fixed)
+        self.program = []
+        for step, (dest, function, first, second) in enumerate(program):
+            first, second = self._slot_map[first], self._slot_map[second]
+            # the operands are read before dest is written, so dest may take the slot of an operand that dies here
+            for slot in {program[step][2], program[step][3]}:
+                if slot not in fixed and last_use[slot] == step:
+                    free.append(self._slot_map[slot])
+            if dest not in self._slot_map:
+                if free:
+                    self._slot_map[dest] = free.pop()
+                else:
+                    self._slot_map[dest] = size
+                    size += 1
+            self.program.append((self._slot_map[dest], function, first, second))
+            if dest not in fixed and dest not in last_use:
+                free.append(self._slot_map[dest])
+        self.slot_count = size
+
+    def run(self, inputs : dict):
+        '''
+            Runs the design on {input name: word}, or on {input name: array of words} when vectorized.
+            Returns ({output name: words}, hazards), hazards True (or a bool array) where a multicycle unit
+            lost its operands.
+        '''
+        values = [None] * self.slot_count
+        for slot, value in self._constants.items():
+            values[slot] = self.arithmetic.constant(value)
+        for slot in self._registers:
+            values[slot] = self.arithmetic.constant(0)
+        for name, slot in self._inputs.items():
+            values[slot] = inputs[name]
+        values[self._hazard] = False
+
+        with self.arithmetic.wrapping():
+            for dest, function, first, second in self.program:
+                values[dest] = function(values[first], values[second])
+        return {name: values[slot] for name, slot in self._outputs.items()}, values[self._hazard]
+
+
+def verify_design(generator : VerilogGenerator, trees, count : int, seed : int = 0, vectorized : bool = None,
+                  batch : int = DEFAULT_BATCH) -> dict:
+    '''
+        Simulates the design on count random input vectors and compares its outputs with the Expression evaluated
+        by Python's eval on words (see ReferenceModel). trees is what expression_to_graph returns for the Expression.
+        Returns a report: the number of vectors, failures (wrong outputs or hazards) and hazards, the static hazards,
+        the speed and up to MAX_EXAMPLES failing vectors.
+    '''
+    simulator = DatapathSimulator(generator, vectorized=vectorized)
+    arithmetic = simulator.arithmetic
+    reference = ReferenceModel(trees, arithmetic)
+    names = sorted(set(reference.inputs) | set(simulator.inputs))
+
+    start = time.perf_counter()
+    failures = 0
+    hazards = 0
+    examples = []
+    rng = arithmetic.random_generator(seed)
+    # one vector at a time without NumPy
+    step = batch if arithmetic.vectorized else 1
+    for first in range(0, count, step):
+        size = min(step, count - first)
+        vectors = arithmetic.random_inputs(names, rng, size)
+
+        simulated, hazard = simulator.run(vectors)
+        expected = reference.evaluate(vectors)
+        failed = hazard
+        for name in simulator.outputs:
+            failed = failed | (simulated[name] != expected[name])
+
+        if arithmetic.vectorized:
+            failed = np.broadcast_to(failed, (size,))
+            hazards += int(np.count_nonzero(hazard))
+            failures += int(np.count_nonzero(failed))
+            indices = np.flatnonzero(failed)[:MAX_EXAMPLES - len(examples)]
+        else:
+            hazards += int(hazard)
+            failures += int(failed)
+            indices = [0] if failed and len(examples) < MAX_EXAMPLES else []
+
+        for index in indices:
+            def pick(value):
+                return int(np.broadcast_to(value, failed.shape)[index]) if arithmetic.vectorized else value
+            examples.append({
+                "inputs": {name: pick(value) for name, value in vectors.items()},
+                "expected": {name: pick(expected[name]) for name in simulator.outputs},
+                "simulated": {name: pick(simulated[name]) for name in simulator.outputs},
+            })
+    seconds = time.perf_counter() - start
+
+    if simulator.static_hazards:
+        failures = count
+    return {
+        "vectors": count,
+        "failures": failures,
+        "hazards": hazards,
+        "static_hazards": simulator.static_hazards,
+        "vectorized": arithmetic.vectorized,
+        "seconds": seconds,
+        "vectors_per_second": count / seconds if seconds > 0 else None,
+        "examples": examples,
+    }
@@ -0,0 +1,132 @@
+import os
+from .code_generator import VerilogGenerator, ModuloVerilogGenerator, write_lines
+from .simulator import WordArithmetic, evaluate_dfg, WORD_BITS
+
+# half period of the testbench clock in ns
+CLOCK_HALF_PERIOD = 5
+
+# the last line a testbench prints, parsed by verilog_runner
+RESULT_FORMAT = "{status} vectors=%0d errors=%0d cycles=%0d"
+
+
+def testbench_lines(generator : VerilogGenerator, count : int = 100, seed : int = 0):
+    '''
+        Lines of a self-checking testbench of the datapath and controller of generator. It applies count random
+        input vectors one after the other, or a new one whenever the controller is ready for a modulo schedule,
+        compares every output with the value of the DFG (evaluate_dfg) when done is raised, and ends with
+        "PASS vectors=N errors=0 cycles=C" or "FAIL ...", C the clock cycles from reset to the last result.
+        A testbench that has not finished after a generous number of cycles fails with "timeout".
+    '''
+    pipelined = isinstance(generator, ModuloVerilogGenerator)
+    inputs = sorted(generator.inputs)
+    outputs = [name for name, _ in generator.outputs]
+    control_ports = generator.control_ports()
+
+    arithmetic = WordArithmetic(vectorized=False)
+    rng = arithmetic.random_generator(seed)
+    vectors = []
+    for _ in range(count):
+        vector = arithmetic.random_inputs(inputs, rng, 1)
+        vectors.append((vector, evaluate_dfg(generator.outputs, vector, arithmetic)))
+
+    # an evaluation takes the schedule, the start and the done state
+    timeout = count * (generator.index.max_time + 3) + 10
+
+    yield "`timescale 1ns/1ps"
+    yield f"// Self-checking testbench, {count} random vectors with the outputs of the DFG"
+    yield "module testbench;\n"
+    yield f"localparam VECTORS = {count};"
+    yield f"localparam TIMEOUT = {timeout};\n"
+
+    yield "reg clk = 0;"
+    yield "reg rst = 0;"
+    yield f"always #{CLOCK_HALF_PERIOD} clk = ~clk;\n"
+
+    yield "// Input vectors and expected outputs"
+    for name in inputs:
+        yield f"reg [{WORD_BITS - 1}:0] vec_{name} [0:VECTORS - 1];"
+    for name in outputs:
+        yield f"reg [{WORD_BITS - 1}:0] exp_{name} [0:VECTORS - 1];"
+    yield "initial begin"
+    for index, (vector, expected) in enumerate(vectors):
+        assignments = [f"vec_{name}[{index}] = {WORD_BITS}'d{vector[name]};" for name in inputs]
+        assignments += [f"exp_{name}[{index}] = {WORD_BITS}'d{expected[name]};" for name in outputs]
+        yield "  " + " ".join(assignments)
+    yield "end\n"
+
+    yield "integer issued = 0;   // evaluations started"
+    yield "integer checked = 0;  // evaluations whose outputs were compared"
+    yield "integer errors = 0;"
+    yield "integer cycles = 0;\n"
+
+    yield "wire op_ready, done;"
+    for name, width in control_ports:
+        yield f"wire [{width - 1}:0] {name};" if width > 1 else f"wire {name};"
+    for name in outputs:
+        yield f"wire [{WORD_BITS - 1}:0] {name};"
+    if pipelined:
+        yield "// a new evaluation whenever the controller is ready, the inputs are sampled when it starts"
+        yield "wire start = issued < VECTORS;"
+        current = "issued"
+    else:
+        yield "// one evaluation at a time, the datapath reads the inputs while it runs"
+        yield "wire start = (issued == checked) && (checked < VECTORS);"
+        current = "checked"
+    for name in inputs:
+        yield f"wire [{WORD_BITS - 1}:0] {name} = vec_{name}[{current}];"
+
+    connections = ["clk", "rst"] + inputs + [name for name, _ in control_ports] + outputs + ["done"]
+    yield "\ndatapath dut_datapath ("
+    yield ",\n".join(f"  .{name}({name})" for name in connections)
+    yield ");\n"
+    connections = ["clk", "rst", "start", "op_ready"] + [name for name, _ in control_ports]
+    yield "controller dut_controller ("
+    yield ",\n".join(f"  .{name}({name})" for name in connections)
+    yield ");\n"
+
+    yield "// an edge on the asynchronous reset at time 0, then two clock cycles in reset"
+    yield "initial begin"
+    yield "  rst = 1;"
+    yield "  repeat (2) @(posedge clk);"
+    yield "  rst <= 0;"
+    yield "end\n"
+
+    yield "always @(posedge clk) begin"
+    yield "  if (!rst) begin"
+    yield "    cycles <= cycles + 1;"
+    yield "    if (op_ready && start) issued <= issued + 1;"
+    yield "    if (done) begin"
+    for name in outputs:
+        yield f"      if ({name} !== exp_{name}[checked]) begin"
+        yield "        errors = errors + 1;"
+        yield f'        $display("vector %0d: {name} = %0d, expected %0d", checked, {name}, exp_{name}[checked]);'
+        yield "      end"
+    yield "      checked <= checked + 1;"
+    yield "      if (checked == VECTORS - 1) begin"
+    yield f'        if (errors == 0) $display("{RESULT_FORMAT.format(status="PASS")}", VECTORS, errors, cycles + 1);'
+    yield f'        else $display("{RESULT_FORMAT.format(status="FAIL")}", VECTORS, errors, cycles + 1);'
+    yield "        $finish;"
+    yield "      end"
+    yield "    end"
+    yield "  end"
+    yield "end\n"
+
+    yield "initial begin"
+    yield f"  #({2 * CLOCK_HALF_PERIOD} * TIMEOUT);"
+    yield f'  $display("{RESULT_FORMAT.format(status="FAIL")} timeout", VECTORS, errors + VECTORS - checked, cycles);'
+    yield "  $finish;"
+    yield "end\n"
+    yield "endmodule"
+
+
+def write_testbench(folder_path : str, generator : VerilogGenerator, count : int = 100, seed : int = 0) -> str:
+    '''
+        Writes codes/Testbench.v next to the datapath and controller of generator and returns its path.
+    '''
+    output_dir = os.path.join(folder_path, "codes")
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, "Testbench.v")
+    with open(path, "w") as file:
+        write_lines(file, testbench_lines(generator, count=count, seed=seed))
+    print(f"Testbench generated ({count} vectors)")
+    return path
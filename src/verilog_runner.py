@@ -0,0 +1,135 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .result_cache import ResultCache
+from typing import List
+
+# sources of a design in its codes folder, the testbench first
+VERILOG_SOURCES = ("Testbench.v", "Datapath.v", "Controller.v")
+# compiled testbench, relative to the design folder
+COMPILED_FILE = "codes/testbench.vvp"
+
+# last line of a testbench, see testbench.RESULT_FORMAT
+RESULT_PATTERN = re.compile(r"(PASS|FAIL) vectors=(\d+) errors=(\d+) cycles=(\d+)")
+
+# seconds a simulation may take
+DEFAULT_TIMEOUT = 600
+
+
+def require_tools(*tools : str) -> None:
+    '''
+        Raises FileNotFoundError if one of the tools is not on the PATH.
+    '''
+    for tool in tools:
+        if shutil.which(tool) is None:
+            raise FileNotFoundError(f"{tool} is not installed or not on the PATH")
+
+
+def simulator_version(iverilog : str = "iverilog") -> str:
+    '''
+        Version line of iverilog. Compiled testbenches are cached per simulator version.
+    '''
+    require_tools(iverilog)
+    result = subprocess.run([iverilog, "-V"], capture_output=True, text=True)
+    lines = (result.stdout or result.stderr).splitlines()
+    return lines[0] if lines else iverilog
+
+
+def design_hash(paths : List[str]) -> str:
+    '''
+        Hash of the contents of the given files, in order.
+    '''
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as file:
+            digest.update(file.read())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def run_testbench(folder_path : str, cache : ResultCache = None, iverilog : str = "iverilog", vvp : str = "vvp",
+                  timeout : float = DEFAULT_TIMEOUT) -> dict:
+    '''
+        Compiles codes/Testbench.v of a design with its datapath and controller, unless the cache holds the
+        compiled testbench of the same sources, and runs it with vvp. Returns the status ("passed", "failed",
+        "skipped" without a testbench) with the vectors, errors and clock cycles the testbench reported, and
+        whether it was compiled; reports errors instead of raising, so one design does not abort the others.
+    '''
+    start = time.perf_counter()
+    status = {"folder": folder_path}
+    sources = [os.path.join(folder_path, "codes", name) for name in VERILOG_SOURCES]
+    compiled = os.path.join(folder_path, COMPILED_FILE)
+
+    try:
+        if not os.path.exists(sources[0]):
+            status.update(status="skipped", error="no codes/Testbench.v, set the Testbench key of the config")
+            return status
+
+        key = cache.key("testbench", design_hash(sources)) if cache is not None else None
+        status["compiled"] = cache is None or cache.restore(key, folder_path) is None
+        if status["compiled"]:
+            result = subprocess.run([iverilog, "-s", "testbench", "-o", compiled] + sources, capture_output=True, text=True)
+            if result.returncode != 0:
+                status.update(status="failed", error=f"iverilog: {result.stderr.strip() or result.stdout.strip()}")
+                return status
+            if cache is not None:
+                cache.store(key, folder_path, [COMPILED_FILE])
+
+        result = subprocess.run([vvp, "-n", compiled], capture_output=True, text=True, timeout=timeout)
+        matches = RESULT_PATTERN.findall(result.stdout)
+        if not matches:
+            status.update(status="failed", error=f"vvp: no result line\n{result.stdout[-2000:]}{result.stderr[-2000:]}")
+            return status
+
+        verdict, vectors, errors, cycles = matches[-1]
+        status.update(status="passed" if verdict == "PASS" else "failed", vectors=int(vectors), errors=int(errors), cycles=int(cycles))
+        if verdict != "PASS":
+            status["error"] = result.stdout[-2000:]
+    except (OSError, subprocess.SubprocessError) as e:
+        status.update(status="failed", error=f"{type(e).__name__}: {e}")
+    finally:
+        status["wall_time"] = round(time.perf_counter() - start, 3)
+    return status
+
+
+def run_testbenches(folder_paths : List[str], workers : int = None, cache : ResultCache = None,
+                    summary_path : str = "testbench_summary.json", iverilog : str = "iverilog", vvp : str = "vvp") -> dict:
+    '''
+        Runs the testbenches of many designs in parallel. Compiling and simulating happen in iverilog and vvp
+        processes, so threads are enough to keep workers of them busy. Writes a summary with the status of every
+        design to summary_path.
+    '''
+    require_tools(iverilog, vvp)
+
+    start = time.perf_counter()
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_testbench, folder, cache, iverilog, vvp): folder for folder in folder_paths}
+        for future in as_completed(futures):
+            folder = futures[future]
+            results[folder] = future.result()
+            cycles = f" ({results[folder]['cycles']} cycles)" if "cycles" in results[folder] else ""
+            print(f"[{results[folder]['status']}] {folder}{cycles}")
+
+    folders = [results[folder] for folder in folder_paths]
+    counts = {name: sum(1 for result in folders if result["status"] == name) for name in ("passed", "failed", "skipped")}
+    summary = {
+        "total": len(folders),
+        **counts,
+        "compiled": sum(1 for result in folders if result.get("compiled")),
+        "cycles": sum(result.get("cycles", 0) for result in folders),
+        "wall_time": round(time.perf_counter() - start, 3),
+        "folders": folders,
+    }
+
+    with open(summary_path, "w") as file:
+        json.dump(summary, file, indent=4)
+
+    print(f"Testbenches done: {summary['passed']}/{summary['total']} passed, {summary['compiled']} compiled, "
+          f"summary written to {summary_path}")
+    return summary
@@ -0,0 +1,32 @@
+import ast
+
+# the arithmetic of the datapath on words, shared by constant folding (dfg_optimizer) and the simulator
+WORD_BITS = 32
+WORD_MASK = (1 << WORD_BITS) - 1
+# flipping the sign bit maps the signed order onto the unsigned one, the comparisons of the ALU are signed
+SIGN_BIT = 1 << (WORD_BITS - 1)
+
+# x / 0 and x % 0 are 0, the mult unit of the generated datapath checks for a zero divisor (Verilog gives all x)
+SCALAR_OPERATIONS = {
+    ast.Add: lambda a, b: (a + b) & WORD_MASK,
+    ast.Sub: lambda a, b: (a - b) & WORD_MASK,
+    ast.USub: lambda a, b: -a & WORD_MASK,
+    ast.UAdd: lambda a, b: a,
+    ast.Lt: lambda a, b: int((a ^ SIGN_BIT) < (b ^ SIGN_BIT)),
+    ast.LtE: lambda a, b: int((a ^ SIGN_BIT) <= (b ^ SIGN_BIT)),
+    ast.Gt: lambda a, b: int((a ^ SIGN_BIT) > (b ^ SIGN_BIT)),
+    ast.GtE: lambda a, b: int((a ^ SIGN_BIT) >= (b ^ SIGN_BIT)),
+    ast.Mult: lambda a, b: (a * b) & WORD_MASK,
+    ast.Div: lambda a, b: a // b if b else 0,
+    ast.FloorDiv: lambda a, b: a // b if b else 0,
+    ast.Mod: lambda a, b: a % b if b else 0,
+    ast.Pow: lambda a, b: pow(a, b, 1 << WORD_BITS),
+    ast.LShift: lambda a, b: (a << b) & WORD_MASK if b < WORD_BITS else 0,
+    ast.RShift: lambda a, b: a >> b,
+    ast.BitAnd: lambda a, b: a & b,
+    ast.BitOr: lambda a, b: a | b,
+    ast.BitXor: lambda a, b: a ^ b,
+    ast.Invert: lambda a, b: ~a & WORD_MASK,
+    ast.Eq: lambda a, b: int(a == b),
+    ast.NotEq: lambda a, b: int(a != b),
+}